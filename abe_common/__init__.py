@@ -0,0 +1,4 @@
+"""
+Module dùng chung giữa các project của repo (không phải Django app).
+Project không nằm ở thư mục gốc (Auth Center, Resource Server) thêm thư mục gốc của repo vào sys.path trong settings.
+"""
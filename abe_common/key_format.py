@@ -0,0 +1,273 @@
+"""
+Định dạng nhị phân có version cho key CP-ABE (PK, MSK, SK, transformation key), thay cho pickle.
+Dùng chung cho project chính (backend) và Auth Center.
+
+Layout (big-endian):
+    header:      MAGIC b'ABEK' | version u8 | kind u8 | group_len u8 | group (ASCII) | field_count u16
+    field table: name_len u8 | name (ASCII) | type u8 | offset u32 | length u32   (mỗi field một mục)
+    data:        giá trị các field, offset tính từ đầu data section
+
+Kiểu giá trị:
+    ELEMENT          element
+    ELEMENT_LIST     count u16 | element...
+    ELEMENT_MAP      count u16 | (key_len u8 | key UTF-8 | element)...
+    INT              int64
+    STR              UTF-8
+    STR_LIST         count u16 | (len u16 | UTF-8)...
+    INT_LIST         count u16 | int64...                      (v2, vd. attr_list số nguyên của Waters11)
+    MIXED_LIST       count u16 | (type u8 | len u32 | value)... (v2, vd. h = [0, h_1, ..., h_n] của Waters11)
+    ELEMENT_INT_MAP  count u16 | (key int64 | element)...      (v2, vd. K của SK sinh từ attribute số nguyên)
+element: tag u8 (loại group của charm, hoặc TAG_RAW) | len u16 | bytes nén (không base64)
+
+Kiểu của item trong list và của key trong map được giữ nguyên khi decode, nên dict decode ra
+dùng được trực tiếp với Waters11 (pk['h'][int(attr)], key['K'][attr]).
+Version 1 chỉ dùng 6 kiểu đầu và vẫn đọc được.
+
+Loader đọc trên memoryview nên không copy dữ liệu trừ bytes của từng element.
+"""
+import base64
+import struct
+
+MAGIC = b'ABEK'
+FORMAT_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+
+KIND_PUBLIC_KEY = 1
+KIND_MASTER_KEY = 2
+KIND_SECRET_KEY = 3
+KIND_TRANSFORM_KEY = 4  # SK đã blind cho outsourced decryption
+
+TYPE_ELEMENT = 1
+TYPE_ELEMENT_LIST = 2
+TYPE_ELEMENT_MAP = 3
+TYPE_INT = 4
+TYPE_STR = 5
+TYPE_STR_LIST = 6
+TYPE_INT_LIST = 7
+TYPE_MIXED_LIST = 8
+TYPE_ELEMENT_INT_MAP = 9
+
+# Element charm không có dạng "<tag>:<base64>" được lưu nguyên
+TAG_RAW = 0xFF
+
+_HEADER = struct.Struct('>4sBBB')
+_U8 = struct.Struct('>B')
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_I64 = struct.Struct('>q')
+_FIELD = struct.Struct('>BII')  # type, offset, length
+
+# Giá trị Python không phải element của charm
+_PLAIN_TYPES = (bool, int, float, str, bytes, list, tuple, dict, type(None))
+
+
+class KeyFormatError(ValueError):
+    """Dữ liệu không đúng định dạng key nhị phân"""
+
+
+def is_binary_key(data):
+    """True nếu data (bytes/memoryview) bắt đầu bằng MAGIC của định dạng này"""
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# ==================== ENCODING ====================
+
+def _encode_element(group, element):
+    if isinstance(element, _PLAIN_TYPES):
+        raise KeyFormatError(f"Unsupported value of type {type(element).__name__}")
+    serialized = group.serialize(element)
+    tag, separator, payload = serialized.partition(b':')
+    if separator and tag.isdigit():
+        tag, raw = int(tag), base64.b64decode(payload)
+    else:
+        tag, raw = TAG_RAW, serialized
+    return _U8.pack(tag) + _U16.pack(len(raw)) + raw
+
+
+def _encode_str(value):
+    data = value.encode('utf-8')
+    return _U16.pack(len(data)) + data
+
+
+def _encode_list(group, value):
+    count = _U16.pack(len(value))
+    if value and all(isinstance(item, str) for item in value):
+        return TYPE_STR_LIST, count + b''.join(_encode_str(item) for item in value)
+    if value and all(_is_int(item) for item in value):
+        return TYPE_INT_LIST, count + b''.join(_I64.pack(item) for item in value)
+    if not any(isinstance(item, _PLAIN_TYPES) for item in value):
+        return TYPE_ELEMENT_LIST, count + b''.join(_encode_element(group, item) for item in value)
+    # List trộn số nguyên và element (h của Waters11): mỗi item mang kiểu riêng
+    parts = [count]
+    for item in value:
+        item_type, payload = _encode_value(group, item)
+        parts.append(_U8.pack(item_type) + _U32.pack(len(payload)) + payload)
+    return TYPE_MIXED_LIST, b''.join(parts)
+
+
+def _encode_map(group, value):
+    parts = [_U16.pack(len(value))]
+    if all(_is_int(key) for key in value):
+        for key, element in value.items():
+            parts.append(_I64.pack(key) + _encode_element(group, element))
+        return TYPE_ELEMENT_INT_MAP, b''.join(parts)
+    if all(isinstance(key, str) for key in value):
+        for key, element in value.items():
+            key_bytes = key.encode('utf-8')
+            parts.append(_U8.pack(len(key_bytes)) + key_bytes + _encode_element(group, element))
+        return TYPE_ELEMENT_MAP, b''.join(parts)
+    raise KeyFormatError("Map keys must be all str or all int")
+
+
+def _encode_value(group, value):
+    if isinstance(value, bool):
+        raise KeyFormatError("Boolean values are not supported")
+    if isinstance(value, int):
+        return TYPE_INT, _I64.pack(value)
+    if isinstance(value, str):
+        return TYPE_STR, value.encode('utf-8')
+    if isinstance(value, (list, tuple)):
+        return _encode_list(group, value)
+    if isinstance(value, dict):
+        return _encode_map(group, value)
+    return TYPE_ELEMENT, _encode_element(group, value)
+
+
+def encode_key(group, kind, key):
+    """Encode dict key của charm (PK/MSK/SK) thành bytes"""
+    group_name = str(group.groupType()).encode('ascii')
+    table = []
+    data = []
+    offset = 0
+    for name, value in key.items():
+        value_type, payload = _encode_value(group, value)
+        name_bytes = name.encode('ascii')
+        table.append(_U8.pack(len(name_bytes)) + name_bytes + _FIELD.pack(value_type, offset, len(payload)))
+        data.append(payload)
+        offset += len(payload)
+
+    header = (
+        _HEADER.pack(MAGIC, FORMAT_VERSION, kind, len(group_name)) + group_name
+        + _U16.pack(len(table))
+    )
+    return header + b''.join(table) + b''.join(data)
+
+
+# ==================== DECODING ====================
+
+def _decode_element(group, view, position):
+    tag, = _U8.unpack_from(view, position)
+    length, = _U16.unpack_from(view, position + 1)
+    start = position + 3
+    raw = bytes(view[start:start + length])
+    if tag == TAG_RAW:
+        serialized = raw
+    else:
+        serialized = str(tag).encode('ascii') + b':' + base64.b64encode(raw)
+    return group.deserialize(serialized), start + length
+
+
+def _decode_value(group, value_type, view):
+    if value_type == TYPE_ELEMENT:
+        return _decode_element(group, view, 0)[0]
+    if value_type == TYPE_INT:
+        return _I64.unpack_from(view, 0)[0]
+    if value_type == TYPE_STR:
+        return bytes(view).decode('utf-8')
+
+    count, = _U16.unpack_from(view, 0)
+    position = 2
+    if value_type == TYPE_STR_LIST:
+        items = []
+        for _ in range(count):
+            length, = _U16.unpack_from(view, position)
+            position += 2
+            items.append(bytes(view[position:position + length]).decode('utf-8'))
+            position += length
+        return items
+    if value_type == TYPE_INT_LIST:
+        return [_I64.unpack_from(view, position + index * _I64.size)[0] for index in range(count)]
+    if value_type == TYPE_ELEMENT_LIST:
+        items = []
+        for _ in range(count):
+            element, position = _decode_element(group, view, position)
+            items.append(element)
+        return items
+    if value_type == TYPE_MIXED_LIST:
+        items = []
+        for _ in range(count):
+            item_type, = _U8.unpack_from(view, position)
+            length, = _U32.unpack_from(view, position + 1)
+            position += 1 + _U32.size
+            items.append(_decode_value(group, item_type, view[position:position + length]))
+            position += length
+        return items
+    if value_type == TYPE_ELEMENT_MAP:
+        items = {}
+        for _ in range(count):
+            key_length, = _U8.unpack_from(view, position)
+            position += 1
+            key = bytes(view[position:position + key_length]).decode('utf-8')
+            element, position = _decode_element(group, view, position + key_length)
+            items[key] = element
+        return items
+    if value_type == TYPE_ELEMENT_INT_MAP:
+        items = {}
+        for _ in range(count):
+            key, = _I64.unpack_from(view, position)
+            element, position = _decode_element(group, view, position + _I64.size)
+            items[key] = element
+        return items
+    raise KeyFormatError(f"Unknown value type {value_type}")
+
+
+def read_header(data):
+    """(version, kind, group name) của key nhị phân"""
+    view = memoryview(data)
+    magic, version, kind, group_length = _HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise KeyFormatError("Not a binary CP-ABE key")
+    if version not in SUPPORTED_VERSIONS:
+        raise KeyFormatError(f"Unsupported key format version {version}")
+    group_name = bytes(view[_HEADER.size:_HEADER.size + group_length]).decode('ascii')
+    return version, kind, group_name
+
+
+def decode_key(group, data, expected_kind=None):
+    """Decode bytes (hoặc memoryview/mmap) thành dict key của charm"""
+    view = memoryview(data)
+    try:
+        _, kind, group_name = read_header(view)
+        if expected_kind is not None and kind != expected_kind:
+            raise KeyFormatError(f"Expected key kind {expected_kind}, found {kind}")
+        if group_name != str(group.groupType()):
+            raise KeyFormatError(f"Key was generated for group {group_name}, not {group.groupType()}")
+
+        position = _HEADER.size + len(group_name)
+        field_count, = _U16.unpack_from(view, position)
+        position += 2
+
+        fields = []
+        for _ in range(field_count):
+            name_length, = _U8.unpack_from(view, position)
+            position += 1
+            name = bytes(view[position:position + name_length]).decode('ascii')
+            position += name_length
+            value_type, offset, length = _FIELD.unpack_from(view, position)
+            position += _FIELD.size
+            fields.append((name, value_type, offset, length))
+
+        data_start = position
+        key = {}
+        for name, value_type, offset, length in fields:
+            start = data_start + offset
+            if start + length > len(view):
+                raise KeyFormatError(f"Field {name} is truncated")
+            key[name] = _decode_value(group, value_type, view[start:start + length])
+        return key
+    except struct.error as e:
+        raise KeyFormatError(f"Truncated key data: {e}") from e
@@ -0,0 +1,204 @@
+"""
+Metrics độ trễ cho hot path (crypto, policy check, DB), xuất ở dạng Prometheus text tại /metrics.
+Dùng chung cho project chính, Auth Center và Resource Server.
+
+- MetricsMiddleware: histogram thời gian request và thời gian/số query DB theo view
+- timed('operation'): decorator/context manager đo một thao tác (keygen, policy check, ...)
+
+Khi chạy nhiều worker (gunicorn), đặt PROMETHEUS_MULTIPROC_DIR trước khi load app
+(gunicorn.conf.py của các project đã làm): mỗi worker ghi metrics vào file trong thư mục đó
+và /metrics tổng hợp từ tất cả worker (prometheus_client multiprocess mode), nên counter
+không bị lùi và p95/p99 tính trên toàn bộ request. Không đặt biến này (runserver) thì
+metrics nằm trong memory của process.
+"""
+import os
+import time
+from contextlib import ExitStack
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Bucket (giây) đủ chi tiết cho cả thao tác ms (policy check) lẫn keygen/pairing chậm
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+PROMETHEUS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+MULTIPROCESS_DIR_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+
+REQUEST_DURATION = 'http_request_duration_seconds'
+REQUEST_DB_DURATION = 'http_request_db_duration_seconds'
+REQUEST_DB_QUERIES = 'http_request_db_queries_total'
+OPERATION_DURATION = 'operation_duration_seconds'
+OPERATION_ERRORS = 'operation_errors_total'
+CACHE_LOOKUPS = 'cache_lookups_total'
+
+# Registry của process (không dùng multiprocess mode)
+_registry = CollectorRegistry()
+
+_metrics = {
+    REQUEST_DURATION: Histogram(
+        REQUEST_DURATION, 'Thời gian xử lý request theo view',
+        ('view', 'method', 'status'), buckets=DEFAULT_BUCKETS, registry=_registry,
+    ),
+    REQUEST_DB_DURATION: Histogram(
+        REQUEST_DB_DURATION, 'Tổng thời gian query DB trong một request theo view',
+        ('view',), buckets=DEFAULT_BUCKETS, registry=_registry,
+    ),
+    REQUEST_DB_QUERIES: Counter(
+        REQUEST_DB_QUERIES, 'Số query DB theo view', ('view',), registry=_registry,
+    ),
+    OPERATION_DURATION: Histogram(
+        OPERATION_DURATION, 'Thời gian của thao tác được đo bằng timed()',
+        ('operation',), buckets=DEFAULT_BUCKETS, registry=_registry,
+    ),
+    OPERATION_ERRORS: Counter(
+        OPERATION_ERRORS, 'Số lần thao tác được đo bằng timed() raise exception', ('operation',), registry=_registry,
+    ),
+    CACHE_LOOKUPS: Counter(
+        CACHE_LOOKUPS, 'Số lần tra cache trong memory theo cache và kết quả (hit/miss)',
+        ('cache', 'result'), registry=_registry,
+    ),
+}
+
+
+def observe(name, value, **labels):
+    """Ghi một giá trị (giây) vào histogram name với labels"""
+    _metrics[name].labels(**labels).observe(value)
+
+
+def increment(name, value=1, **labels):
+    """Tăng counter name với labels"""
+    _metrics[name].labels(**labels).inc(value)
+
+
+class timed:
+    """
+    Đo thời gian một thao tác vào operation_duration_seconds{operation=...}.
+    Dùng được như context manager (with timed('keygen')) hoặc decorator (@timed('keygen'))
+    cho cả hàm thường lẫn coroutine function (async view).
+    """
+    __slots__ = ('operation', 'started')
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and issubclass(exc_type, Exception):
+            increment(OPERATION_ERRORS, operation=self.operation)
+        observe(OPERATION_DURATION, time.perf_counter() - self.started, operation=self.operation)
+        return False
+
+    def __call__(self, func):
+        operation = self.operation
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timed(operation):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(operation):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+# ==================== MIDDLEWARE ====================
+
+class _QueryTimer:
+    """execute_wrapper cộng dồn thời gian và số query DB của request"""
+    __slots__ = ('duration', 'queries')
+
+    def __init__(self):
+        self.duration = 0.0
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.queries += 1
+
+
+class MetricsMiddleware:
+    """
+    Ghi thời gian request, thời gian và số query DB theo view (tên URL pattern).
+    Đặt ở đầu MIDDLEWARE để đo cả thời gian của các middleware khác.
+    Khi chạy ASGI, query chạy trong thread của sync_to_async (connection riêng theo thread)
+    nên chỉ thời gian request được ghi, không có thời gian DB.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        query_timer = _QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_timer))
+            response = self.get_response(request)
+        view = self._record_request(request, response, time.perf_counter() - started)
+        observe(REQUEST_DB_DURATION, query_timer.duration, view=view)
+        increment(REQUEST_DB_QUERIES, query_timer.queries, view=view)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record_request(request, response, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _record_request(request, response, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        observe(REQUEST_DURATION, elapsed, view=view, method=request.method, status=str(response.status_code))
+        return view
+
+
+# ==================== EXPOSITION ====================
+
+def render_metrics():
+    """Toàn bộ metrics (bytes) ở định dạng Prometheus text exposition, tổng hợp mọi worker nếu có"""
+    if os.environ.get(MULTIPROCESS_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(_registry)
+
+
+def metrics_view(request):
+    """
+    GET /metrics cho Prometheus. Nếu đặt settings.METRICS_AUTH_TOKEN thì yêu cầu
+    header 'Authorization: Bearer <token>'; không đặt thì chỉ mở khi DEBUG
+    (latency theo view không được công khai trên production).
+    """
+    token = getattr(settings, 'METRICS_AUTH_TOKEN', None)
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse('Unauthorized\n', status=401, content_type='text/plain')
+    elif not settings.DEBUG:
+        return HttpResponse('Forbidden: set METRICS_AUTH_TOKEN to enable /metrics\n',
+                            status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
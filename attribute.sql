@@ -1,19 +1,25 @@
+-- cpabe_id phải được ghi kèm: INSERT bằng SQL không đi qua Attribute.save() nên không được cấp id tự động
 -- BASIC ROLES
-INSERT INTO backend_attribute (name, description, created_at) VALUES 
-('doctor', 'Bác sĩ', NOW()),
-('nurse', 'Y tá', NOW()),
-('physician', 'Bác sĩ lâm sàng', NOW()),
-('healthcare_staff', 'Nhân viên y tế', NOW()),
+INSERT INTO backend_attribute (name, description, cpabe_id, created_at) VALUES 
+('doctor', 'Bác sĩ', 1, NOW()),
+('nurse', 'Y tá', 2, NOW()),
+('physician', 'Bác sĩ lâm sàng', 3, NOW()),
+('healthcare_staff', 'Nhân viên y tế', 4, NOW()),
 
 -- HOSPITAL/ORGANIZATION
-('hospital_1', 'Nhân viên Bệnh viện 1', NOW()),
-('hospital_2', 'Nhân viên Bệnh viện 2', NOW()),
-('sanatorium', 'Nhân viên Sanatorium', NOW()),
+('hospital_1', 'Nhân viên Bệnh viện 1', 5, NOW()),
+('hospital_2', 'Nhân viên Bệnh viện 2', 6, NOW()),
+('sanatorium', 'Nhân viên Sanatorium', 7, NOW()),
 
 -- RESEARCH & ACADEMIC  
-('researcher', 'Nhà nghiên cứu', NOW()),
-('md', 'Tiến sĩ Y khoa', NOW()),
-('health_science_centre', 'Trung tâm Khoa học Sức khỏe', NOW()),
-('medicine_institute', 'Viện Y học', NOW()),
-
+('researcher', 'Nhà nghiên cứu', 8, NOW()),
+('md', 'Tiến sĩ Y khoa', 9, NOW()),
+('health_science_centre', 'Trung tâm Khoa học Sức khỏe', 10, NOW()),
+('medicine_institute', 'Viện Y học', 11, NOW());
 
+-- Đồng bộ bộ đếm cpabe_id và đổi mapping version để các worker đang chạy load lại mapping
+INSERT INTO backend_attributeidsequence (id, last_value, mapping_version)
+VALUES (1, 11, md5(random()::text))
+ON CONFLICT (id) DO UPDATE SET
+    last_value = GREATEST(backend_attributeidsequence.last_value, EXCLUDED.last_value),
+    mapping_version = EXCLUDED.mapping_version;
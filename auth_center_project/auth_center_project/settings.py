@@ -12,11 +12,17 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 from django.conf import settings
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Thư mục gốc của repo chứa các module dùng chung giữa các project (abe_common)
+REPO_ROOT = BASE_DIR.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.append(str(REPO_ROOT))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -52,6 +58,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'abe_common.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -250,10 +257,11 @@ CPABE_CONFIG = {
     'KEYS_DIR': os.path.join(BASE_DIR, 'keys_cpabe'),
     'PUBLIC_KEY_FILENAME': 'public_key.bin',
     'MASTER_KEY_FILENAME': 'master_key.bin',
-    'TEMP_SK_FILENAME_PREFIX': 'temp_sk_',
     'SCHEME_NAME': 'Waters11',
     'PAIRING_GROUP': 'SS512',
-    'WATERS11_UNI_SIZE': 100
+    'WATERS11_UNI_SIZE': 100,
+    # Build fixed-base precomputation tables cho PK khi load (tăng tốc Waters11.keygen)
+    'FIXED_BASE_PRECOMPUTATION': os.getenv('ABE_FIXED_BASE_PRECOMPUTATION', 'True') == 'True',
 }
 
 # Internationalization
@@ -323,4 +331,7 @@ ACCOUNT_SIGNUP_FIELDS = ['email*', 'username*', 'password1*', 'password2*']
 ACCOUNT_USER_MODEL_USERNAME_FIELD = "username"
 ACCOUNT_USER_MODEL_EMAIL_FIELD = "email"
 ACCOUNT_LOGOUT_ON_GET = True
-ACCOUNT_PASSWORD_MIN_LENGTH = 8
\ No newline at end of file
+ACCOUNT_PASSWORD_MIN_LENGTH = 8
+
+# Nếu đặt, /metrics yêu cầu header 'Authorization: Bearer <token>'; không đặt thì /metrics chỉ mở khi DEBUG
+METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN')
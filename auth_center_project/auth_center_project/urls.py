@@ -19,9 +19,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include   
 from cpabe_service_app.views import CustomTokenObtainPairView
+from abe_common.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/cpabe/', include('cpabe_service_app.urls')),
     
     # Custom JWT login endpoint with attributes
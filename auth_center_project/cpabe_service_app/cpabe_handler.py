@@ -1,16 +1,39 @@
 # cpabe_service_app/cpabe_handler.py
 import os
-import uuid
 import logging
+import threading
 from django.conf import settings
 
 # Import các thành phần từ các file .py cùng cấp
 from .f_cpabe import setup as f_cpabe_setup_util # Đổi tên để tránh nhầm lẫn
 from .f_cpabe import gen_secret_key as f_cpabe_gen_key_util # Đổi tên
+from .f_cpabe import dump_key_bytes, load_key_file, precompute_fixed_bases, KEY_FORMAT_CHARM
+from abe_common.key_format import KIND_MASTER_KEY, KIND_PUBLIC_KEY
 from .CPABE import CPABE # Lớp bao bọc của bạn
+from abe_common.metrics import timed
 
 logger = logging.getLogger(__name__)
 
+_handler = None
+_handler_lock = threading.Lock()
+
+def get_cpabe_handler():
+    """CPABEHandler dùng chung cho cả process (PairingGroup/Waters11 và PK/MSK chỉ load một lần)"""
+    global _handler
+    if _handler is None:
+        with _handler_lock:
+            if _handler is None:
+                _handler = CPABEHandler()
+    return _handler
+
+def _file_signature(path):
+    """(mtime, size) của file, None nếu không tồn tại - đổi khi file khóa bị ghi lại"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
 class CPABEHandler:
     def __init__(self):
         self.config = settings.CPABE_CONFIG
@@ -44,6 +67,35 @@ class CPABEHandler:
             logger.error(f"Lỗi nghiêm trọng khi khởi tạo CPABE instance: {e}")
             raise
 
+        # (chữ ký file PK, chữ ký file MSK, PK dict, MSK dict, {output_format: PK đã serialize});
+        # thay nguyên tuple khi reload nên thread đọc không cần lock
+        self._keys = None
+        self._keys_lock = threading.Lock()
+
+    def _get_keys(self):
+        """
+        PK/MSK đã deserialize, giữ trong memory; chỉ đọc lại đĩa khi file đổi (setup lại, xoay khóa).
+        Trả về None nếu chưa có PK; MSK dict là None nếu chưa có file MSK.
+        """
+        signatures = (_file_signature(self.pk_file_path), _file_signature(self.msk_file_path))
+        if signatures[0] is None:
+            return None
+        keys = self._keys
+        if keys is not None and keys[:2] == signatures:
+            return keys
+        with self._keys_lock:
+            keys = self._keys
+            if keys is None or keys[:2] != signatures:
+                group = self.actual_scheme_instance.group
+                pk_dict = load_key_file(self.pk_file_path, group, KIND_PUBLIC_KEY)
+                if self.config.get('FIXED_BASE_PRECOMPUTATION', True):
+                    # PK sống suốt process nên bảng precomputation chỉ build một lần mỗi lần load
+                    precompute_fixed_bases(pk_dict)
+                msk_dict = load_key_file(self.msk_file_path, group, KIND_MASTER_KEY) if signatures[1] else None
+                keys = self._keys = (*signatures, pk_dict, msk_dict, {})
+                logger.info(f"Đã load khóa CP-ABE vào memory từ: {self.keys_dir}")
+        return keys
+
     def run_system_setup(self):
         if os.path.exists(self.pk_file_path) and os.path.exists(self.msk_file_path):
             msg = "Hệ thống CP-ABE (PK, MSK) đã được thiết lập trước đó."
@@ -72,51 +124,62 @@ class CPABEHandler:
             logger.exception(error_msg)
             return False, error_msg
 
-    def get_public_key_content(self):
-        if not os.path.exists(self.pk_file_path):
+    @timed('get_public_key')
+    def get_public_key_content(self, output_format=KEY_FORMAT_CHARM):
+        """
+        output_format: 'charm' (objectToBytes - mặc định, client Pyodide dùng bytesToObject)
+                       hoặc 'binary' (định dạng key_format lưu trên đĩa)
+        """
+        try:
+            keys = self._get_keys()
+        except Exception as e:
+            error_msg = f"Lỗi khi load khóa CP-ABE từ {self.keys_dir}: {e}"
+            logger.exception(error_msg)
+            return None, error_msg
+        if keys is None:
             msg = "Không tìm thấy file Khóa Công Khai. Hệ thống có thể chưa được thiết lập."
             logger.warning(msg)
             return None, msg
         try:
-            with open(self.pk_file_path, 'rb') as pk_file:
-                return pk_file.read(), None
-        except IOError as e:
-            error_msg = f"Lỗi I/O khi đọc file Khóa Công Khai {self.pk_file_path}: {e}"
+            public_key_content = keys[4]
+            if output_format not in public_key_content:
+                public_key_content[output_format] = dump_key_bytes(
+                    keys[2], self.actual_scheme_instance.group, KIND_PUBLIC_KEY, output_format
+                )
+            return public_key_content[output_format], None
+        except Exception as e:
+            error_msg = f"Lỗi khi chuyển định dạng Khóa Công Khai: {e}"
             logger.exception(error_msg)
             return None, error_msg
 
-    def generate_secret_key_content(self, user_attributes_string):
+    @timed('generate_secret_key')
+    def generate_secret_key_content(self, user_attributes_string, output_format=KEY_FORMAT_CHARM):
         """
         user_attributes_string: chuỗi thuộc tính đã được định dạng đúng từ model
                                 (ví dụ: "ATTR1,ATTR2,ATTR3")
+        output_format: 'charm' (mặc định) hoặc 'binary' (key_format)
         """
-        if not (os.path.exists(self.pk_file_path) and os.path.exists(self.msk_file_path)):
+        try:
+            keys = self._get_keys()
+        except Exception as e:
+            error_msg = f"Lỗi khi load khóa CP-ABE từ {self.keys_dir}: {e}"
+            logger.exception(error_msg)
+            return None, error_msg
+        if keys is None or keys[3] is None:
             msg = "Không tìm thấy PK hoặc MSK. Không thể tạo Khóa Bí Mật."
             logger.warning(msg)
             return None, msg
 
-        temp_sk_filename_base = f"{self.config['TEMP_SK_FILENAME_PREFIX']}{uuid.uuid4()}.bin"
-        temp_sk_filepath = os.path.join(self.keys_dir, temp_sk_filename_base)
-
         try:
-            logger.info(f"Đang tạo Khóa Bí Mật cho thuộc tính: '{user_attributes_string}' vào file tạm: {temp_sk_filepath}")
-            f_cpabe_gen_key_util(
+            logger.info(f"Đang tạo Khóa Bí Mật cho thuộc tính: '{user_attributes_string}'")
+            secret_key_content = f_cpabe_gen_key_util(
                 self.actual_scheme_instance,
-                self.pk_file_path,
-                self.msk_file_path,
+                keys[2],
+                keys[3],
                 user_attributes_string,
-                temp_sk_filepath
+                output_format=output_format
             )
-
-            if os.path.exists(temp_sk_filepath):
-                with open(temp_sk_filepath, 'rb') as sk_f:
-                    secret_key_content = sk_f.read()
-                logger.info(f"Đã tạo và đọc thành công Khóa Bí Mật từ: {temp_sk_filepath}")
-                return secret_key_content, None
-            else:
-                error_msg = f"Lỗi: File Khóa Bí Mật tạm thời {temp_sk_filepath} không được tạo."
-                logger.error(error_msg)
-                return None, error_msg
+            return secret_key_content, None
         except ValueError as ve:
             error_msg = f"Lỗi giá trị khi tạo Khóa Bí Mật: {ve}"
             logger.error(error_msg)
@@ -125,10 +188,3 @@ class CPABEHandler:
             error_msg = f"Lỗi khi tạo Khóa Bí Mật cho thuộc tính '{user_attributes_string}': {e}"
             logger.exception(error_msg)
             return None, error_msg
-        finally:
-            if os.path.exists(temp_sk_filepath):
-                try:
-                    os.remove(temp_sk_filepath)
-                    logger.info(f"Đã xóa file Khóa Bí Mật tạm thời: {temp_sk_filepath}")
-                except OSError as e_del:
-                    logger.error(f"Lỗi khi xóa file Khóa Bí Mật tạm thời {temp_sk_filepath}: {e_del}")
\ No newline at end of file
@@ -1,5 +1,13 @@
 import os
 from charm.core.engine.util import objectToBytes, bytesToObject
+from charm.core.math.pairing import pc_element
+
+from abe_common.key_format import KIND_MASTER_KEY, KIND_PUBLIC_KEY, KIND_SECRET_KEY, decode_key, encode_key, is_binary_key
+
+# Định dạng output của key: 'charm' (objectToBytes, client Pyodide đang dùng) hoặc 'binary' (key_format)
+KEY_FORMAT_CHARM = 'charm'
+KEY_FORMAT_BINARY = 'binary'
+KEY_FORMATS = (KEY_FORMAT_CHARM, KEY_FORMAT_BINARY)
 
 def _save_bytes_to_file(data_bytes, filename):
     with open(filename, 'wb') as file:
@@ -9,12 +17,27 @@ def _load_bytes_from_file(filename):
     with open(filename, 'rb') as file:
         return file.read()
 
+def load_key_bytes(key_bytes, group, kind):
+    """Decode key ở định dạng nhị phân (key_format) hoặc objectToBytes cũ"""
+    if is_binary_key(key_bytes):
+        return decode_key(group, key_bytes, expected_kind=kind)
+    return bytesToObject(key_bytes, group)
+
+def dump_key_bytes(key_dict, group, kind, output_format=KEY_FORMAT_CHARM):
+    if output_format == KEY_FORMAT_BINARY:
+        return encode_key(group, kind, key_dict)
+    if output_format == KEY_FORMAT_CHARM:
+        return objectToBytes(key_dict, group)
+    raise ValueError(f"Unsupported key format: {output_format}")
+
 def setup(actual_waters11_scheme_instance, output_directory_path, pk_filename="public_key.bin", msk_filename="master_key.bin"):
     if not os.path.exists(output_directory_path):
         os.makedirs(output_directory_path)
     public_key_dict, master_key_dict = actual_waters11_scheme_instance.setup()
-    serialized_public_key = objectToBytes(public_key_dict, actual_waters11_scheme_instance.group)
-    serialized_master_key = objectToBytes(master_key_dict, actual_waters11_scheme_instance.group)
+    group = actual_waters11_scheme_instance.group
+    # Lưu trên đĩa ở định dạng nhị phân có version (nhỏ hơn và load nhanh hơn objectToBytes)
+    serialized_public_key = encode_key(group, KIND_PUBLIC_KEY, public_key_dict)
+    serialized_master_key = encode_key(group, KIND_MASTER_KEY, master_key_dict)
     full_pk_path = os.path.join(output_directory_path, pk_filename)
     full_msk_path = os.path.join(output_directory_path, msk_filename)
     _save_bytes_to_file(serialized_public_key, full_pk_path)
@@ -22,14 +45,37 @@ def setup(actual_waters11_scheme_instance, output_directory_path, pk_filename="p
     return full_pk_path, full_msk_path
 
 
-def gen_secret_key(actual_waters11_scheme_instance, public_key_file_path, master_key_file_path,
-                   user_attributes_string, output_sk_file_path):
-    pk_dict = bytesToObject(_load_bytes_from_file(public_key_file_path), actual_waters11_scheme_instance.group)
-    msk_dict = bytesToObject(_load_bytes_from_file(master_key_file_path), actual_waters11_scheme_instance.group)
+def convert_key_bytes(key_bytes, group, kind, output_format=KEY_FORMAT_CHARM):
+    """Chuyển key (bất kỳ định dạng nào load_key_bytes đọc được) sang output_format"""
+    if output_format == KEY_FORMAT_BINARY and is_binary_key(key_bytes):
+        return key_bytes
+    if output_format == KEY_FORMAT_CHARM and not is_binary_key(key_bytes):
+        return key_bytes
+    return dump_key_bytes(load_key_bytes(key_bytes, group, kind), group, kind, output_format)
+
+
+def load_key_file(file_path, group, kind):
+    return load_key_bytes(_load_bytes_from_file(file_path), group, kind)
+
+
+def precompute_fixed_bases(pk_dict):
+    """
+    Build bảng fixed-base precomputation (initPP của PBC) cho g1_a, g2 và h[1..] -
+    các base Waters11.keygen lũy thừa; phép ** sau đó tự dùng bảng đã build.
+    h[0] là số nguyên 0 (placeholder của Waters11.setup) nên được bỏ qua.
+    """
+    for base in [pk_dict['g1_a'], pk_dict['g2']] + list(pk_dict['h'][1:]):
+        if isinstance(base, pc_element):
+            base.initPP()
+    return pk_dict
+
+
+def gen_secret_key(actual_waters11_scheme_instance, pk_dict, msk_dict, user_attributes_string,
+                   output_format=KEY_FORMAT_CHARM):
+    """Tạo Khóa Bí Mật từ PK/MSK đã load, trả về bytes ở output_format (không ghi file)"""
+    group = actual_waters11_scheme_instance.group
     attr_list = [attr.strip().upper() for attr in user_attributes_string.split(',') if attr.strip()] # Chuẩn hóa và upper
     if not attr_list:
         raise ValueError("Attribute list cannot be empty for key generation.")
     user_secret_key_dict = actual_waters11_scheme_instance.keygen(pk_dict, msk_dict, attr_list)
-    serialized_user_secret_key = objectToBytes(user_secret_key_dict, actual_waters11_scheme_instance.group)
-    _save_bytes_to_file(serialized_user_secret_key, output_sk_file_path)
-    return output_sk_file_path
+    return dump_key_bytes(user_secret_key_dict, group, KIND_SECRET_KEY, output_format)
@@ -1,3 +1,154 @@
-from django.test import TestCase
+import importlib.util
+import os
+import shutil
+import tempfile
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from abe_common.key_format import KIND_SECRET_KEY, decode_key, is_binary_key
+
+# Charm cần thư viện PBC; cpabe_handler/f_cpabe import charm ngay khi load module
+HAS_CHARM = importlib.util.find_spec('charm') is not None
+
+
+def cpabe_config(keys_dir, **overrides):
+    config = {
+        'KEYS_DIR': keys_dir,
+        'PUBLIC_KEY_FILENAME': 'public_key.bin',
+        'MASTER_KEY_FILENAME': 'master_key.bin',
+        'SCHEME_NAME': 'Waters11',
+        'PAIRING_GROUP': 'SS512',
+        'WATERS11_UNI_SIZE': 5,
+        'FIXED_BASE_PRECOMPUTATION': True,
+    }
+    config.update(overrides)
+    return config
+
+
+@skipUnless(HAS_CHARM, "charm-crypto is not installed")
+class CPABEHandlerTest(TestCase):
+    """CPABEHandler dùng chung cả process: PK/MSK load một lần, đọc lại khi file khóa đổi"""
+
+    def setUp(self):
+        self.keys_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.keys_dir, ignore_errors=True)
+        settings_override = override_settings(CPABE_CONFIG=cpabe_config(self.keys_dir))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Mỗi test dùng handler mới với thư mục khóa riêng
+        patcher = mock.patch('cpabe_service_app.cpabe_handler._handler', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        from cpabe_service_app.cpabe_handler import get_cpabe_handler
+        self.handler = get_cpabe_handler()
+
+    def test_handler_is_a_singleton(self):
+        from cpabe_service_app.cpabe_handler import get_cpabe_handler
+        self.assertIs(get_cpabe_handler(), self.handler)
+
+    def test_keys_are_loaded_once_and_reloaded_on_file_change(self):
+        self.assertIsNone(self.handler._get_keys())
+        self.handler.run_system_setup()
+
+        with mock.patch('cpabe_service_app.cpabe_handler.precompute_fixed_bases') as precompute:
+            keys = self.handler._get_keys()
+            self.assertIs(self.handler._get_keys(), keys)
+            precompute.assert_called_once_with(keys[2])
+
+            # Xoay khóa: ghi lại file PK (mtime/size đổi)
+            stat = os.stat(self.handler.pk_file_path)
+            os.utime(self.handler.pk_file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            reloaded = self.handler._get_keys()
+        self.assertIsNot(reloaded, keys)
+        self.assertEqual(precompute.call_count, 2)
+
+    def test_precomputation_can_be_disabled(self):
+        self.handler.config = cpabe_config(self.keys_dir, FIXED_BASE_PRECOMPUTATION=False)
+        self.handler.run_system_setup()
+        with mock.patch('cpabe_service_app.cpabe_handler.precompute_fixed_bases') as precompute:
+            self.assertIsNotNone(self.handler._get_keys())
+        precompute.assert_not_called()
+
+    def test_gen_secret_key_returns_bytes(self):
+        from cpabe_service_app.f_cpabe import KEY_FORMAT_BINARY, gen_secret_key
+        self.handler.run_system_setup()
+        _, _, pk, msk, _ = self.handler._get_keys()
+        scheme = self.handler.actual_scheme_instance
+
+        key_bytes = gen_secret_key(scheme, pk, msk, '1, 3', output_format=KEY_FORMAT_BINARY)
+        self.assertIsInstance(key_bytes, bytes)
+        secret_key = decode_key(scheme.group, key_bytes, expected_kind=KIND_SECRET_KEY)
+        self.assertEqual(set(secret_key['K']), {'1', '3'})
+        self.assertIsInstance(gen_secret_key(scheme, pk, msk, '2'), bytes)
+        with self.assertRaises(ValueError):
+            gen_secret_key(scheme, pk, msk, ' , ')
+
+    def test_missing_master_key(self):
+        self.handler.run_system_setup()
+        os.remove(self.handler.msk_file_path)
+        secret_key, error = self.handler.generate_secret_key_content('1')
+        self.assertIsNone(secret_key)
+        self.assertIn('MSK', error)
+        # PK vẫn phục vụ được khi thiếu MSK
+        self.assertIsNotNone(self.handler.get_public_key_content()[0])
+
+
+@skipUnless(HAS_CHARM, "charm-crypto is not installed")
+class KeyViewTest(TestCase):
+    """?format=binary trả về key_format, mặc định objectToBytes; lỗi trả về JSON"""
+
+    def setUp(self):
+        self.keys_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.keys_dir, ignore_errors=True)
+        settings_override = override_settings(CPABE_CONFIG=cpabe_config(self.keys_dir))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch('cpabe_service_app.cpabe_handler._handler', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        from cpabe_service_app.cpabe_handler import get_cpabe_handler
+        from cpabe_service_app.models import Attribute
+        self.handler = get_cpabe_handler()
+        self.handler.run_system_setup()
+
+        self.user = get_user_model().objects.create_user(username='doctor', password='secret')
+        self.user.cpabe_profile.attributes.add(Attribute.objects.create(name='ROLE:DOCTOR'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_public_key_formats(self):
+        url = reverse('cpabe_service_app:cpabe_public_key')
+        binary = self.client.get(url, {'format': 'binary'})
+        self.assertEqual(binary.status_code, 200)
+        self.assertTrue(is_binary_key(binary.content))
+
+        charm = self.client.get(url)
+        self.assertEqual(charm.status_code, 200)
+        self.assertFalse(is_binary_key(charm.content))
+
+        invalid = self.client.get(url, {'format': 'pem'})
+        self.assertEqual(invalid.status_code, 400)
+        self.assertIn('error', invalid.json())
+
+    def test_secret_key_formats(self):
+        url = reverse('cpabe_service_app:cpabe_generate_secret_key')
+        binary = self.client.post(f'{url}?format=binary')
+        self.assertEqual(binary.status_code, 200)
+        secret_key = decode_key(self.handler.actual_scheme_instance.group, binary.content, KIND_SECRET_KEY)
+        self.assertEqual(len(secret_key['K']), 1)
+
+        charm = self.client.post(url)
+        self.assertEqual(charm.status_code, 200)
+        self.assertFalse(is_binary_key(charm.content))
+
+    def test_secret_key_without_master_key(self):
+        os.remove(self.handler.msk_file_path)
+        response = self.client.post(reverse('cpabe_service_app:cpabe_generate_secret_key'))
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('MSK', response.json()['error'])
@@ -2,19 +2,35 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework import status
+from rest_framework.negotiation import DefaultContentNegotiation
 from django.http import HttpResponse, Http404
 from django.conf import settings
 from django.shortcuts import render
-from .cpabe_handler import CPABEHandler
+from .cpabe_handler import get_cpabe_handler
+from .f_cpabe import KEY_FORMATS, KEY_FORMAT_CHARM
 from .models import UserProfile
 from .serializers import MyTokenObtainPairSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 
+class KeyFormatContentNegotiation(DefaultContentNegotiation):
+    """
+    ?format= của các view khóa là định dạng key (charm/binary), không phải format của renderer:
+    mặc định DRF lọc renderer theo ?format= và trả về 404 khi không có renderer 'binary'.
+    View tự kiểm tra ?format= (400 khi không hợp lệ) nên không lọc renderer theo nó.
+    """
+    def filter_renderers(self, renderers, format):
+        return renderers
+
+def _requested_key_format(request):
+    """?format=binary trả về key ở định dạng key_format; mặc định objectToBytes của charm"""
+    key_format = request.query_params.get('format', KEY_FORMAT_CHARM)
+    return key_format if key_format in KEY_FORMATS else None
+
 class CPABESetupView(APIView):
     permission_classes = [IsAdminUser] # Chỉ admin Django mới được setup
 
     def post(self, request, *args, **kwargs):
-        handler = CPABEHandler()
+        handler = get_cpabe_handler()
         success, message = handler.run_system_setup()
         if success:
             return Response({"message": message}, status=status.HTTP_200_OK)
@@ -26,10 +42,15 @@ class CPABESetupView(APIView):
 
 class PublicKeyView(APIView):
     permission_classes = [AllowAny] # Khóa công khai cho phép mọi người truy cập
+    content_negotiation_class = KeyFormatContentNegotiation
 
     def get(self, request, *args, **kwargs):
-        handler = CPABEHandler()
-        pk_content, error_msg = handler.get_public_key_content()
+        key_format = _requested_key_format(request)
+        if key_format is None:
+            return Response({"error": f"Định dạng khóa không hợp lệ. Hỗ trợ: {', '.join(KEY_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        handler = get_cpabe_handler()
+        pk_content, error_msg = handler.get_public_key_content(key_format)
 
         if error_msg:
             return Response({"error": error_msg}, status=status.HTTP_404_NOT_FOUND)
@@ -43,6 +64,7 @@ class PublicKeyView(APIView):
 
 class GenerateSecretKeyView(APIView):
     permission_classes = [IsAuthenticated]
+    content_negotiation_class = KeyFormatContentNegotiation
 
     def post(self, request, *args, **kwargs):
         user = request.user
@@ -51,14 +73,18 @@ class GenerateSecretKeyView(APIView):
         except UserProfile.DoesNotExist:
             return Response({"error": "Không tìm thấy hồ sơ người dùng CP-ABE."}, status=status.HTTP_404_NOT_FOUND)
 
+        key_format = _requested_key_format(request)
+        if key_format is None:
+            return Response({"error": f"Định dạng khóa không hợp lệ. Hỗ trợ: {', '.join(KEY_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
         user_attributes_str = user_profile.get_attributes_string()
 
         if not user_attributes_str:
             return Response({"error": "Người dùng chưa được gán thuộc tính nào."}, status=status.HTTP_400_BAD_REQUEST)
 
         print(f"Đang tạo Khóa Bí Mật cho người dùng '{user.username}' với thuộc tính: '{user_attributes_str}'")
-        handler = CPABEHandler()
-        sk_content, error_msg = handler.generate_secret_key_content(user_attributes_str)
+        handler = get_cpabe_handler()
+        sk_content, error_msg = handler.generate_secret_key_content(user_attributes_str, key_format)
 
         if error_msg:
             return Response({"error": error_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
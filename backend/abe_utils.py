@@ -1,13 +1,30 @@
+import asyncio
 import base64
+import hashlib
+import json
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 import pickle
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.core.exceptions import ImproperlyConfigured
-from charm.toolbox.pairinggroup import PairingGroup, GT
-from charm.schemes.abenc.waters11 import Waters11
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 
 from backend.models import *
+from abe_common.metrics import timed
+from abe_common.key_format import (
+    KIND_MASTER_KEY, KIND_PUBLIC_KEY, KIND_SECRET_KEY, KIND_TRANSFORM_KEY, decode_key, encode_key, is_binary_key
+)
+from backend.policy import (
+    POLICY_CACHE_SIZE, PolicySyntaxError, attribute_bits, compile_policy, policy_bitsets, translate_policy
+)
 
 # Constants
 if not isinstance(settings.BASE_DIR, Path):
@@ -19,48 +36,146 @@ ABE_PARAMS_DIR = BASE_DIR_PATH / 'abe_params'
 ABE_SECURE_KEYS_DIR = BASE_DIR_PATH / 'secure_keys'
 PK_FILE_PATH = ABE_PARAMS_DIR / 'public_parameters.bin'
 MSK_FILE_PATH = ABE_SECURE_KEYS_DIR / 'master_secret.key'
+SECRET_KEY_CACHE_PREFIX = 'abe:user_secret_key:'
 
-# Global variables
-_charm_group = None
-_charm_waters11_scheme = None
-_loaded_pk = None
-_loaded_msk = None
+# Global variables (các tuple được thay nguyên khối nên đọc/ghi giữa các thread là an toàn)
+_attribute_mapping = None  # (version, name_to_int, int_to_name)
+_public_parameters_payload = None  # (version_key, body, content_hash)
 
 # ==================== WATERS11 INITIALIZATION ====================
 
+class CharmEngine:
+    """
+    Group, Waters11 scheme, PK và MSK dùng chung giữa các thread (và các request async).
+    Mỗi thành phần được load đúng một lần dưới lock; sau đó đọc không cần lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.group = None
+        self.scheme = None
+        self.public_key = None
+        self.public_key_fingerprint = None
+        self.master_key = None
+
+    def init_scheme(self):
+        """
+        Khởi tạo đối tượng PairingGroup và Waters11 scheme.
+        Charm chỉ được import ở đây (lazy) để manage.py, migrate và test không phải load PBC.
+        """
+        if self.scheme is not None:
+            return
+        with self._lock:
+            if self.scheme is None:
+                from charm.toolbox.pairinggroup import PairingGroup
+                from charm.schemes.abenc.waters11 import Waters11
+                group = PairingGroup('SS512')
+                self.scheme = Waters11(group, uni_size=settings.ABE_UNIVERSE_SIZE, verbose=False)
+                self.group = group
+                print("Charm-Crypto Group and Waters11 Scheme Initialized.")
+
+    def load_public_key(self):
+        if self.public_key is not None:
+            return self.public_key
+        with self._lock:
+            if self.public_key is None:
+                if not PK_FILE_PATH.exists():
+                    raise ImproperlyConfigured(f"PK file not found: {PK_FILE_PATH}")
+                with open(PK_FILE_PATH, 'rb') as f:
+                    pk_file_bytes = f.read()
+                public_key = _decode_key_file(pk_file_bytes, KIND_PUBLIC_KEY)
+                if getattr(settings, 'ABE_FIXED_BASE_PRECOMPUTATION', True):
+                    precompute_fixed_bases(public_key)
+                self.public_key_fingerprint = hashlib.sha256(pk_file_bytes).hexdigest()
+                self.public_key = public_key
+        return self.public_key
+
+    def load_master_key(self):
+        if self.master_key is not None:
+            return self.master_key
+        with self._lock:
+            if self.master_key is None:
+                if not MSK_FILE_PATH.exists():
+                    raise ImproperlyConfigured(f"MSK file not found: {MSK_FILE_PATH}")
+                with open(MSK_FILE_PATH, 'rb') as f:
+                    self.master_key = _decode_key_file(f.read(), KIND_MASTER_KEY)
+        return self.master_key
+
+
+_engine = CharmEngine()
+
 def init_charm_settings():
-    """Khởi tạo đối tượng PairingGroup và Waters11 scheme"""
-    global _charm_group, _charm_waters11_scheme
-    if _charm_group is None:
-        _charm_group = PairingGroup('SS512')
-        _charm_waters11_scheme = Waters11(_charm_group, uni_size=11, verbose=False)
-        print("Charm-Crypto Group and Waters11 Scheme Initialized.")
+    """Khởi tạo đối tượng PairingGroup và Waters11 scheme (xem CharmEngine.init_scheme)"""
+    _engine.init_scheme()
 
 def get_charm_group():
-    if _charm_group is None:
-        init_charm_settings()
-    return _charm_group
+    if _engine.group is None:
+        _engine.init_scheme()
+    return _engine.group
 
 def get_waters11_scheme():
-    if _charm_waters11_scheme is None:
-        init_charm_settings()
-    return _charm_waters11_scheme
+    if _engine.scheme is None:
+        _engine.init_scheme()
+    return _engine.scheme
+
+def warm_up():
+    """
+    Load trước group/scheme, PK (kèm bảng precomputation) và MSK.
+    Gọi trong gunicorn master (preload_app) để các worker fork ra dùng chung
+    copy-on-write thay vì mỗi worker tự load ở request đầu tiên.
+    Trả về danh sách thành phần đã load; bỏ qua PK/MSK nếu hệ thống chưa setup.
+    """
+    init_charm_settings()
+    loaded = ['group']
+    for name, loader in (('PK', load_public_parameters), ('MSK', load_master_secret_key)):
+        try:
+            loader()
+            loaded.append(name)
+        except ImproperlyConfigured as e:
+            print(f"Skipping {name} warm-up: {e}")
+    return loaded
 
 # ==================== ATTRIBUTE MAPPING FUNCTIONS ====================
 
-def get_attribute_mapping():
-    """Tạo mapping giữa attribute names và integers cho Waters11 scheme"""
+def get_attribute_mapping_version():
+    """
+    Lấy version hiện tại của attribute mapping.
+    Version nằm trong DB (AttributeIdSequence) chứ không ở cache, vì cache mặc định là LocMem
+    riêng từng worker - bump ở một worker sẽ không tới các worker khác.
+    """
+    from .models import AttributeIdSequence
+    return AttributeIdSequence.current_mapping_version()
+
+def invalidate_attribute_mapping():
+    """Đánh dấu mapping đã thay đổi - gọi từ signal khi Attribute được lưu/xóa"""
+    global _attribute_mapping
+    _attribute_mapping = None
+    from .models import AttributeIdSequence
+    AttributeIdSequence.bump_mapping_version()
+
+def get_attribute_mapping(refresh=False):
+    """
+    Lấy mapping giữa attribute names và integers (cpabe_id) cho Waters11 scheme.
+    Mapping được cache trong process và chỉ load lại khi version thay đổi (hoặc refresh=True).
+    Attribute chưa có cpabe_id (insert bằng SQL/bulk_create) được cấp id ngay khi load.
+    Không được sửa các dict trả về.
+    """
+    global _attribute_mapping
+    version = get_attribute_mapping_version()
+    cached = _attribute_mapping
+    if not refresh and cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
     from .models import Attribute
-    
-    all_attributes = Attribute.objects.all().order_by('id')
-    name_to_int = {}
-    int_to_name = {}
-    
-    # Bắt đầu từ 1 vì Waters11 sử dụng h[0] cho mục đích khác
-    for i, attr in enumerate(all_attributes, start=1):
-        name_to_int[attr.name] = i
-        int_to_name[i] = attr.name
-    
+    rows = list(Attribute.objects.values_list('name', 'cpabe_id'))
+    if any(cpabe_id is None for _, cpabe_id in rows):
+        Attribute.assign_missing_cpabe_ids()
+        version = get_attribute_mapping_version()
+        rows = list(Attribute.objects.values_list('name', 'cpabe_id'))
+    name_to_int = {name: cpabe_id for name, cpabe_id in rows}
+    int_to_name = {cpabe_id: name for name, cpabe_id in rows}
+
+    _attribute_mapping = (version, name_to_int, int_to_name)
     return name_to_int, int_to_name
 
 def convert_attributes_to_integers(attr_names):
@@ -69,16 +184,13 @@ def convert_attributes_to_integers(attr_names):
     
     attr_integers = []
     for attr_name in attr_names:
-        if attr_name in name_to_int:
-            attr_integers.append(name_to_int[attr_name])
-    else:
-            # Nếu attribute chưa có trong mapping, tạo mới
+        if attr_name not in name_to_int:
+            # Attribute chưa có trong mapping: tạo mới, hoặc đã được insert ngoài ORM
+            # (không bump version) nên phải load lại mapping từ DB
             from .models import Attribute
-            attr_obj, created = Attribute.objects.get_or_create(name=attr_name)
-            if created:
-                # Refresh mapping
-                name_to_int, _ = get_attribute_mapping()
-            attr_integers.append(name_to_int[attr_name])
+            Attribute.objects.get_or_create(name=attr_name)
+            name_to_int, _ = get_attribute_mapping(refresh=True)
+        attr_integers.append(name_to_int[attr_name])
     
     return attr_integers
 
@@ -98,26 +210,38 @@ def convert_integers_to_attributes(attr_integers):
 # ==================== KEY MANAGEMENT ====================
 
 def load_public_parameters():
-    global _loaded_pk
-    if _loaded_pk is None:
-        if not PK_FILE_PATH.exists():
-            raise ImproperlyConfigured(f"PK file not found: {PK_FILE_PATH}")
-        with open(PK_FILE_PATH, 'rb') as f:
-            serialized_pk = pickle.load(f)
-        group = get_charm_group()
-        _loaded_pk = deserialize_charm_object(group, serialized_pk)
-    return _loaded_pk
+    return _engine.load_public_key()
+
+def precompute_fixed_bases(pk):
+    """
+    Build bảng precomputation (fixed-base windowing của PBC qua initPP) cho các base
+    cố định mà Waters11.keygen lũy thừa: g1_a, g2 và h[i].
+    Sau khi gọi, phép ** trên các element này tự động dùng bảng đã build.
+    h[0] của Waters11.setup() là số nguyên 0 (placeholder), không phải element nên được bỏ qua.
+    """
+    from charm.core.math.pairing import pc_element
+    bases = [pk['g1_a'], pk['g2']] + list(pk['h'])
+    for base in bases:
+        if isinstance(base, pc_element):
+            base.initPP()
+    return pk
+
+def get_public_parameters_fingerprint():
+    """SHA-256 của file PK đang dùng - thay đổi khi hệ thống được setup lại"""
+    if _engine.public_key_fingerprint is None:
+        _engine.load_public_key()
+    return _engine.public_key_fingerprint
 
 def load_master_secret_key():
-    global _loaded_msk
-    if _loaded_msk is None:
-        if not MSK_FILE_PATH.exists():
-            raise ImproperlyConfigured(f"MSK file not found: {MSK_FILE_PATH}")
-        with open(MSK_FILE_PATH, 'rb') as f:
-            serialized_msk = pickle.load(f)
-        group = get_charm_group()
-        _loaded_msk = deserialize_charm_object(group, serialized_msk)
-    return _loaded_msk
+    return _engine.load_master_key()
+
+def _decode_key_file(file_bytes, kind):
+    """Decode file key: định dạng nhị phân (key_format) hoặc pickle cũ của setup_abe_system"""
+    group = get_charm_group()
+    if is_binary_key(file_bytes):
+        return decode_key(group, file_bytes, expected_kind=kind)
+    # File tạo trước khi có key_format - chạy lại setup_abe_system để chuyển sang định dạng mới
+    return deserialize_charm_object(group, pickle.loads(file_bytes))
 
 # ==================== SERIALIZATION FUNCTIONS ====================
 
@@ -165,45 +289,281 @@ def deserialize_charm_object(group, serialized_object):
 
 # ==================== USER KEY GENERATION ====================
 
+def get_secret_key_cache_key(user_id):
+    return f"{SECRET_KEY_CACHE_PREFIX}{user_id}"
+
+def compute_attribute_set_hash(attr_names, attr_integers, include_public_key=True):
+    """
+    Hash của tập attribute (name, cpabe_id) của user, mặc định gắn với PK đang dùng.
+    include_public_key=False: không load PK (không chạm tới charm), dùng cho kiểm tra nhanh lúc login.
+    """
+    digest = hashlib.sha256(get_public_parameters_fingerprint().encode('utf-8') if include_public_key else b'')
+    for name, attr_int in sorted(zip(attr_names, attr_integers)):
+        digest.update(f"\n{name}:{attr_int}".encode('utf-8'))
+    return digest.hexdigest()
+
+def invalidate_user_secret_key(user_id):
+    """Xóa secret key đã cache của user - gọi khi UserAttribute thay đổi"""
+    cache.delete(get_secret_key_cache_key(user_id))
+
+def _get_user_key_attribute_set(user):
+    """Lấy (attr_names, attr_integers) của user - chỉ DB, không cần charm"""
+    from .models import UserAttribute
+    user_attributes = UserAttribute.objects.filter(user=user).select_related('attribute')
+    attr_names = [ua.attribute.name for ua in user_attributes]
+    
+    if not attr_names:
+        raise ValueError(f"User {user.email} has no attributes assigned")
+    
+    # Chuyển đổi attribute names thành integers cho Waters11
+    return attr_names, convert_attributes_to_integers(attr_names)
+
+def _get_user_key_attributes(user):
+    """Lấy (attr_names, attr_integers, attribute_hash) dùng để generate/cache key của user"""
+    attr_names, attr_integers = _get_user_key_attribute_set(user)
+    return attr_names, attr_integers, compute_attribute_set_hash(attr_names, attr_integers)
+
+def get_cached_user_secret_key(user):
+    """Lấy secret key đã cache của user nếu vẫn còn hợp lệ, ngược lại trả về None"""
+    _, _, attribute_hash = _get_user_key_attributes(user)
+    cached = cache.get(get_secret_key_cache_key(user.pk))
+    if cached is not None and cached['attribute_hash'] == attribute_hash:
+        return cached['key_data']
+    return None
+
+def peek_cached_user_secret_key(user):
+    """
+    Như get_cached_user_secret_key nhưng không load charm/PK (dùng trong signal login):
+    so theo user id và hash tập attribute; fingerprint PK chỉ được so nếu process đã load PK.
+    """
+    attr_names, attr_integers = _get_user_key_attribute_set(user)
+    cached = cache.get(get_secret_key_cache_key(user.pk))
+    attribute_set_hash = compute_attribute_set_hash(attr_names, attr_integers, include_public_key=False)
+    if cached is None or cached.get('attribute_set_hash') != attribute_set_hash:
+        return None
+    loaded_fingerprint = _engine.public_key_fingerprint
+    if loaded_fingerprint is not None and cached.get('public_key_fingerprint') != loaded_fingerprint:
+        return None
+    return cached['key_data']
+
+@timed('generate_user_secret_key')
 def generate_user_secret_key(user):
-    """Generate CP-ABE secret key cho user dựa trên static attributes"""
+    """
+    Generate CP-ABE secret key cho user dựa trên static attributes.
+    Key đã serialize được cache theo user và hash của tập attributes, nên các
+    request lặp lại không phải chạy lại Waters11.keygen.
+    """
+    return _get_user_secret_key_entry(user)['key_data']
+
+def compute_user_secret_key(attr_integers):
+    """
+    Chạy Waters11.keygen và serialize key: (secret key JSON cho client, key_format bytes).
+    Chỉ dùng charm (không DB/cache) nên chạy được trong crypto executor (thread hoặc process).
+    """
+    pk = load_public_parameters()
+    msk = load_master_secret_key()
+    waters11_scheme = get_waters11_scheme()
+    group = get_charm_group()
+    
+    # pk['h'] = [0, h_1, ..., h_uni_size]: cpabe_id ngoài khoảng này không có base tương ứng
+    universe_size = len(pk['h']) - 1
+    out_of_universe = [attr for attr in attr_integers if not 1 <= int(attr) <= universe_size]
+    if out_of_universe:
+        raise ValueError(
+            f"Attribute ids {out_of_universe} are outside the Waters11 universe of the loaded PK "
+            f"(uni_size={universe_size}); increase ABE_UNIVERSE_SIZE and run setup_abe_system"
+        )
+    
+    # Generate secret key bằng Waters11 scheme (thời gian được đo ở process gọi, xem run_in_crypto_executor)
+    secret_key = waters11_scheme.keygen(pk, msk, attr_integers)
+    
+    # Serialize secret key
+    serialized_sk = serialize_charm_object(group, secret_key)
+    return convert_bytes_to_base64(serialized_sk), encode_key(group, KIND_SECRET_KEY, secret_key)
+
+def _build_secret_key_entry(user, attr_names, attr_integers, attribute_hash, json_compatible_sk, key_binary):
+    return {
+        'attribute_hash': attribute_hash,
+        # Cho peek_cached_user_secret_key (PK đã được load khi tính attribute_hash)
+        'attribute_set_hash': compute_attribute_set_hash(attr_names, attr_integers, include_public_key=False),
+        'public_key_fingerprint': get_public_parameters_fingerprint(),
+        'key_data': {
+            'secret_key': json_compatible_sk,
+            'attributes': attr_names,
+            'attribute_integers': attr_integers,
+            'user_email': user.email
+        },
+        'key_binary': key_binary,
+    }
+
+def _is_valid_secret_key_entry(cached, attribute_hash):
+    return cached is not None and cached['attribute_hash'] == attribute_hash and 'key_binary' in cached
+
+def _get_user_secret_key_entry(user):
+    """Entry cache của secret key: key_data (JSON cho client) và key_binary (key_format)"""
     try:
-        pk = load_public_parameters()
-        msk = load_master_secret_key()
-        waters11_scheme = get_waters11_scheme()
-        group = get_charm_group()
+        attr_names, attr_integers, attribute_hash = _get_user_key_attributes(user)
         
-        # Lấy danh sách static attributes của user
-        from .models import UserAttribute
-        user_attributes = UserAttribute.objects.filter(user=user)
-        attr_names = [ua.attribute.name for ua in user_attributes]
+        cache_key = get_secret_key_cache_key(user.pk)
+        cached = cache.get(cache_key)
+        if _is_valid_secret_key_entry(cached, attribute_hash):
+            return cached
         
-        if not attr_names:
-            raise ValueError(f"User {user.email} has no attributes assigned")
+        print(f"Generating secret key for user {user.email} with attributes: {attr_names} -> {attr_integers}")
+        with timed('waters11_keygen'):
+            json_compatible_sk, key_binary = compute_user_secret_key(attr_integers)
         
-        # Chuyển đổi attribute names thành integers cho Waters11
-        attr_integers = convert_attributes_to_integers(attr_names)
+        entry = _build_secret_key_entry(user, attr_names, attr_integers, attribute_hash, json_compatible_sk, key_binary)
+        cache.set(cache_key, entry, timeout=getattr(settings, 'ABE_SECRET_KEY_CACHE_TTL', 3600))
+        return entry
         
-        print(f"Generating secret key for user {user.email} with attributes: {attr_names} -> {attr_integers}")
+    except Exception as e:
+        print(f"Error generating secret key for user {user.email}: {e}")
+        raise
+
+@timed('generate_user_secret_key')
+async def aget_user_secret_key_entry(user):
+    """
+    Như _get_user_secret_key_entry cho async view: DB/cache qua async API,
+    keygen chạy trong crypto executor nên event loop không bị chặn.
+    """
+    try:
+        attr_names, attr_integers, attribute_hash = await sync_to_async(_get_user_key_attributes)(user)
         
-        # Generate secret key bằng Waters11 scheme
-        secret_key = waters11_scheme.keygen(pk, msk, attr_integers)
+        cache_key = get_secret_key_cache_key(user.pk)
+        cached = await cache.aget(cache_key)
+        if _is_valid_secret_key_entry(cached, attribute_hash):
+            return cached
         
-        # Serialize secret key
-        serialized_sk = serialize_charm_object(group, secret_key)
-        json_compatible_sk = convert_bytes_to_base64(serialized_sk)
+        print(f"Generating secret key for user {user.email} with attributes: {attr_names} -> {attr_integers}")
+        json_compatible_sk, key_binary = await run_in_crypto_executor(
+            compute_user_secret_key, attr_integers, operation='waters11_keygen'
+        )
         
-        return {
-            'secret_key': json_compatible_sk,
-            'attributes': attr_names,
-            'attribute_integers': attr_integers,
-            'user_email': user.email
-        }
+        entry = _build_secret_key_entry(user, attr_names, attr_integers, attribute_hash, json_compatible_sk, key_binary)
+        await cache.aset(cache_key, entry, timeout=getattr(settings, 'ABE_SECRET_KEY_CACHE_TTL', 3600))
+        return entry
         
     except Exception as e:
         print(f"Error generating secret key for user {user.email}: {e}")
         raise
 
+# ==================== CRYPTO EXECUTOR ====================
+
+_crypto_executor = None
+_crypto_executor_lock = threading.Lock()
+
+def _init_crypto_process():
+    """Initializer của process worker: setup Django (nếu start method không phải fork) và load key"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    warm_up()
+
+def get_crypto_executor():
+    """
+    Executor giới hạn cho phép tính charm (keygen) gọi từ async view.
+    ABE_CRYPTO_EXECUTOR: 'thread' (mặc định) hoặc 'process' (keygen chạy song song trên nhiều core);
+    ABE_CRYPTO_EXECUTOR_WORKERS: số worker (mặc định số CPU).
+    """
+    global _crypto_executor
+    if _crypto_executor is None:
+        with _crypto_executor_lock:
+            if _crypto_executor is None:
+                workers = getattr(settings, 'ABE_CRYPTO_EXECUTOR_WORKERS', None) or os.cpu_count() or 1
+                if getattr(settings, 'ABE_CRYPTO_EXECUTOR', 'thread') == 'process':
+                    _crypto_executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_crypto_process)
+                else:
+                    _crypto_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='abe-crypto')
+    return _crypto_executor
+
+async def run_in_crypto_executor(func, *args, operation=None):
+    """
+    Chạy func(*args) trong crypto executor; func chỉ được dùng charm, không dùng DB.
+    operation: tên thao tác đo bằng timed() quanh lời gọi, ở process hiện tại - không đo bên trong
+    func vì với ABE_CRYPTO_EXECUTOR='process' metrics ghi trong process con không được scrape.
+    """
+    loop = asyncio.get_running_loop()
+    if operation is None:
+        return await loop.run_in_executor(get_crypto_executor(), partial(func, *args))
+    with timed(operation):
+        return await loop.run_in_executor(get_crypto_executor(), partial(func, *args))
+
+# ==================== KEYGEN JOB QUEUE ====================
+
+def enqueue_keygen_job(user):
+    """Tạo job generate key cho user (dùng lại job đang chờ/đang chạy nếu có)"""
+    from .models import KeygenJob
+    active_job = KeygenJob.objects.filter(
+        user=user,
+        status__in=[KeygenJob.STATUS_PENDING, KeygenJob.STATUS_RUNNING]
+    ).order_by('-created_at').first()
+    if active_job is not None:
+        return active_job
+    return KeygenJob.objects.create(user=user)
+
+def get_latest_keygen_job(user):
+    from .models import KeygenJob
+    return KeygenJob.objects.filter(user=user).order_by('-created_at').first()
+
+def claim_next_keygen_job():
+    """
+    Nhận job đang chờ tiếp theo cho worker hiện tại.
+    Dùng update có điều kiện nên an toàn khi nhiều worker cùng chạy (kể cả trên SQLite).
+    """
+    from .models import KeygenJob
+    with transaction.atomic():
+        candidate_ids = list(
+            KeygenJob.objects.select_for_update(skip_locked=True)
+            .filter(status=KeygenJob.STATUS_PENDING)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:5]
+        )
+        for job_id in candidate_ids:
+            claimed = KeygenJob.objects.filter(
+                id=job_id, status=KeygenJob.STATUS_PENDING
+            ).update(
+                status=KeygenJob.STATUS_RUNNING,
+                started_at=timezone.now(),
+                attempts=F('attempts') + 1
+            )
+            if claimed:
+                return KeygenJob.objects.select_related('user').get(id=job_id)
+    return None
+
+def run_keygen_job(job):
+    """Chạy một job đã nhận: generate key và lưu kết quả vào job"""
+    from .models import KeygenJob
+    try:
+        job.result = generate_user_secret_key(job.user)
+        job.status = KeygenJob.STATUS_DONE
+        job.error = None
+    except Exception as e:
+        job.result = None
+        job.status = KeygenJob.STATUS_FAILED
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['result', 'status', 'error', 'finished_at'])
+    return job
+
+def requeue_stale_keygen_jobs(stale_after_seconds):
+    """Đưa các job 'running' quá lâu (worker bị dừng giữa chừng) về lại hàng đợi"""
+    from .models import KeygenJob
+    cutoff = timezone.now() - timedelta(seconds=stale_after_seconds)
+    return KeygenJob.objects.filter(
+        status=KeygenJob.STATUS_RUNNING, started_at__lt=cutoff
+    ).update(status=KeygenJob.STATUS_PENDING)
+
+def purge_finished_keygen_jobs(older_than_seconds):
+    from .models import KeygenJob
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    deleted, _ = KeygenJob.objects.filter(
+        status__in=[KeygenJob.STATUS_DONE, KeygenJob.STATUS_FAILED],
+        finished_at__lt=cutoff
+    ).delete()
+    return deleted
+
 # ==================== CLIENT SUPPORT ====================
 
 def convert_bytes_to_base64(obj):
@@ -231,6 +591,7 @@ def convert_base64_to_bytes(obj):
     else:
         return obj
 
+@timed('get_public_parameters_for_client')
 def get_public_parameters_for_client():
     """Lấy public parameters để gửi về client"""
     try:
@@ -257,6 +618,31 @@ def get_public_parameters_for_client():
     except Exception as e:
         print(f"Error getting public parameters for client: {e}")
         raise
+
+def get_public_parameters_payload():
+    """
+    Response JSON (bytes) của public parameters và content hash, build một lần cho mỗi
+    (PK fingerprint, attribute mapping version) rồi dùng lại từ memory.
+    """
+    global _public_parameters_payload
+    version_key = (get_public_parameters_fingerprint(), get_attribute_mapping_version())
+    cached = _public_parameters_payload
+    if cached is not None and cached[0] == version_key:
+        return cached[1], cached[2]
+    
+    body = json.dumps({
+        'success': True,
+        'data': get_public_parameters_for_client(),
+        'message': 'Public parameters retrieved successfully'
+    }).encode('utf-8')
+    content_hash = hashlib.sha256(body).hexdigest()[:32]
+    
+    _public_parameters_payload = (version_key, body, content_hash)
+    return body, content_hash
+
+async def aget_public_parameters_payload():
+    """get_public_parameters_payload cho async view (build lần đầu cần DB nên chạy trong thread)"""
+    return await sync_to_async(get_public_parameters_payload)()
     
 # ==================== USER ATTRIBUTE FUNCTIONS ====================
 
@@ -284,86 +670,28 @@ def add_user_attribute(user, attribute_name):
 
 # ==================== POLICY EVALUATION ====================
 
+@lru_cache(maxsize=POLICY_CACHE_SIZE)
+def _compile_attribute_policy(policy_string, mapping_version):
+    """Compile policy theo tên attribute sau khi chuyển sang số nguyên (cache theo mapping version)"""
+    name_to_int, _ = get_attribute_mapping()
+    return compile_policy(translate_policy(policy_string, name_to_int))
+
 def evaluate_policy_for_user(policy_string, user_attributes):
     """
-    Đánh giá xem user có thỏa mãn policy không
+    Đánh giá xem user có thỏa mãn policy không.
+    Policy được chuyển sang số nguyên giống client rồi đánh giá theo đúng ngữ nghĩa MSP của charm.
     """
     try:
-        return _evaluate_policy_recursive(policy_string.strip(), user_attributes)
-    except Exception as e:
+        compiled = _compile_attribute_policy(policy_string.strip(), get_attribute_mapping_version())
+    except PolicySyntaxError as e:
         print(f"Error evaluating policy '{policy_string}': {e}")
         return False
-
-def _evaluate_policy_recursive(policy, user_attributes):
-    """Recursive policy evaluation với proper precedence"""
-    policy = policy.strip()
-    
-    # Base case: single attribute
-    if not any(op in policy for op in [' OR ', ' AND ', 'NOT ', '(', ')']):
-        return policy in user_attributes
-    
-    # Handle NOT
-    if policy.startswith('NOT '):
-        inner_policy = policy[4:].strip()
-        return not _evaluate_policy_recursive(inner_policy, user_attributes)
-    
-    # Handle parentheses
-    if '(' in policy:
-        return _evaluate_with_parentheses(policy, user_attributes)
-    
-    # Handle OR (lower precedence)
-    if ' OR ' in policy:
-        or_parts = policy.split(' OR ')
-        return any(_evaluate_policy_recursive(part.strip(), user_attributes) for part in or_parts)
-    
-    # Handle AND (higher precedence)
-    if ' AND ' in policy:
-        and_parts = policy.split(' AND ')
-        return all(_evaluate_policy_recursive(part.strip(), user_attributes) for part in and_parts)
-    
-    return False
-
-def _evaluate_with_parentheses(policy, user_attributes):
-    """Handle parentheses in policy evaluation"""
-    result = ""
-    depth = 0
-    i = 0
-    
-    while i < len(policy):
-        char = policy[i]
-        
-        if char == '(':
-            if depth == 0:
-                # Start of parentheses group
-                start = i + 1
-            depth += 1
-        elif char == ')':
-            depth -= 1
-            if depth == 0:
-                # End of parentheses group
-                inner_expr = policy[start:i]
-                inner_result = _evaluate_policy_recursive(inner_expr, user_attributes)
-                result += str(inner_result).lower()  # Convert to 'true'/'false'
-            else:
-                result += char
-        elif depth == 0:
-            result += char
-        
-        i += 1
-    
-    # Replace 'true'/'false' with actual boolean evaluation
-    result = result.replace('true', 'True').replace('false', 'False')
     
-    # If we still have logical operators, evaluate recursively
-    if any(op in result for op in [' OR ', ' AND ', 'NOT ']):
-        # Convert True/False back to policy format for recursive evaluation
-        return _evaluate_policy_recursive(result, user_attributes)
-    
-    # Direct boolean evaluation
-    try:
-        return eval(result)
-    except:
-        return False
+    name_to_int, _ = get_attribute_mapping()
+    user_attribute_ids = frozenset(
+        str(name_to_int[name]) for name in user_attributes if name in name_to_int
+    )
+    return compiled.evaluate(user_attribute_ids)
     
 # ==================== MEDICAL DATA FUNCTIONS ====================
 
@@ -377,19 +705,257 @@ def get_user_medical_data(user):
     from .models import MedicalData
     return MedicalData.objects.filter(owner_user=user).order_by('-created_at')
 
-def create_medical_data_record(owner_user, patient_id=None, **encrypted_data):
+# ==================== DECRYPTABILITY PRE-FILTER ====================
+
+def extract_policy_from_key_blob(key_blob):
+    """Lấy policy (dạng số nguyên) từ AES key blob - JSON ciphertext CP-ABE do client tạo"""
+    if not key_blob:
+        return None
+    data = bytes(key_blob)
+    try:
+        try:
+            ciphertext = json.loads(data)
+        except ValueError:
+            ciphertext = json.loads(base64.b64decode(data))
+        policy = ciphertext['policy']
+    except (TypeError, ValueError, KeyError):
+        return None
+    return policy if isinstance(policy, str) else None
+
+def get_policy_fields(key_blob, prefix):
+    """Các field policy/bitset của MedicalData cho một AES key blob (prefix: patient_info | medical_record)"""
+    policy = extract_policy_from_key_blob(key_blob)
+    if policy is None:
+        return {}
+    try:
+        all_bits, required_bits = policy_bitsets(compile_policy(policy))
+    except PolicySyntaxError as e:
+        print(f"Cannot compile stored policy '{policy}': {e}")
+        all_bits, required_bits = None, None
+    return {
+        f'{prefix}_policy': policy,
+        f'{prefix}_policy_bits': all_bits,
+        f'{prefix}_required_bits': required_bits,
+    }
+
+def get_attribute_ids(attr_names):
+    """Tập cpabe_id (dạng chuỗi, giống attr_list trong secret key) của các attribute names"""
+    name_to_int, _ = get_attribute_mapping()
+    return frozenset(str(name_to_int[name]) for name in attr_names if name in name_to_int)
+
+async def aget_attribute_ids(attr_names):
+    """get_attribute_ids cho async view (mapping có thể phải load từ DB)"""
+    return await sync_to_async(get_attribute_ids)(attr_names)
+
+def get_user_attribute_ids(user):
+    """Tập cpabe_id của user (trong view nên dùng get_attribute_ids(request.abe_attributes.names))"""
+    return get_attribute_ids(get_user_attributes_list(user))
+
+def can_satisfy_stored_policy(policy, user_attribute_ids):
+    """True/False nếu biết policy; None cho bản ghi cũ không có policy (không xác định được)"""
+    if not policy:
+        return None
+    try:
+        return compile_policy(policy).evaluate(user_attribute_ids)
+    except PolicySyntaxError:
+        return None
+
+def _bitset_prefilter(prefix, user_bits):
     """
-    Tạo bản ghi MedicalData với dữ liệu đã mã hóa từ client
+    Điều kiện cần trong DB: policy chứa ít nhất một attribute của user và user có đủ
+    các attribute bắt buộc. Bản ghi không có bitset luôn được giữ lại.
     """
+    policy_bits = f'{prefix}_policy_bits'
+    required_bits = f'{prefix}_required_bits'
+    condition = (
+        Q(**{f'{policy_bits}__isnull': True})
+        | (~Q(**{f'{prefix}_hit': 0}) & Q(**{f'{prefix}_missing': 0}))
+    )
+    return condition, {
+        f'{prefix}_hit': F(policy_bits).bitand(user_bits),
+        f'{prefix}_missing': F(required_bits).bitand(~user_bits),
+    }
+
+def prefilter_decryptable_medical_data(queryset, user_attribute_ids):
+    """
+    Lọc trong DB bằng bitset: giữ các bản ghi mà tập attribute của user có thể
+    thỏa mãn ít nhất một trong hai policy (điều kiện cần, chưa chính xác).
+    """
+    user_bits = attribute_bits(user_attribute_ids)
+    if user_bits is None:
+        return queryset
+    patient_condition, patient_annotations = _bitset_prefilter('patient_info', user_bits)
+    medical_condition, medical_annotations = _bitset_prefilter('medical_record', user_bits)
+    return queryset.annotate(
+        **patient_annotations, **medical_annotations
+    ).filter(patient_condition | medical_condition)
+
+def is_possibly_decryptable(record):
+    """Sau annotate_decrypt_flags: user thỏa mãn ít nhất một policy (hoặc không xác định được)"""
+    return record.can_decrypt_patient_info is not False or record.can_decrypt_medical_record is not False
+
+def annotate_decrypt_flags(record, user_attribute_ids):
+    record.can_decrypt_patient_info = can_satisfy_stored_policy(record.patient_info_policy, user_attribute_ids)
+    record.can_decrypt_medical_record = can_satisfy_stored_policy(record.medical_record_policy, user_attribute_ids)
+    return record
+
+# ==================== MEDICAL DATA LISTING ====================
+
+# Các field cần cho danh sách medical record (không đọc các blob đã mã hóa)
+MEDICAL_DATA_LIST_FIELDS = (
+    'id', 'patient_id', 'created_at', 'owner_user__email',
+    'patient_info_policy', 'medical_record_policy',
+)
+# Các cột dữ liệu đã mã hóa của MedicalData
+MEDICAL_DATA_BLOB_FIELDS = (
+    'patient_info_aes_key_blob', 'patient_info_aes_iv_blob',
+    'patient_name_blob', 'patient_age_blob', 'patient_gender_blob', 'patient_phone_blob',
+    'medical_record_aes_key_blob', 'medical_record_aes_iv_blob',
+    'chief_complaint_blob', 'past_medical_history_blob', 'diagnosis_blob', 'status_blob',
+)
+MEDICAL_DATA_COUNT_CACHE_KEY = 'abe:medical_data_count'
+MEDICAL_DATA_COUNT_CACHE_TTL = 300
+
+def encode_medical_data_cursor(record):
+    """Cursor keyset (created_at, id) dạng chuỗi an toàn cho URL"""
+    raw = f"{record.created_at.isoformat()}|{record.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_medical_data_cursor(cursor):
+    """Giải mã cursor, raise ValueError nếu không hợp lệ"""
     try:
-        from .models import MedicalData
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, record_id = raw.split('|')
+        created_at = datetime.fromisoformat(created_at)
+        return created_at, int(record_id)
+    except (UnicodeError, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def get_medical_data_page(user_attribute_ids, cursor=None, page_size=50, decryptable_only=True):
+    """
+    Lấy một trang medical record (mới nhất trước) theo keyset (created_at, id).
+    Chỉ đọc MEDICAL_DATA_LIST_FIELDS. Khi decryptable_only, các bản ghi user không thể
+    giải mã bị bỏ qua và trang được lấp đầy bằng các batch tiếp theo.
+    Trả về (records, next_cursor) - next_cursor là None khi hết dữ liệu.
+    """
+    from .models import MedicalData
+    queryset = MedicalData.objects.select_related('owner_user').only(
+        *MEDICAL_DATA_LIST_FIELDS
+    ).order_by('-created_at', '-id')
+    if decryptable_only:
+        queryset = prefilter_decryptable_medical_data(queryset, user_attribute_ids)
+    
+    position = decode_medical_data_cursor(cursor) if cursor else None
+    records = []
+    while len(records) <= page_size:
+        batch_queryset = queryset
+        if position is not None:
+            created_at, record_id = position
+            batch_queryset = batch_queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=record_id)
+            )
+        batch = list(batch_queryset[:page_size + 1])
         
-        medical_record = MedicalData(
-            owner_user=owner_user,
-            patient_id=patient_id,  # THÊM MỚI: Lưu patient_id không mã hóa
-            **encrypted_data
-        )
+        for record in batch:
+            position = (record.created_at, record.id)
+            annotate_decrypt_flags(record, user_attribute_ids)
+            if not decryptable_only or is_possibly_decryptable(record):
+                records.append(record)
+                if len(records) > page_size:
+                    break
         
+        if len(batch) <= page_size:
+            break
+    
+    has_more = len(records) > page_size
+    records = records[:page_size]
+    next_cursor = encode_medical_data_cursor(records[-1]) if has_more else None
+    return records, next_cursor
+
+def get_medical_data_count():
+    """Tổng số medical record (cache ngắn hạn, xóa khi có bản ghi mới/bị xóa)"""
+    from .models import MedicalData
+    count = cache.get(MEDICAL_DATA_COUNT_CACHE_KEY)
+    if count is None:
+        count = MedicalData.objects.count()
+        cache.set(MEDICAL_DATA_COUNT_CACHE_KEY, count, timeout=MEDICAL_DATA_COUNT_CACHE_TTL)
+    return count
+
+def invalidate_medical_data_count():
+    cache.delete(MEDICAL_DATA_COUNT_CACHE_KEY)
+
+def serialize_medical_data_summary(record):
+    """Thông tin không mã hóa của bản ghi cho API danh sách"""
+    return {
+        'id': record.id,
+        'patient_id': record.patient_id,
+        'owner_user': record.owner_user.email if record.owner_user else None,
+        'created_at': record.created_at.isoformat(),
+        'can_decrypt_patient_info': record.can_decrypt_patient_info,
+        'can_decrypt_medical_record': record.can_decrypt_medical_record,
+    }
+
+MEDICAL_DATA_REQUIRED_FIELDS = (
+    'patient_id',
+    'patient_info_aes_key_blob',
+    'patient_info_aes_iv_blob',
+    'medical_record_aes_key_blob',
+    'medical_record_aes_iv_blob',
+)
+
+class MedicalRecordPayloadError(ValueError):
+    """Payload upload medical record không hợp lệ (error cho log, message cho người dùng)"""
+    def __init__(self, error, message):
+        super().__init__(error)
+        self.error = error
+        self.message = message
+
+def decode_medical_record_payload(data):
+    """
+    Validate và decode payload upload (các blob dạng base64) của một medical record.
+    Trả về (patient_id, encrypted_data) hoặc raise MedicalRecordPayloadError.
+    """
+    if not isinstance(data, dict):
+        raise MedicalRecordPayloadError('Record must be a JSON object', 'Dữ liệu JSON không hợp lệ')
+    
+    for field in MEDICAL_DATA_REQUIRED_FIELDS:
+        if field not in data:
+            raise MedicalRecordPayloadError(f'Missing required field: {field}', 'Thiếu thông tin bắt buộc')
+    
+    encrypted_data = {}
+    for field in MEDICAL_DATA_BLOB_FIELDS:
+        if field in data and data[field]:
+            try:
+                encrypted_data[field] = base64.b64decode(data[field])
+            except Exception:
+                raise MedicalRecordPayloadError(
+                    f'Invalid base64 data for field: {field}',
+                    f'Dữ liệu mã hóa không hợp lệ: {field}'
+                )
+    return data['patient_id'], encrypted_data
+
+def build_medical_data_record(owner_user, patient_id=None, **encrypted_data):
+    """Tạo (chưa lưu) MedicalData kèm policy và bitset lấy từ ciphertext"""
+    from .models import MedicalData
+    
+    # Lưu policy và bitset lấy từ ciphertext để lọc trước khi hiển thị
+    policy_fields = {}
+    policy_fields.update(get_policy_fields(encrypted_data.get('patient_info_aes_key_blob'), 'patient_info'))
+    policy_fields.update(get_policy_fields(encrypted_data.get('medical_record_aes_key_blob'), 'medical_record'))
+    
+    return MedicalData(
+        owner_user=owner_user,
+        patient_id=patient_id,  # THÊM MỚI: Lưu patient_id không mã hóa
+        **policy_fields,
+        **encrypted_data
+    )
+
+def create_medical_data_record(owner_user, patient_id=None, **encrypted_data):
+    """
+    Tạo bản ghi MedicalData với dữ liệu đã mã hóa từ client
+    """
+    try:
+        medical_record = build_medical_data_record(owner_user, patient_id, **encrypted_data)
         medical_record.save()
         print(f"Medical data record created: ID {medical_record.id} for patient: {patient_id}")
         return medical_record
@@ -398,6 +964,29 @@ def create_medical_data_record(owner_user, patient_id=None, **encrypted_data):
         print(f"Error creating medical data record: {e}")
         return None
 
+async def acreate_medical_data_record(owner_user, patient_id=None, **encrypted_data):
+    """create_medical_data_record cho async view (lưu bằng async ORM)"""
+    try:
+        medical_record = build_medical_data_record(owner_user, patient_id, **encrypted_data)
+        await medical_record.asave()
+        print(f"Medical data record created: ID {medical_record.id} for patient: {patient_id}")
+        return medical_record
+        
+    except Exception as e:
+        print(f"Error creating medical data record: {e}")
+        return None
+
+def bulk_create_medical_data_records(records):
+    """
+    Lưu một chunk MedicalData (chưa lưu) bằng bulk_create trong một transaction.
+    bulk_create không gửi post_save nên tự xóa cache tổng số bản ghi.
+    """
+    from .models import MedicalData
+    with transaction.atomic():
+        created = MedicalData.objects.bulk_create(records)
+    invalidate_medical_data_count()
+    return created
+
 def update_medical_data_record(medical_data_id, patient_id=None, **encrypted_data):
     """
     Cập nhật bản ghi MedicalData với dữ liệu đã mã hóa mới
@@ -425,4 +1014,296 @@ def update_medical_data_record(medical_data_id, patient_id=None, **encrypted_dat
         return None
     except Exception as e:
         print(f"Error updating medical data record: {e}")
-        return None
\ No newline at end of file
+        return None
+# ==================== OUTSOURCED DECRYPTION ====================
+
+# Outsourced decryption kiểu Green-Hohenberger-Waters cho Waters11:
+# - Client chọn z ngẫu nhiên, gửi transformation key TK = SK với mọi element lũy thừa 1/z (giữ z)
+# - Server chạy Waters11.decrypt với TK: mọi pairing trong decrypt tuyến tính theo element
+#   của key nên kết quả là c_m * e(g,g)^(-alpha*s/z); trả về (c_m, T = kết quả / c_m)
+# - Client tính message = c_m * T^z (một phép lũy thừa GT) rồi AES key = SHA-256(message)
+# Server không có z nên không suy ra được message/AES key.
+MAX_TRANSFORMATION_KEYS_PER_USER = 5
+TRANSFORM_GROUPS = ('patient_info', 'medical_record')
+
+class TransformationKeyError(ValueError):
+    """Transformation key không hợp lệ hoặc không còn khớp với attributes của user"""
+    def __init__(self, error, message):
+        super().__init__(error)
+        self.error = error
+        self.message = message
+
+def _deserialize_base64_element(group, value):
+    """Element charm từ base64(group.serialize()) - padding có thể bị thiếu như ở client"""
+    value = str(value)
+    return group.deserialize(base64.b64decode(value + '=' * (-len(value) % 4)))
+
+def parse_transformation_key(components, attr_integers):
+    """
+    Dict charm của transformation key từ JSON client gửi (cùng dạng 'secret_key' của
+    generate_user_secret_key, element đã lũy thừa 1/z). attr_list lấy từ attributes
+    hiện tại của user, không tin giá trị client gửi.
+    """
+    if not isinstance(components, dict):
+        raise TransformationKeyError('transform_key must be a JSON object', 'Transformation key không hợp lệ')
+    group = get_charm_group()
+    attr_list = [str(attr_int) for attr_int in attr_integers]
+    transform_key = {'attr_list': attr_list}
+    try:
+        for name, value in components.items():
+            if name in ('attr_list', 'attributes'):
+                continue
+            if isinstance(value, dict):
+                transform_key[name] = {str(k): _deserialize_base64_element(group, v) for k, v in value.items()}
+            elif isinstance(value, list):
+                transform_key[name] = [_deserialize_base64_element(group, item) for item in value]
+            else:
+                transform_key[name] = _deserialize_base64_element(group, value)
+    except Exception as e:
+        raise TransformationKeyError(f'Invalid transform key element: {e}', 'Transformation key không hợp lệ')
+    
+    # Mỗi attribute của user phải có thành phần tương ứng trong key
+    attribute_components = [value for value in transform_key.values() if isinstance(value, dict)]
+    if not attribute_components or any(not set(attr_list) <= set(value) for value in attribute_components):
+        raise TransformationKeyError(
+            'Transform key does not match the user attributes',
+            'Transformation key không khớp với thuộc tính hiện tại, vui lòng tải lại khóa'
+        )
+    return transform_key
+
+def store_transformation_key(user, components):
+    """Lưu transformation key của user (giữ tối đa MAX_TRANSFORMATION_KEYS_PER_USER key mới nhất)"""
+    from .models import TransformationKey
+    _, attr_integers, attribute_hash = _get_user_key_attributes(user)
+    transform_key = parse_transformation_key(components, attr_integers)
+    key_data = encode_key(get_charm_group(), KIND_TRANSFORM_KEY, transform_key)
+    
+    with transaction.atomic():
+        created = TransformationKey.objects.create(user=user, attribute_hash=attribute_hash, key_data=key_data)
+        stale_ids = list(
+            TransformationKey.objects.filter(user=user)
+            .order_by('-created_at')
+            .values_list('id', flat=True)[MAX_TRANSFORMATION_KEYS_PER_USER:]
+        )
+        if stale_ids:
+            TransformationKey.objects.filter(id__in=stale_ids).delete()
+    return created
+
+def get_transformation_key_data(user, key_id):
+    """key_data của transformation key còn hợp lệ (cùng tập attribute hiện tại) hoặc raise TransformationKeyError"""
+    from .models import TransformationKey
+    try:
+        transformation_key = TransformationKey.objects.get(id=key_id, user=user)
+    except (TransformationKey.DoesNotExist, ValidationError):
+        raise TransformationKeyError('Unknown transform key', 'Transformation key không tồn tại, vui lòng tạo lại')
+    _, _, attribute_hash = _get_user_key_attributes(user)
+    if transformation_key.attribute_hash != attribute_hash:
+        transformation_key.delete()
+        raise TransformationKeyError(
+            'Transform key is outdated',
+            'Thuộc tính của bạn đã thay đổi, transformation key cần được tạo lại'
+        )
+    return bytes(transformation_key.key_data)
+
+async def aget_transformation_key_data(user, key_id):
+    """get_transformation_key_data cho async view"""
+    return await sync_to_async(get_transformation_key_data)(user, key_id)
+
+def load_abe_ciphertext(key_blob):
+    """Ciphertext Waters11 (dict charm) từ AES key blob, đọc giống trang giải mã của client"""
+    group = get_charm_group()
+    data = bytes(key_blob)
+    try:
+        ciphertext_data = json.loads(data)
+    except ValueError:
+        ciphertext_data = json.loads(base64.b64decode(data))
+    
+    ciphertext = {}
+    for name, value in ciphertext_data.items():
+        if name == 'policy':
+            ciphertext[name] = get_waters11_scheme().util.createPolicy(str(value).strip())
+        elif name in ('attribute_list', '_key_verification'):
+            continue
+        elif isinstance(value, dict):
+            ciphertext[name] = {k: _deserialize_base64_element(group, v) for k, v in value.items()}
+        elif isinstance(value, list):
+            ciphertext[name] = [_deserialize_base64_element(group, item) for item in value]
+        else:
+            ciphertext[name] = _deserialize_base64_element(group, value)
+    return ciphertext
+
+def _message_component(group, ciphertext):
+    """Tên thành phần GT (c_m = e(g,g)^(alpha*s) * message) của ciphertext"""
+    from charm.toolbox.pairinggroup import GT
+    gt_prefix = f'{GT}:'.encode('ascii')
+    for name, value in ciphertext.items():
+        if name == 'policy' or isinstance(value, (dict, list)):
+            continue
+        if group.serialize(value).startswith(gt_prefix):
+            return name
+    raise ValueError('Ciphertext has no GT component')
+
+def transform_ciphertext(transform_key, ciphertext):
+    """
+    Phần pairing của Waters11.decrypt với transformation key.
+    Trả về (c_m, T) với message = c_m * T^z, hoặc None nếu attributes không thỏa mãn policy.
+    """
+    group = get_charm_group()
+    message_name = _message_component(group, ciphertext)
+    blinded = get_waters11_scheme().decrypt(load_public_parameters(), ciphertext, transform_key)
+    if blinded is None or blinded is False:
+        return None
+    message_component = ciphertext[message_name]
+    return message_component, blinded / message_component
+
+def transform_medical_record_keys(key_data, key_blobs):
+    """
+    Transform các AES key blob ({prefix: blob | None}) của một medical record.
+    Trả về {prefix: {'message', 'transformed'} (base64) | None}. Chỉ dùng charm (không DB)
+    nên chạy được trong crypto executor.
+    """
+    group = get_charm_group()
+    transform_key = decode_key(group, key_data, expected_kind=KIND_TRANSFORM_KEY)
+    result = {}
+    for prefix, key_blob in key_blobs.items():
+        transformed = transform_ciphertext(transform_key, load_abe_ciphertext(key_blob)) if key_blob else None
+        if transformed is None:
+            result[prefix] = None
+            continue
+        message_component, blinded = transformed
+        result[prefix] = {
+            'message': base64.b64encode(group.serialize(message_component)).decode('utf-8'),
+            'transformed': base64.b64encode(group.serialize(blinded)).decode('utf-8'),
+        }
+    return result
+
+def get_transform_key_blobs(record_id, user_attribute_ids):
+    """
+    {prefix: AES key blob} của medical record cho transform; bỏ (None) nhóm mà policy đã lưu
+    cho biết user chắc chắn không thỏa mãn để không tốn pairing. Raise MedicalData.DoesNotExist.
+    """
+    from .models import MedicalData
+    row = MedicalData.objects.filter(id=record_id).values_list(
+        'patient_info_aes_key_blob', 'medical_record_aes_key_blob',
+        'patient_info_policy', 'medical_record_policy',
+    ).first()
+    if row is None:
+        raise MedicalData.DoesNotExist(f"Medical record {record_id} not found")
+    key_blobs = {}
+    for prefix, key_blob, policy in zip(TRANSFORM_GROUPS, row[:2], row[2:]):
+        can_decrypt = can_satisfy_stored_policy(policy, user_attribute_ids)
+        key_blobs[prefix] = key_blob if key_blob and can_decrypt is not False else None
+    return key_blobs
+
+async def aget_transform_key_blobs(record_id, user_attribute_ids):
+    """get_transform_key_blobs cho async view"""
+    return await sync_to_async(get_transform_key_blobs)(record_id, user_attribute_ids)
+
+# ==================== BINARY RECORD CONTAINER ====================
+
+# Container nhị phân cho một medical record (thay cho JSON base64):
+#   MAGIC (4 bytes) | header_len (uint32 BE) | header JSON (UTF-8)
+#   rồi với mỗi blob khác rỗng: name_len (uint8) | name (ASCII) | data_len (uint32 BE) | data
+RECORD_CONTAINER_MAGIC = b'MDR1'
+RECORD_CONTAINER_CONTENT_TYPE = 'application/vnd.medical-record+octet-stream'
+
+_RECORD_METADATA_FIELDS = (
+    'id', 'patient_id', 'owner_user__email', 'created_at', 'created_date',
+    'patient_info_policy', 'medical_record_policy',
+)
+
+def get_medical_record_container_parts(record_id, user_attribute_ids):
+    """
+    Đọc một medical record bằng một query values_list (không tạo model instance).
+    Trả về (metadata dict, list (field_name, blob)). Raise MedicalData.DoesNotExist.
+    """
+    from .models import MedicalData
+    row = MedicalData.objects.filter(id=record_id).values_list(
+        *_RECORD_METADATA_FIELDS, *MEDICAL_DATA_BLOB_FIELDS
+    ).first()
+    if row is None:
+        raise MedicalData.DoesNotExist(f"Medical record {record_id} not found")
+    
+    record_id, patient_id, owner_email, created_at, created_date, patient_policy, medical_policy = row[:len(_RECORD_METADATA_FIELDS)]
+    metadata = {
+        'id': record_id,
+        'patient_id': patient_id,
+        'owner_user': owner_email,
+        'created_at': created_at.isoformat(),
+        'created_date': created_date.isoformat(),
+        'can_decrypt_patient_info': can_satisfy_stored_policy(patient_policy, user_attribute_ids),
+        'can_decrypt_medical_record': can_satisfy_stored_policy(medical_policy, user_attribute_ids),
+    }
+    blobs = row[len(_RECORD_METADATA_FIELDS):]
+    parts = [(name, blob) for name, blob in zip(MEDICAL_DATA_BLOB_FIELDS, blobs) if blob]
+    return metadata, parts
+
+def _container_part_header(name, data_length):
+    name_bytes = name.encode('ascii')
+    return bytes([len(name_bytes)]) + name_bytes + data_length.to_bytes(4, 'big')
+
+def get_medical_record_container_length(metadata, parts):
+    header_length = len(json.dumps(metadata).encode('utf-8'))
+    length = len(RECORD_CONTAINER_MAGIC) + 4 + header_length
+    for name, blob in parts:
+        length += 1 + len(name) + 4 + len(blob)
+    return length
+
+def iter_medical_record_container(metadata, parts):
+    """Generator các đoạn bytes của container (dùng cho StreamingHttpResponse)"""
+    header = json.dumps(metadata).encode('utf-8')
+    yield RECORD_CONTAINER_MAGIC + len(header).to_bytes(4, 'big') + header
+    for name, blob in parts:
+        yield _container_part_header(name, len(blob))
+        # memoryview/bytes từ DB driver được gửi thẳng, không encode lại
+        yield blob
+
+# ==================== BATCH RECORD FETCH ====================
+
+# Nhóm field -> các blob của nhóm (AES key blob, IV blob, rồi các field blob)
+MEDICAL_DATA_GROUP_BLOB_FIELDS = {
+    'patient_info': MEDICAL_DATA_BLOB_FIELDS[:6],
+    'medical_record': MEDICAL_DATA_BLOB_FIELDS[6:],
+}
+
+def _serialize_encrypted_row(row, blob_fields, user_attribute_ids, groups):
+    """Một dòng values_list -> dict như get_encrypted_medical_record, chỉ kèm blob của groups"""
+    record_id, patient_id, owner_email, created_at, created_date, patient_policy, medical_policy = row[:len(_RECORD_METADATA_FIELDS)]
+    record = {
+        'id': record_id,
+        'patient_id': patient_id,
+        'owner_user': owner_email,
+        'created_at': created_at.isoformat(),
+        'created_date': created_date.isoformat(),
+        'can_decrypt_patient_info': can_satisfy_stored_policy(patient_policy, user_attribute_ids),
+        'can_decrypt_medical_record': can_satisfy_stored_policy(medical_policy, user_attribute_ids),
+    }
+    blobs = dict(zip(blob_fields, row[len(_RECORD_METADATA_FIELDS):]))
+    for group in groups:
+        # Nhóm mà policy đã lưu cho biết user chắc chắn không giải mã được thì không gửi blob
+        if record[f'can_decrypt_{group}'] is False:
+            continue
+        for field in MEDICAL_DATA_GROUP_BLOB_FIELDS[group]:
+            blob = blobs[field]
+            record[field] = base64.b64encode(blob).decode('utf-8') if blob else None
+    return record
+
+def get_encrypted_medical_data_batch(record_ids, user_attribute_ids, groups=tuple(MEDICAL_DATA_GROUP_BLOB_FIELDS)):
+    """
+    Lấy nhiều medical record đã mã hóa bằng một query values_list, giữ thứ tự record_ids.
+    Chỉ đọc blob của groups; id không tồn tại bị bỏ qua.
+    """
+    from .models import MedicalData
+    blob_fields = [field for group in groups for field in MEDICAL_DATA_GROUP_BLOB_FIELDS[group]]
+    rows = MedicalData.objects.filter(id__in=record_ids).values_list(*_RECORD_METADATA_FIELDS, *blob_fields)
+    records = {row[0]: _serialize_encrypted_row(row, blob_fields, user_attribute_ids, groups) for row in rows}
+    return [records[record_id] for record_id in record_ids if record_id in records]
+
+def get_encrypted_medical_data_page(user_attribute_ids, cursor=None, page_size=50, decryptable_only=True,
+                                    groups=tuple(MEDICAL_DATA_GROUP_BLOB_FIELDS)):
+    """
+    Một trang medical record (cùng thứ tự/cursor với get_medical_data_page) kèm blob đã mã hóa.
+    Trả về (records, next_cursor).
+    """
+    records, next_cursor = get_medical_data_page(user_attribute_ids, cursor, page_size, decryptable_only)
+    return get_encrypted_medical_data_batch([record.id for record in records], user_attribute_ids, groups), next_cursor
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.translation import gettext_lazy as _
-from .models import User, Attribute, UserAttribute, MedicalData
+from .models import User, Attribute, UserAttribute, MedicalData, KeygenJob, TransformationKey
 
 
 class UserAttributeInline(admin.TabularInline):
@@ -47,9 +47,10 @@ class UserAdmin(BaseUserAdmin):
 
 @admin.register(Attribute)
 class AttributeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'get_users_count', 'description', 'created_at')
+    list_display = ('name', 'cpabe_id', 'get_users_count', 'description', 'created_at')
     search_fields = ('name', 'description')
     list_filter = ('created_at',)
+    readonly_fields = ('cpabe_id',)
     ordering = ('name',)
     
     def get_users_count(self, obj):
@@ -120,4 +121,35 @@ class MedicalDataAdmin(admin.ModelAdmin):
     
     def has_delete_permission(self, request, obj=None):
         """Cho phép xóa nhưng cần xác nhận"""
-        return request.user.is_superuser
\ No newline at end of file
+        return request.user.is_superuser
+
+
+@admin.register(KeygenJob)
+class KeygenJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'attempts', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__email',)
+    readonly_fields = ('user', 'status', 'error', 'attempts', 'created_at', 'started_at', 'finished_at')
+    exclude = ('result',)
+    ordering = ('-created_at',)
+    
+    def get_queryset(self, request):
+        """Optimize queries"""
+        return super().get_queryset(request).select_related('user')
+
+
+@admin.register(TransformationKey)
+class TransformationKeyAdmin(admin.ModelAdmin):
+    """Xóa transformation key để thu hồi outsourced decryption của một phiên"""
+    list_display = ('id', 'user', 'created_at')
+    search_fields = ('user__email',)
+    readonly_fields = ('id', 'user', 'attribute_hash', 'created_at')
+    exclude = ('key_data',)
+    ordering = ('-created_at',)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def get_queryset(self, request):
+        """Optimize queries"""
+        return super().get_queryset(request).select_related('user')
@@ -5,12 +5,6 @@ class BackendConfig(AppConfig):
     name = 'backend' # Tên app của bạn
 
     def ready(self):
-        from . import abe_utils
-        try:
-            abe_utils.init_charm_settings()
-            print("Charm-Crypto initialized successfully via AppConfig.")
-        except Exception as e:
-            print(f"Error initializing Charm-Crypto: {e}")
-
+        # Charm được khởi tạo lazy ở lần dùng đầu tiên (hoặc abe_utils.warm_up() trong gunicorn master)
         import backend.signals
         print("Backend signals imported.")
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Ảnh chụp attributes của user, tính một lần cho mỗi request (request.abe_attributes)
+và dùng chung cho middleware, decorators, context processor và views.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+USER_ATTRIBUTE_SNAPSHOT_CACHE_PREFIX = 'abe:user_attributes:'
+
+# Attribute được hiển thị là bác sĩ trong templates (gồm cả tên tiếng Việt)
+DOCTOR_ATTRIBUTE_NAMES = frozenset(['doctor', 'bac_si', 'bác sĩ'])
+# Attribute cấp quyền bác sĩ cho decorators (chỉ 'doctor')
+DOCTOR_ROLE_ATTRIBUTE_NAMES = frozenset(['doctor'])
+
+
+class UserAttributeSnapshot:
+    """Attributes của user tại thời điểm load (immutable, an toàn để cache)"""
+    __slots__ = ('user_attributes', 'names', 'is_doctor', 'has_doctor_role')
+
+    def __init__(self, user_attributes=()):
+        self.user_attributes = tuple(user_attributes)
+        self.names = frozenset(ua.attribute.name for ua in self.user_attributes)
+        self.is_doctor = not self.names.isdisjoint(DOCTOR_ATTRIBUTE_NAMES)
+        self.has_doctor_role = not self.names.isdisjoint(DOCTOR_ROLE_ATTRIBUTE_NAMES)
+
+    @property
+    def has_attributes(self):
+        return bool(self.names)
+
+    def __getstate__(self):
+        return self.user_attributes
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+
+EMPTY_SNAPSHOT = UserAttributeSnapshot()
+
+
+def get_snapshot_cache_key(user_id):
+    from .abe_utils import get_attribute_mapping_version
+    # Gắn với attribute mapping version để đổi tên/mô tả Attribute cũng làm mới snapshot
+    return f"{USER_ATTRIBUTE_SNAPSHOT_CACHE_PREFIX}{user_id}:{get_attribute_mapping_version()}"
+
+
+def load_user_attribute_snapshot(user):
+    """
+    Load snapshot từ cache (nếu bật ABE_USER_ATTRIBUTE_CACHE_TTL) hoặc từ DB.
+    Chỉ nên bật TTL khi cache dùng chung giữa các worker (REDIS_URL), nếu không
+    attribute bị thu hồi vẫn còn hiệu lực ở worker khác tới khi hết TTL.
+    """
+    if not user.is_authenticated:
+        return EMPTY_SNAPSHOT
+
+    timeout = getattr(settings, 'ABE_USER_ATTRIBUTE_CACHE_TTL', 0)
+    cache_key = get_snapshot_cache_key(user.pk) if timeout else None
+    if cache_key:
+        snapshot = cache.get(cache_key)
+        if snapshot is not None:
+            return snapshot
+
+    from .models import UserAttribute
+    snapshot = UserAttributeSnapshot(
+        UserAttribute.objects.filter(user=user).select_related('attribute').order_by('id')
+    )
+    if cache_key:
+        cache.set(cache_key, snapshot, timeout=timeout)
+    return snapshot
+
+
+def invalidate_user_attribute_snapshot(user_id):
+    """Xóa snapshot đã cache của user - gọi khi UserAttribute thay đổi"""
+    cache.delete(get_snapshot_cache_key(user_id))
+
+
+def attach_user_attribute_snapshot(request):
+    """Gắn request.abe_attributes (lazy - chỉ query khi được dùng lần đầu)"""
+    request.abe_attributes = SimpleLazyObject(lambda: load_user_attribute_snapshot(request.user))
+    return request.abe_attributes
+
+
+def get_request_attribute_snapshot(request):
+    """Snapshot của request hiện tại (tự gắn nếu middleware chưa chạy)"""
+    snapshot = getattr(request, 'abe_attributes', None)
+    if snapshot is None:
+        snapshot = attach_user_attribute_snapshot(request)
+    return snapshot
+
+
+async def aget_request_attribute_snapshot(request):
+    """
+    get_request_attribute_snapshot cho async view/middleware: snapshot được load
+    (cache/DB) trong thread thay vì lazy trên event loop.
+    """
+    snapshot = getattr(request, 'abe_attributes', None)
+    # type() không kích hoạt SimpleLazyObject (isinstance thì có)
+    if type(snapshot) is UserAttributeSnapshot:
+        return snapshot
+    user = await request.auser()
+    request.abe_attributes = await sync_to_async(load_user_attribute_snapshot)(user)
+    return request.abe_attributes
@@ -0,0 +1,3 @@
+"""
+Benchmark cho đường crypto CP-ABE. Chạy bằng:  python manage.py run_crypto_benchmarks --help
+"""
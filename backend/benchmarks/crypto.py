@@ -0,0 +1,300 @@
+"""
+Micro-benchmark cho đường crypto Waters11: setup, keygen, encrypt, decrypt và
+serialize/deserialize (JSON base64 gửi cho client và định dạng nhị phân key_format).
+
+Mỗi kết quả là một dict phẳng (một dòng CSV) để so sánh giữa các commit.
+"""
+import csv
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from abe_common.key_format import KIND_PUBLIC_KEY, KIND_SECRET_KEY, decode_key, encode_key
+
+POLICY_SHAPES = ('and', 'or', 'mixed')
+
+# Các cột xác định một phép đo (dùng để ghép kết quả khi so sánh)
+CASE_FIELDS = ('group', 'uni_size', 'attributes', 'policy_size', 'policy_shape', 'operation')
+STAT_FIELDS = (
+    'iterations', 'mean_ms', 'median_ms', 'p95_ms', 'min_ms', 'max_ms', 'stdev_ms',
+    'ops_per_sec', 'size_bytes',
+)
+RESULT_FIELDS = CASE_FIELDS + STAT_FIELDS
+
+
+class BenchmarkError(Exception):
+    """Cấu hình benchmark không hợp lệ hoặc kết quả crypto sai"""
+
+
+# ==================== MEASUREMENT ====================
+
+def measure(func, iterations, warmup=0):
+    """Chạy func warmup lần (không đo) rồi iterations lần; trả về thống kê thời gian (ms)"""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    mean = statistics.mean(timings)
+    return {
+        'iterations': iterations,
+        'mean_ms': round(mean, 4),
+        'median_ms': round(statistics.median(timings), 4),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+        'min_ms': round(timings[0], 4),
+        'max_ms': round(timings[-1], 4),
+        'stdev_ms': round(statistics.stdev(timings), 4) if len(timings) > 1 else 0.0,
+        'ops_per_sec': round(1000 / mean, 2) if mean else None,
+    }
+
+
+def build_policy(attributes, shape):
+    """
+    Policy trên danh sách attribute:
+    'and' - tất cả, 'or' - bất kỳ, 'mixed' - cây cân bằng xen kẽ AND/OR.
+    """
+    if shape == 'and':
+        return ' and '.join(attributes)
+    if shape == 'or':
+        return ' or '.join(attributes)
+    if shape == 'mixed':
+        return _build_mixed_policy(attributes, is_and=True)
+    raise BenchmarkError(f"Unknown policy shape {shape!r}; expected one of {', '.join(POLICY_SHAPES)}")
+
+
+def _build_mixed_policy(attributes, is_and):
+    if len(attributes) == 1:
+        return attributes[0]
+    middle = len(attributes) // 2
+    operator = ' and ' if is_and else ' or '
+    left = _build_mixed_policy(attributes[:middle], not is_and)
+    right = _build_mixed_policy(attributes[middle:], not is_and)
+    return f"({left}{operator}{right})"
+
+
+def _json_serialize(group, charm_object):
+    from backend.abe_utils import convert_bytes_to_base64, serialize_charm_object
+    return json.dumps(convert_bytes_to_base64(serialize_charm_object(group, charm_object))).encode('utf-8')
+
+
+def _json_deserialize(group, data):
+    from backend.abe_utils import convert_base64_to_bytes, deserialize_charm_object
+    return deserialize_charm_object(group, convert_base64_to_bytes(json.loads(data)))
+
+
+# ==================== BENCHMARK CASES ====================
+
+class SchemeContext:
+    """Group, Waters11 scheme và PK/MSK cho một cặp (pairing group, uni_size)"""
+
+    def __init__(self, group_name, uni_size, precompute):
+        from charm.toolbox.pairinggroup import PairingGroup
+        from charm.schemes.abenc.waters11 import Waters11
+        from backend.abe_utils import precompute_fixed_bases
+
+        self.group_name = group_name
+        self.uni_size = uni_size
+        self.group = PairingGroup(group_name)
+        self.scheme = Waters11(self.group, uni_size=uni_size, verbose=False)
+        self.pk, self.msk = self.scheme.setup()
+        if precompute:
+            precompute_fixed_bases(self.pk)
+
+    def row(self, operation, stats, attributes=0, policy_size=0, policy_shape='', size_bytes=None):
+        result = {
+            'group': self.group_name,
+            'uni_size': self.uni_size,
+            'attributes': attributes,
+            'policy_size': policy_size,
+            'policy_shape': policy_shape,
+            'operation': operation,
+        }
+        result.update(stats)
+        result['size_bytes'] = size_bytes
+        return result
+
+
+def benchmark_setup(context, iterations, warmup):
+    """setup() và kích thước PK ở dạng JSON (API) và nhị phân (key_format)"""
+    rows = [context.row('setup', measure(context.scheme.setup, iterations, warmup))]
+    rows.extend(_serialization_rows(context, 'pk', context.pk, KIND_PUBLIC_KEY, iterations, warmup))
+    return rows
+
+
+def benchmark_keygen(context, num_attributes, iterations, warmup):
+    attr_list = [str(i) for i in range(1, num_attributes + 1)]
+    stats = measure(lambda: context.scheme.keygen(context.pk, context.msk, attr_list), iterations, warmup)
+    secret_key = context.scheme.keygen(context.pk, context.msk, attr_list)
+    rows = [context.row('keygen', stats, attributes=num_attributes)]
+    for row in _serialization_rows(context, 'sk', secret_key, KIND_SECRET_KEY, iterations, warmup):
+        row['attributes'] = num_attributes
+        rows.append(row)
+    return rows, secret_key
+
+
+def benchmark_encrypt_decrypt(context, secret_key, num_attributes, policy_size, shape, iterations, warmup):
+    """encrypt/decrypt với policy policy_size leaf; secret_key có num_attributes attribute (thỏa mãn policy)"""
+    from charm.toolbox.pairinggroup import GT
+
+    policy = build_policy([str(i) for i in range(1, policy_size + 1)], shape)
+    message = context.group.random(GT)
+    ciphertext = context.scheme.encrypt(context.pk, message, policy)
+    if context.scheme.decrypt(context.pk, ciphertext, secret_key) != message:
+        raise BenchmarkError(f"Decryption failed for policy {policy!r}")
+
+    case = {'attributes': num_attributes, 'policy_size': policy_size, 'policy_shape': shape}
+    rows = [
+        context.row('encrypt', measure(lambda: context.scheme.encrypt(context.pk, message, policy), iterations, warmup), **case),
+        context.row('decrypt', measure(lambda: context.scheme.decrypt(context.pk, ciphertext, secret_key), iterations, warmup), **case),
+    ]
+
+    # Client lưu policy của ciphertext dưới dạng chuỗi (BinNode không serialize được)
+    stored_ciphertext = dict(ciphertext, policy=policy)
+    ciphertext_json = _json_serialize(context.group, stored_ciphertext)
+    rows.append(context.row(
+        'ct_serialize_json',
+        measure(lambda: _json_serialize(context.group, stored_ciphertext), iterations, warmup),
+        size_bytes=len(ciphertext_json), **case,
+    ))
+    rows.append(context.row(
+        'ct_deserialize_json',
+        measure(lambda: _json_deserialize(context.group, ciphertext_json), iterations, warmup),
+        size_bytes=len(ciphertext_json), **case,
+    ))
+    return rows
+
+
+def _serialization_rows(context, label, key, kind, iterations, warmup):
+    """Đo serialize/deserialize của key ở dạng JSON base64 (API hiện tại) và key_format"""
+    group = context.group
+    key_json = _json_serialize(group, key)
+    key_binary = encode_key(group, kind, key)
+    return [
+        context.row(f'{label}_serialize_json', measure(lambda: _json_serialize(group, key), iterations, warmup),
+                    size_bytes=len(key_json)),
+        context.row(f'{label}_deserialize_json', measure(lambda: _json_deserialize(group, key_json), iterations, warmup),
+                    size_bytes=len(key_json)),
+        context.row(f'{label}_serialize_binary', measure(lambda: encode_key(group, kind, key), iterations, warmup),
+                    size_bytes=len(key_binary)),
+        context.row(f'{label}_deserialize_binary', measure(lambda: decode_key(group, key_binary, kind), iterations, warmup),
+                    size_bytes=len(key_binary)),
+    ]
+
+
+def run_sweep(groups, uni_sizes, attribute_counts, policy_sizes, policy_shapes,
+              iterations, warmup, setup_iterations, precompute=True, progress=None):
+    """
+    Chạy toàn bộ sweep, yield từng dòng kết quả.
+    Policy size > số attribute của key hoặc số attribute > uni_size bị bỏ qua.
+    """
+    for shape in policy_shapes:
+        if shape not in POLICY_SHAPES:
+            raise BenchmarkError(f"Unknown policy shape {shape!r}; expected one of {', '.join(POLICY_SHAPES)}")
+
+    for group_name in groups:
+        for uni_size in uni_sizes:
+            if progress:
+                progress(f"group={group_name} uni_size={uni_size}: setup")
+            context = SchemeContext(group_name, uni_size, precompute)
+            yield from benchmark_setup(context, setup_iterations, min(warmup, setup_iterations))
+
+            for num_attributes in attribute_counts:
+                # Attribute của Waters11 là số nguyên trong [1, uni_size] (h[0] không dùng)
+                if not 1 <= num_attributes <= uni_size:
+                    continue
+                if progress:
+                    progress(f"group={group_name} uni_size={uni_size} attributes={num_attributes}")
+                rows, secret_key = benchmark_keygen(context, num_attributes, iterations, warmup)
+                yield from rows
+
+                for policy_size in policy_sizes:
+                    if not 1 <= policy_size <= num_attributes:
+                        continue
+                    for shape in policy_shapes:
+                        if policy_size == 1 and shape != policy_shapes[0]:
+                            continue  # Policy một leaf giống nhau với mọi shape
+                        yield from benchmark_encrypt_decrypt(
+                            context, secret_key, num_attributes, policy_size, shape, iterations, warmup
+                        )
+
+
+# ==================== EXPORT / COMPARE ====================
+
+def collect_metadata():
+    """Thông tin môi trường đi kèm kết quả (commit, Python, máy)"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        from importlib.metadata import version
+        charm_version = version('Charm-Crypto')
+    except Exception:
+        charm_version = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': commit,
+        'python': sys.version.split()[0],
+        'charm_crypto': charm_version,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def write_json(path, metadata, parameters, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'metadata': metadata, 'parameters': parameters, 'results': results}, f, indent=2)
+
+
+def write_csv(path, results):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for row in results:
+            writer.writerow({field: row.get(field) for field in RESULT_FIELDS})
+
+
+def load_results(path):
+    """Đọc kết quả từ file JSON hoặc CSV đã export"""
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def _case_key(row):
+    return tuple(str(row.get(field, '')) for field in CASE_FIELDS)
+
+
+def compare_results(baseline, current, threshold_percent):
+    """
+    Ghép kết quả theo CASE_FIELDS, trả về list (row hiện tại, mean baseline, % thay đổi, regression?).
+    Regression khi mean_ms tăng quá threshold_percent.
+    """
+    baseline_by_case = {_case_key(row): row for row in baseline}
+    comparisons = []
+    for row in current:
+        base = baseline_by_case.get(_case_key(row))
+        if base is None or base.get('mean_ms') in (None, ''):
+            continue
+        # mean_ms đọc từ CSV là chuỗi ('0.0' vẫn truthy) nên kiểm tra sau khi chuyển sang float
+        base_mean = float(base['mean_ms'])
+        if not base_mean:
+            continue
+        change = (float(row['mean_ms']) - base_mean) / base_mean * 100
+        comparisons.append((row, base_mean, change, change > threshold_percent))
+    return comparisons
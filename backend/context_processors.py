@@ -1,32 +1,42 @@
-from .models import UserAttribute
+from django.urls import reverse
+from django.utils.functional import lazy
+from .attribute_snapshot import get_request_attribute_snapshot
 
 def user_attributes_context(request):
     """
     Context processor để thêm thông tin attributes vào tất cả templates
+    (đọc từ snapshot của request, không query thêm)
     """
-    context = {}
+    snapshot = get_request_attribute_snapshot(request)
     
     if request.user.is_authenticated:
-        # Kiểm tra user có attributes hay không
-        has_attributes = UserAttribute.objects.filter(user=request.user).exists()
-        user_attributes = UserAttribute.objects.filter(user=request.user)
-        
-        # Kiểm tra user có phải bác sĩ không
-        is_doctor = UserAttribute.objects.filter(
-            user=request.user,
-            attribute__name__in=['doctor', 'bac_si', 'bác sĩ']
-        ).exists()
-        
-        context.update({
-            'has_attributes': has_attributes,
-            'user_attributes': user_attributes,
-            'is_doctor': is_doctor,
-        })
-    else:
-        context.update({
-            'has_attributes': False,
-            'user_attributes': None,
-            'is_doctor': False,
-        })
+        return {
+            'has_attributes': snapshot.has_attributes,
+            'user_attributes': snapshot.user_attributes,
+            'is_doctor': snapshot.is_doctor,
+        }
     
-    return context 
\ No newline at end of file
+    return {
+        'has_attributes': False,
+        'user_attributes': None,
+        'is_doctor': False,
+    }
+
+
+def _public_key_url():
+    """URL public parameters có content hash (cache vĩnh viễn), fallback về URL thường"""
+    try:
+        from .abe_utils import get_public_parameters_payload
+        return reverse('get_public_parameters_versioned', args=[get_public_parameters_payload()[1]])
+    except Exception as e:
+        print(f"Error building versioned public key URL: {e}")
+        return reverse('get_public_parameters')
+
+
+def abe_public_key_context(request):
+    """
+    Context processor thêm abe_public_key_url (lazy - chỉ tính khi template dùng tới)
+    """
+    return {
+        'abe_public_key_url': lazy(_public_key_url, str)(),
+    }
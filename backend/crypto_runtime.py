@@ -0,0 +1,250 @@
+"""
+Bundle Pyodide + charm wheel tự host cho trang upload và trang xem hồ sơ.
+
+Lệnh fetch_crypto_runtime tải Pyodide core, các package trong pyodide-lock.json và các wheel
+(charm cùng dependency thuần Python) vào static/crypto_runtime/<bundle hash>/ rồi ghi
+static/crypto_runtime/manifest.json. Tên thư mục là hash nội dung nên mọi file được phục vụ
+với Cache-Control immutable; service worker precache cả bundle để trang boot được khi mạng
+chậm hoặc mất kết nối. Khi chưa build bundle, client dùng CDN như trước.
+"""
+import hashlib
+import json
+import os
+import shutil
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import reverse
+
+RUNTIME_STATIC_DIR = 'crypto_runtime'
+MANIFEST_NAME = 'manifest.json'
+
+DEFAULT_PYODIDE_VERSION = '0.27.7'
+PYODIDE_CDN_URL = 'https://cdn.jsdelivr.net/pyodide/v{version}/full/'
+# File core mà pyodide.js tải từ indexURL khi boot
+PYODIDE_CORE_FILES = ('pyodide.js', 'pyodide.asm.js', 'pyodide.asm.wasm', 'python_stdlib.zip', 'pyodide-lock.json')
+
+CHARM_WHEEL_URL = (
+    'https://quackusarle.github.io/charm_crypto_wheel_for_pyodide/'
+    'charm_crypto-0.50-cp312-cp312-pyodide_2024_0_wasm32.whl'
+)
+# Dependency của Charm-Crypto 0.50 (trước đây micropip tải từ PyPI), cùng version với requirements.txt
+DEFAULT_PYPI_WHEELS = ('pyparsing==2.4.0', 'hypothesis==6.133.2', 'attrs==25.3.0', 'sortedcontainers==2.4.0')
+PYPI_JSON_URL = 'https://pypi.org/pypi/{name}/{version}/json'
+
+DOWNLOAD_TIMEOUT = 120
+
+# (mtime manifest, manifest) - thay nguyên tuple nên đọc giữa các thread là an toàn
+_manifest_cache = None
+
+
+class CryptoRuntimeError(Exception):
+    """Không tải hoặc không build được bundle crypto runtime"""
+
+
+# ==================== BUILD ====================
+
+def get_runtime_root():
+    """Thư mục nguồn của bundle (nằm trong STATICFILES_DIRS để collectstatic copy)"""
+    return Path(settings.BASE_DIR) / 'static' / RUNTIME_STATIC_DIR
+
+
+def _download(url, destination, expected_sha256=None):
+    """Tải url vào destination, trả về sha256 hex của nội dung"""
+    digest = hashlib.sha256()
+    try:
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(destination, 'wb') as f:
+            while True:
+                chunk = response.read(1024 * 1024)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+    except OSError as e:
+        raise CryptoRuntimeError(f"Cannot download {url}: {e}")
+    checksum = digest.hexdigest()
+    if expected_sha256 and checksum != expected_sha256:
+        raise CryptoRuntimeError(f"Checksum mismatch for {url}: expected {expected_sha256}, got {checksum}")
+    return checksum
+
+
+def resolve_pypi_wheel(requirement):
+    """URL, tên file và sha256 của wheel thuần Python (py3-none-any) cho requirement 'name==version'"""
+    name, separator, version = requirement.partition('==')
+    if not separator or not name.strip() or not version.strip():
+        raise CryptoRuntimeError(f"Wheel requirement must be pinned as name==version, got {requirement!r}")
+    url = PYPI_JSON_URL.format(name=name.strip(), version=version.strip())
+    try:
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+            release = json.load(response)
+    except (OSError, ValueError) as e:
+        raise CryptoRuntimeError(f"Cannot query PyPI for {requirement}: {e}")
+    for release_file in release.get('urls', []):
+        filename = release_file['filename']
+        if release_file.get('packagetype') == 'bdist_wheel' and filename.endswith('-none-any.whl'):
+            return release_file['url'], filename, release_file.get('digests', {}).get('sha256')
+    raise CryptoRuntimeError(f"{requirement} has no pure-Python wheel on PyPI")
+
+
+def _resolve_lock_packages(lock, names):
+    """Tên file các package trong pyodide-lock.json (kèm dependency) cần cho names"""
+    packages = lock.get('packages', {})
+    resolved = {}
+    pending = [name.lower() for name in names]
+    while pending:
+        name = pending.pop()
+        if name in resolved:
+            continue
+        if name not in packages:
+            raise CryptoRuntimeError(f"Package {name!r} is not in pyodide-lock.json")
+        entry = packages[name]
+        resolved[name] = entry
+        pending.extend(dependency.lower() for dependency in entry.get('depends', []))
+    return resolved
+
+
+def build_bundle(pyodide_version=DEFAULT_PYODIDE_VERSION, packages=(), charm_wheel_url=CHARM_WHEEL_URL,
+                 pypi_wheels=DEFAULT_PYPI_WHEELS, keep_old=False, progress=None):
+    """
+    Tải bundle vào thư mục tạm, đặt tên thư mục theo hash nội dung rồi ghi manifest.
+    Trả về manifest. Bundle cũ bị xóa trừ khi keep_old.
+    """
+    def report(message):
+        if progress:
+            progress(message)
+
+    root = get_runtime_root()
+    root.mkdir(parents=True, exist_ok=True)
+    staging = root / f'.staging-{os.getpid()}'
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+
+    try:
+        files = {}
+        cdn_url = PYODIDE_CDN_URL.format(version=pyodide_version)
+        for name in PYODIDE_CORE_FILES:
+            report(f"Downloading {cdn_url}{name}")
+            files[name] = _download(cdn_url + name, staging / name)
+
+        with open(staging / 'pyodide-lock.json', encoding='utf-8') as f:
+            lock = json.load(f)
+        lock_packages = _resolve_lock_packages(lock, packages)
+        for entry in lock_packages.values():
+            report(f"Downloading {cdn_url}{entry['file_name']}")
+            files[entry['file_name']] = _download(
+                cdn_url + entry['file_name'], staging / entry['file_name'], entry.get('sha256')
+            )
+
+        wheels = []
+        wheel_sources = [(charm_wheel_url, charm_wheel_url.rsplit('/', 1)[-1], None)]
+        wheel_sources.extend(resolve_pypi_wheel(requirement) for requirement in pypi_wheels)
+        for url, filename, sha256 in wheel_sources:
+            report(f"Downloading {url}")
+            files[filename] = _download(url, staging / filename, sha256)
+            wheels.append(filename)
+
+        bundle_digest = hashlib.sha256()
+        for name in sorted(files):
+            bundle_digest.update(f"{name}:{files[name]}\n".encode('utf-8'))
+        version = bundle_digest.hexdigest()[:16]
+
+        bundle_dir = root / version
+        if bundle_dir.exists():
+            shutil.rmtree(staging)
+        else:
+            staging.rename(bundle_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    manifest = {
+        'version': version,
+        'pyodide_version': pyodide_version,
+        'packages': sorted(lock_packages),
+        'wheels': wheels,
+        'files': files,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+    }
+    manifest_path = root / MANIFEST_NAME
+    temporary_path = root / f'{MANIFEST_NAME}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temporary_path, manifest_path)
+
+    if not keep_old:
+        for path in root.iterdir():
+            if path.is_dir() and path.name != version and not path.name.startswith('.'):
+                report(f"Removing old bundle {path.name}")
+                shutil.rmtree(path, ignore_errors=True)
+    return manifest
+
+
+# ==================== RUNTIME ====================
+
+def find_runtime_file(relative_path):
+    """Đường dẫn file của bundle: thư mục static nguồn, hoặc STATIC_ROOT sau collectstatic"""
+    candidates = [get_runtime_root()]
+    if settings.STATIC_ROOT:
+        candidates.append(Path(settings.STATIC_ROOT) / RUNTIME_STATIC_DIR)
+    for base in candidates:
+        if (base / relative_path).is_file():
+            return base / relative_path
+    return None
+
+
+def load_manifest():
+    """Manifest của bundle hiện tại (đọc lại khi file đổi), None nếu chưa build"""
+    global _manifest_cache
+    path = find_runtime_file(MANIFEST_NAME)
+    if path is None:
+        return None
+    mtime = path.stat().st_mtime_ns
+    cached = _manifest_cache
+    if cached is not None and cached[0] == (path, mtime):
+        return cached[1]
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    _manifest_cache = ((path, mtime), manifest)
+    return manifest
+
+
+def get_runtime_config():
+    """
+    Cấu hình boot cho client (crypto_runtime.js): bundle tự host nếu đã build,
+    ngược lại Pyodide từ CDN và micropip.install charm wheel như trước.
+    """
+    manifest = load_manifest()
+    if manifest is None:
+        cdn_url = PYODIDE_CDN_URL.format(version=DEFAULT_PYODIDE_VERSION)
+        return {
+            'version': None,
+            'index_url': cdn_url,
+            'script_url': cdn_url + 'pyodide.js',
+            'packages': [],
+            'wheel_urls': [],
+            'charm_wheel_url': CHARM_WHEEL_URL,
+            'service_worker_url': None,
+        }
+
+    index_url = reverse('crypto_runtime_file', args=[manifest['version'], 'pyodide.js'])[:-len('pyodide.js')]
+    return {
+        'version': manifest['version'],
+        'index_url': index_url,
+        'script_url': index_url + 'pyodide.js',
+        'packages': manifest['packages'],
+        'wheel_urls': [index_url + wheel for wheel in manifest['wheels']],
+        'charm_wheel_url': None,
+        'service_worker_url': reverse('crypto_runtime_service_worker'),
+    }
+
+
+def get_precache_urls():
+    """URL mọi file của bundle hiện tại cho service worker"""
+    manifest = load_manifest()
+    if manifest is None:
+        return None, []
+    return manifest['version'], [
+        reverse('crypto_runtime_file', args=[manifest['version'], name]) for name in sorted(manifest['files'])
+    ]
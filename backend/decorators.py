@@ -3,7 +3,8 @@ from django.shortcuts import redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
-from .models import UserAttribute
+from asgiref.sync import iscoroutinefunction
+from .attribute_snapshot import aget_request_attribute_snapshot, get_request_attribute_snapshot
 
 def requires_attributes(redirect_url='home'):
     """
@@ -15,7 +16,7 @@ def requires_attributes(redirect_url='home'):
         @login_required
         def wrapper(request, *args, **kwargs):
             # Kiểm tra user có attribute nào không
-            has_attributes = UserAttribute.objects.filter(user=request.user).exists()
+            has_attributes = get_request_attribute_snapshot(request).has_attributes
             
             if not has_attributes:
                 messages.warning(
@@ -28,23 +29,37 @@ def requires_attributes(redirect_url='home'):
         return wrapper
     return decorator
 
+def _no_attributes_response():
+    return JsonResponse({
+        'success': False,
+        'error': 'ACCESS_DENIED',
+        'message': 'Bạn chưa được gán thuộc tính truy cập. Vui lòng liên hệ quản trị viên.'
+    }, status=403)
+
 def api_requires_attributes():
     """
-    Decorator cho API endpoints - trả về JSON error thay vì redirect
+    Decorator cho API endpoints - trả về JSON error thay vì redirect.
+    Hỗ trợ cả async view (snapshot được load ngoài event loop).
     """
     def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            @login_required
+            async def async_wrapper(request, *args, **kwargs):
+                snapshot = await aget_request_attribute_snapshot(request)
+                if not snapshot.has_attributes:
+                    return _no_attributes_response()
+                return await view_func(request, *args, **kwargs)
+            return async_wrapper
+
         @wraps(view_func)
         @login_required
         def wrapper(request, *args, **kwargs):
             # Kiểm tra user có attribute nào không
-            has_attributes = UserAttribute.objects.filter(user=request.user).exists()
+            has_attributes = get_request_attribute_snapshot(request).has_attributes
             
             if not has_attributes:
-                return JsonResponse({
-                    'success': False,
-                    'error': 'ACCESS_DENIED',
-                    'message': 'Bạn chưa được gán thuộc tính truy cập. Vui lòng liên hệ quản trị viên.'
-                }, status=403)
+                return _no_attributes_response()
             
             return view_func(request, *args, **kwargs)
         return wrapper
@@ -59,10 +74,7 @@ def requires_doctor_role(redirect_url='home'):
         @login_required
         def wrapper(request, *args, **kwargs):
             # Kiểm tra user có attribute doctor không
-            is_doctor = UserAttribute.objects.filter(
-                user=request.user,
-                attribute__name__in=['doctor']
-            ).exists()
+            is_doctor = get_request_attribute_snapshot(request).has_doctor_role
             
             if not is_doctor:
                 messages.error(
@@ -75,26 +87,37 @@ def requires_doctor_role(redirect_url='home'):
         return wrapper
     return decorator
 
+def _doctor_only_response():
+    return JsonResponse({
+        'success': False,
+        'error': 'DOCTOR_ONLY',
+        'message': 'Chỉ có bác sĩ mới có quyền sử dụng chức năng này.'
+    }, status=403)
+
 def api_requires_doctor_role():
     """
-    Decorator cho API endpoints - chỉ cho phép bác sĩ truy cập
+    Decorator cho API endpoints - chỉ cho phép bác sĩ truy cập.
+    Hỗ trợ cả async view (snapshot được load ngoài event loop).
     """
     def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            @login_required
+            async def async_wrapper(request, *args, **kwargs):
+                snapshot = await aget_request_attribute_snapshot(request)
+                if not snapshot.has_doctor_role:
+                    return _doctor_only_response()
+                return await view_func(request, *args, **kwargs)
+            return async_wrapper
+
         @wraps(view_func)
         @login_required
         def wrapper(request, *args, **kwargs):
             # Kiểm tra user có attribute doctor không
-            is_doctor = UserAttribute.objects.filter(
-                user=request.user,
-                attribute__name__in=['doctor']
-            ).exists()
+            is_doctor = get_request_attribute_snapshot(request).has_doctor_role
             
             if not is_doctor:
-                return JsonResponse({
-                    'success': False,
-                    'error': 'DOCTOR_ONLY',
-                    'message': 'Chỉ có bác sĩ mới có quyền sử dụng chức năng này.'
-                }, status=403)
+                return _doctor_only_response()
             
             return view_func(request, *args, **kwargs)
         return wrapper
@@ -0,0 +1,266 @@
+"""
+Ingest hàng loạt dữ liệu y tế dạng plaintext (export CSV/JSONL của bệnh viện) trên server tin cậy.
+
+Mã hóa giống hệt trang upload (medical_upload.js) để trang xem hồ sơ giải mã được không cần thay đổi:
+- Mỗi nhóm field (thông tin bệnh nhân, hồ sơ y tế) có một GT message ngẫu nhiên,
+  AES key = SHA-256(group.serialize(GT message)), GT message được mã hóa Waters11 theo policy
+- Các field trong nhóm mã hóa AES-GCM với cùng key và IV 12 byte của nhóm
+- Blob lưu ở dạng giống upload API sau khi base64-decode: key blob là JSON ciphertext CP-ABE,
+  IV và field blob là bytes thô (ciphertext kèm tag GCM)
+
+Khác client: GT message lấy từ group.random(GT) thay vì lũy thừa seed 32 bit của AES key,
+và ciphertext không có '_key_verification' (client giải mã không dùng field này).
+
+Phép mã hóa chạy song song trên ProcessPoolExecutor (worker chỉ dùng charm, không dùng DB);
+process chính tạo MedicalData và bulk_create theo từng batch.
+"""
+import base64
+import csv
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from backend.policy import translate_policy
+
+INPUT_FORMATS = ('csv', 'jsonl')
+
+# Nhóm field: (prefix key/IV blob, các field plaintext -> field blob)
+FIELD_GROUPS = (
+    ('patient_info', ('patient_name', 'patient_age', 'patient_gender', 'patient_phone')),
+    ('medical_record', ('chief_complaint', 'past_medical_history', 'diagnosis', 'status')),
+)
+PLAINTEXT_FIELDS = ('patient_id',) + tuple(field for _, fields in FIELD_GROUPS for field in fields)
+
+AES_IV_SIZE = 12
+
+
+class IngestError(Exception):
+    """File input, policy hoặc bản ghi không hợp lệ"""
+
+
+# ==================== INPUT ====================
+
+def detect_format(path):
+    """Định dạng input theo phần mở rộng của file"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise IngestError(f"Cannot detect input format of {path}; use one of: {', '.join(INPUT_FORMATS)}")
+
+
+def read_records(path, input_format):
+    """
+    Đọc file input, yield dict plaintext từng bản ghi - đọc lần lượt nên không load cả file vào memory.
+    Cột/key cần có: patient_id và các field plaintext (thiếu thì coi như rỗng).
+    """
+    if input_format not in INPUT_FORMATS:
+        raise IngestError(f"Unknown input format {input_format!r}; expected one of {', '.join(INPUT_FORMATS)}")
+
+    with open(path, newline='' if input_format == 'csv' else None, encoding='utf-8-sig') as f:
+        if input_format == 'csv':
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None or 'patient_id' not in reader.fieldnames:
+                raise IngestError(f"{path}: CSV header must contain a patient_id column")
+            for row in reader:
+                yield _normalize_record(reader.line_num, row)
+            return
+
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise IngestError(f"Line {line_number}: invalid JSON: {e}")
+            if not isinstance(row, dict):
+                raise IngestError(f"Line {line_number}: expected a JSON object")
+            yield _normalize_record(line_number, row)
+
+
+def _normalize_record(line_number, row):
+    """Chỉ giữ các field plaintext, chuyển về chuỗi đã strip (giống .value.trim() trên form upload)"""
+    record = {}
+    for field in PLAINTEXT_FIELDS:
+        value = row.get(field)
+        record[field] = '' if value is None else str(value).strip()
+    if not record['patient_id']:
+        raise IngestError(f"Line {line_number}: missing patient_id")
+    if len(record['patient_id']) > 50:
+        raise IngestError(f"Line {line_number}: patient_id longer than 50 characters")
+    return record
+
+
+# ==================== POLICY ====================
+
+def resolve_access_policies(identifiers):
+    """
+    Policy string từ danh sách AccessPolicy (id hoặc name), ghép như trang upload:
+    một policy giữ nguyên, nhiều policy thành '((p1) OR (p2))'.
+    Trả về (policy theo tên attribute, policy đã chuyển sang số nguyên CP-ABE).
+    """
+    from backend.abe_utils import get_attribute_mapping
+    from backend.models import AccessPolicy
+
+    templates = []
+    for identifier in identifiers:
+        lookup = {'pk': int(identifier)} if str(identifier).isdigit() else {'name': identifier}
+        try:
+            templates.append(AccessPolicy.objects.get(**lookup).policy_template)
+        except AccessPolicy.DoesNotExist:
+            raise IngestError(f"AccessPolicy {identifier!r} does not exist")
+    if not templates:
+        raise IngestError("At least one AccessPolicy is required")
+
+    if len(templates) == 1:
+        policy = templates[0]
+    else:
+        policy = '(' + ' OR '.join(f'({template})' for template in templates) + ')'
+
+    name_to_int, _ = get_attribute_mapping()
+    return policy, translate_policy(policy, name_to_int)
+
+
+# ==================== ENCRYPTION ====================
+
+def _serialize_ciphertext(group, ciphertext):
+    """Serialize ciphertext CP-ABE giống client: element -> base64(group.serialize()), còn lại -> str()"""
+    def serialize_value(value):
+        try:
+            return base64.b64encode(group.serialize(value)).decode('ascii')
+        except Exception:
+            return str(value)
+
+    serialized = {}
+    for key, value in ciphertext.items():
+        if isinstance(value, dict):
+            serialized[key] = {str(k): serialize_value(v) for k, v in value.items()}
+        elif isinstance(value, list):
+            serialized[key] = [serialize_value(item) for item in value]
+        elif isinstance(value, str):
+            serialized[key] = value
+        else:
+            serialized[key] = serialize_value(value)
+    return serialized
+
+
+def encrypt_field_group(values, policy):
+    """
+    Mã hóa một nhóm field (dict field -> plaintext) theo policy (dạng số nguyên).
+    Trả về (key blob, IV, dict field -> ciphertext) ở dạng bytes như MedicalData lưu.
+    """
+    from charm.toolbox.pairinggroup import GT
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from backend.abe_utils import get_charm_group, get_waters11_scheme, load_public_parameters
+
+    group = get_charm_group()
+    gt_message = group.random(GT)
+    ciphertext = get_waters11_scheme().encrypt(load_public_parameters(), gt_message, policy)
+    key_blob = json.dumps(_serialize_ciphertext(group, ciphertext)).encode('utf-8')
+
+    # Một IV cho cả nhóm vì trang giải mã dùng chung IV của nhóm (mỗi bản ghi có key riêng)
+    aesgcm = AESGCM(hashlib.sha256(group.serialize(gt_message)).digest())
+    iv = os.urandom(AES_IV_SIZE)
+    blobs = {field: aesgcm.encrypt(iv, value.encode('utf-8'), None) for field, value in values.items()}
+    return key_blob, iv, blobs
+
+
+def encrypt_record(record, patient_policy, medical_policy):
+    """
+    Mã hóa một bản ghi plaintext thành kwargs cho build_medical_data_record.
+    Hàm top-level (picklable) để chạy trong process worker; chỉ nhận/trả kiểu Python thường.
+    """
+    encrypted_data = {}
+    for (prefix, fields), policy in zip(FIELD_GROUPS, (patient_policy, medical_policy)):
+        key_blob, iv, blobs = encrypt_field_group({field: record[field] for field in fields}, policy)
+        encrypted_data[f'{prefix}_aes_key_blob'] = key_blob
+        encrypted_data[f'{prefix}_aes_iv_blob'] = iv
+        for field, blob in blobs.items():
+            encrypted_data[f'{field}_blob'] = blob
+    return record['patient_id'], encrypted_data
+
+
+def _encrypt_chunk(records, patient_policy, medical_policy):
+    return [encrypt_record(record, patient_policy, medical_policy) for record in records]
+
+
+def _init_ingest_process():
+    """Initializer của process worker: chỉ load group/scheme và PK (không cần MSK, không dùng DB)"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from backend.abe_utils import init_charm_settings, load_public_parameters
+    init_charm_settings()
+    load_public_parameters()
+
+
+# ==================== PIPELINE ====================
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_encrypted_batches(records, patient_policy, medical_policy, workers, batch_size, task_size=16):
+    """
+    Mã hóa records trên pool workers process, yield từng batch (list (patient_id, encrypted_data))
+    theo đúng thứ tự input. Mỗi batch chia thành task task_size bản ghi; chỉ batch hiện tại và
+    batch kế tiếp nằm trong pool nên memory không tăng theo kích thước file, và worker vẫn
+    mã hóa batch sau trong lúc process chính ghi batch trước vào DB.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_ingest_process) as executor:
+        def submit(batch):
+            return [
+                executor.submit(_encrypt_chunk, task, patient_policy, medical_policy)
+                for task in _chunked(batch, task_size)
+            ]
+
+        pending = None
+        for batch in _chunked(records, batch_size):
+            futures = submit(batch)
+            if pending is not None:
+                yield [item for future in pending for item in future.result()]
+            pending = futures
+        if pending is not None:
+            yield [item for future in pending for item in future.result()]
+
+
+def ingest_records(records, owner_user, patient_policy, medical_policy, workers=None,
+                   batch_size=500, dry_run=False, progress=None):
+    """
+    Mã hóa và lưu records (iterable dict plaintext) vào MedicalData theo batch.
+    Mỗi batch được bulk_create trong một transaction; trả về số bản ghi đã xử lý.
+    """
+    from django.db import connections
+    from backend.abe_utils import (
+        build_medical_data_record, bulk_create_medical_data_records, init_charm_settings,
+        load_public_parameters,
+    )
+
+    # Load PK trước khi fork để worker dùng chung (và báo lỗi sớm nếu hệ thống chưa setup);
+    # đóng DB connection để process con không kế thừa socket của process chính
+    init_charm_settings()
+    load_public_parameters()
+    connections.close_all()
+
+    total = 0
+    for batch in iter_encrypted_batches(records, patient_policy, medical_policy,
+                                        workers or os.cpu_count() or 1, batch_size):
+        if not dry_run:
+            bulk_create_medical_data_records([
+                build_medical_data_record(owner_user, patient_id, **encrypted_data)
+                for patient_id, encrypted_data in batch
+            ])
+        total += len(batch)
+        if progress:
+            progress(total)
+    return total
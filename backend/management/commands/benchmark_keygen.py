@@ -0,0 +1,76 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.abe_utils import (
+    get_charm_group,
+    get_waters11_scheme,
+    serialize_charm_object,
+    deserialize_charm_object,
+    precompute_fixed_bases,
+)
+from charm.toolbox.pairinggroup import GT
+
+
+def _time_keygen(scheme, pk, msk, attr_list, iterations):
+    """Chạy keygen `iterations` lần, trả về danh sách thời gian (ms)"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        scheme.keygen(pk, msk, attr_list)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks Waters11.keygen with and without fixed-base precomputation '
+            'tables (initPP) on the public parameters.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Number of keygen calls per variant (default: 200).')
+        parser.add_argument('--attributes', type=int, default=5,
+                            help='Number of attributes in each generated key (default: 5).')
+        parser.add_argument('--warmup', type=int, default=10,
+                            help='Untimed keygen calls before measuring (default: 10).')
+
+    def handle(self, *args, **options):
+        group = get_charm_group()
+        scheme = get_waters11_scheme()
+
+        num_attributes = options['attributes']
+        if not 1 <= num_attributes <= scheme.uni_size:
+            raise CommandError(f"--attributes must be between 1 and {scheme.uni_size}")
+        attr_list = [str(i) for i in range(1, num_attributes + 1)]
+
+        # Dùng bộ tham số mới để không phụ thuộc vào file PK/MSK đã setup
+        pk, msk = scheme.setup()
+        serialized_pk = serialize_charm_object(group, pk)
+        plain_pk = deserialize_charm_object(group, serialized_pk)
+        precomputed_pk = precompute_fixed_bases(deserialize_charm_object(group, serialized_pk))
+
+        # Kiểm tra key tạo từ bảng precomputation vẫn giải mã đúng
+        message = group.random(GT)
+        policy = ' and '.join(attr_list)
+        ciphertext = scheme.encrypt(plain_pk, message, policy)
+        secret_key = scheme.keygen(precomputed_pk, msk, attr_list)
+        if scheme.decrypt(plain_pk, ciphertext, secret_key) != message:
+            raise CommandError("Key generated with precomputed bases failed to decrypt.")
+
+        self.stdout.write(f"Group: {group.groupType()}, universe size: {scheme.uni_size}, "
+                          f"attributes per key: {num_attributes}, iterations: {options['iterations']}")
+
+        results = {}
+        for label, variant_pk in (('plain', plain_pk), ('precomputed', precomputed_pk)):
+            _time_keygen(scheme, variant_pk, msk, attr_list, options['warmup'])
+            timings = _time_keygen(scheme, variant_pk, msk, attr_list, options['iterations'])
+            results[label] = timings
+            self.stdout.write(
+                f"{label:>12}: mean {statistics.mean(timings):.3f} ms, "
+                f"median {statistics.median(timings):.3f} ms, "
+                f"throughput {1000 / statistics.mean(timings):.1f} keys/s"
+            )
+
+        speedup = statistics.mean(results['plain']) / statistics.mean(results['precomputed'])
+        self.stdout.write(self.style.SUCCESS(f"Speedup with fixed-base precomputation: {speedup:.2f}x"))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.crypto_runtime import (
+    CHARM_WHEEL_URL,
+    DEFAULT_PYODIDE_VERSION,
+    DEFAULT_PYPI_WHEELS,
+    CryptoRuntimeError,
+    build_bundle,
+)
+
+
+class Command(BaseCommand):
+    help = ('Downloads Pyodide, the charm wheel and its pure-Python dependencies into a content-hashed '
+            'bundle under static/crypto_runtime/ so the upload and record pages boot the crypto runtime '
+            'from this server (and the service worker cache) instead of external CDNs. '
+            'Run collectstatic afterwards when static files are served from STATIC_ROOT.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pyodide-version', default=DEFAULT_PYODIDE_VERSION,
+                            help=f'Pyodide release to bundle (default: {DEFAULT_PYODIDE_VERSION}).')
+        parser.add_argument('--package', action='append', default=[], dest='packages',
+                            help='Extra package from pyodide-lock.json to bundle (with its dependencies); repeatable.')
+        parser.add_argument('--charm-wheel-url', default=CHARM_WHEEL_URL,
+                            help='URL of the charm wheel built for Pyodide.')
+        parser.add_argument('--wheel', action='append', dest='wheels',
+                            help='Pinned PyPI requirement (name==version) with a pure-Python wheel; repeatable '
+                                 f"(default: {', '.join(DEFAULT_PYPI_WHEELS)}).")
+        parser.add_argument('--keep-old', action='store_true',
+                            help='Keep previously built bundles next to the new one.')
+
+    def handle(self, *args, **options):
+        try:
+            manifest = build_bundle(
+                pyodide_version=options['pyodide_version'],
+                packages=options['packages'],
+                charm_wheel_url=options['charm_wheel_url'],
+                pypi_wheels=options['wheels'] or DEFAULT_PYPI_WHEELS,
+                keep_old=options['keep_old'],
+                progress=lambda message: self.stderr.write(message),
+            )
+        except CryptoRuntimeError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Crypto runtime bundle {manifest['version']} ready: Pyodide {manifest['pyodide_version']}, "
+            f"{len(manifest['files'])} files, wheels: {', '.join(manifest['wheels'])}"
+        ))
@@ -0,0 +1,82 @@
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.ingest import INPUT_FORMATS, IngestError, detect_format, ingest_records, read_records, resolve_access_policies
+
+
+class Command(BaseCommand):
+    help = ('Encrypts plaintext medical records from a CSV/JSONL export (same hybrid AES-GCM + Waters11 '
+            'format as the upload page) on a process pool and stores them in MedicalData in batches. '
+            'Each batch is committed on its own; use --skip to resume after an interrupted run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='CSV or JSONL file with patient_id and the plaintext fields.')
+        parser.add_argument('--format', choices=INPUT_FORMATS,
+                            help='Input format (default: detected from the file extension).')
+        parser.add_argument('--owner-email', required=True,
+                            help='Email of the user recorded as owner of the ingested records.')
+        parser.add_argument('--patient-policy', action='append', required=True,
+                            help='AccessPolicy (id or name) for patient info fields; repeat to OR several policies.')
+        parser.add_argument('--medical-policy', action='append', required=True,
+                            help='AccessPolicy (id or name) for medical record fields; repeat to OR several policies.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Encryption worker processes (default: number of CPUs).')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Records per bulk insert (default: MEDICAL_DATA_BATCH_CHUNK_SIZE).')
+        parser.add_argument('--skip', type=int, default=0,
+                            help='Skip the first N records of the input (resume a previous run).')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Ingest at most N records.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Read and encrypt the records without writing to the database.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or getattr(settings, 'MEDICAL_DATA_BATCH_CHUNK_SIZE', 500)
+        if batch_size < 1 or (options['workers'] is not None and options['workers'] < 1):
+            raise CommandError("--batch-size and --workers must be at least 1")
+        if options['skip'] < 0 or (options['limit'] is not None and options['limit'] < 0):
+            raise CommandError("--skip and --limit must not be negative")
+
+        try:
+            owner = get_user_model().objects.get(email=options['owner_email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User {options['owner_email']} does not exist")
+
+        try:
+            input_format = options['format'] or detect_format(options['input'])
+            patient_policy, patient_policy_int = resolve_access_policies(options['patient_policy'])
+            medical_policy, medical_policy_int = resolve_access_policies(options['medical_policy'])
+        except IngestError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Patient info policy: {patient_policy} -> {patient_policy_int}")
+        self.stdout.write(f"Medical record policy: {medical_policy} -> {medical_policy_int}")
+
+        records = read_records(options['input'], input_format)
+        stop = options['skip'] + options['limit'] if options['limit'] is not None else None
+        records = islice(records, options['skip'], stop)
+
+        started = time.perf_counter()
+
+        def progress(total):
+            elapsed = time.perf_counter() - started
+            rate = total / elapsed if elapsed else 0
+            self.stderr.write(f"{total} records ({rate:.1f}/s)")
+
+        try:
+            total = ingest_records(
+                records, owner, patient_policy_int, medical_policy_int,
+                workers=options['workers'], batch_size=batch_size,
+                dry_run=options['dry_run'], progress=progress,
+            )
+        except (IngestError, OSError) as e:
+            raise CommandError(str(e))
+
+        action = 'Encrypted (dry run)' if options['dry_run'] else 'Ingested'
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {total} records in {time.perf_counter() - started:.1f}s."
+        ))
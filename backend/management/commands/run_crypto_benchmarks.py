@@ -0,0 +1,134 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmarks.crypto import (
+    POLICY_SHAPES,
+    BenchmarkError,
+    collect_metadata,
+    compare_results,
+    load_results,
+    run_sweep,
+    write_csv,
+    write_json,
+)
+
+
+def _int_list(value):
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise CommandError(f"Expected a comma-separated list of integers, got {value!r}")
+
+
+def _str_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks Waters11 setup, keygen, encrypt, decrypt and key/ciphertext '
+            'serialization across pairing groups, universe sizes, attribute counts and '
+            'policy shapes. Results can be exported to JSON/CSV and compared with a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', type=_str_list, default=['SS512'],
+                            help='Comma-separated pairing groups (default: SS512).')
+        parser.add_argument('--uni-sizes', type=_int_list, default=[11],
+                            help='Comma-separated Waters11 universe sizes (default: 11).')
+        parser.add_argument('--attributes', type=_int_list, default=[1, 2, 5, 10],
+                            help='Comma-separated attribute counts per secret key (default: 1,2,5,10).')
+        parser.add_argument('--policy-sizes', type=_int_list, default=[1, 2, 5, 10],
+                            help='Comma-separated policy leaf counts; only sizes <= attribute count run '
+                                 '(default: 1,2,5,10).')
+        parser.add_argument('--policy-shapes', type=_str_list, default=list(POLICY_SHAPES),
+                            help=f"Comma-separated policy shapes: {', '.join(POLICY_SHAPES)} (default: all).")
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Measured calls per operation (default: 50).')
+        parser.add_argument('--setup-iterations', type=int, default=5,
+                            help='Measured setup() calls per group/universe size (default: 5).')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Untimed calls before measuring each operation (default: 5).')
+        parser.add_argument('--no-precompute', action='store_true',
+                            help='Do not build fixed-base precomputation tables on the PK '
+                                 '(default follows ABE_FIXED_BASE_PRECOMPUTATION).')
+        parser.add_argument('--json', dest='json_path',
+                            help='Write results and environment metadata to this JSON file.')
+        parser.add_argument('--csv', dest='csv_path',
+                            help='Write results to this CSV file.')
+        parser.add_argument('--compare',
+                            help='Baseline JSON/CSV from a previous run to compare mean latency against.')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Percent increase in mean latency reported as a regression (default: 10).')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error if any operation regressed beyond --threshold.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['setup_iterations'] < 1:
+            raise CommandError("--iterations and --setup-iterations must be at least 1")
+
+        precompute = (not options['no_precompute']
+                      and getattr(settings, 'ABE_FIXED_BASE_PRECOMPUTATION', True))
+        parameters = {
+            'groups': options['groups'],
+            'uni_sizes': options['uni_sizes'],
+            'attribute_counts': options['attributes'],
+            'policy_sizes': options['policy_sizes'],
+            'policy_shapes': options['policy_shapes'],
+            'iterations': options['iterations'],
+            'warmup': options['warmup'],
+            'setup_iterations': options['setup_iterations'],
+            'precompute': precompute,
+        }
+
+        results = []
+        try:
+            for row in run_sweep(progress=lambda message: self.stderr.write(message), **parameters):
+                results.append(row)
+                self._write_row(row)
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+
+        if not results:
+            raise CommandError("No benchmark case matched the given parameters.")
+
+        if options['json_path']:
+            write_json(options['json_path'], collect_metadata(), parameters, results)
+            self.stdout.write(self.style.SUCCESS(f"JSON results written to {options['json_path']}"))
+        if options['csv_path']:
+            write_csv(options['csv_path'], results)
+            self.stdout.write(self.style.SUCCESS(f"CSV results written to {options['csv_path']}"))
+
+        if options['compare']:
+            self._compare(options['compare'], results, options['threshold'], options['fail_on_regression'])
+
+    def _write_row(self, row):
+        policy = f"{row['policy_shape']}/{row['policy_size']}" if row['policy_size'] else '-'
+        size = f", {row['size_bytes']} B" if row['size_bytes'] is not None else ''
+        self.stdout.write(
+            f"{row['group']:>7} u={row['uni_size']:<3} attrs={row['attributes']:<3} policy={policy:<9} "
+            f"{row['operation']:<22} mean {row['mean_ms']:.3f} ms, p95 {row['p95_ms']:.3f} ms, "
+            f"{row['ops_per_sec']} ops/s{size}"
+        )
+
+    def _compare(self, baseline_path, results, threshold, fail_on_regression):
+        try:
+            baseline = load_results(baseline_path)
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read baseline {baseline_path}: {e}")
+
+        comparisons = compare_results(baseline, results, threshold)
+        self.stdout.write(f"Compared {len(comparisons)} operations with {baseline_path}:")
+        regressions = 0
+        for row, base_mean, change, regressed in comparisons:
+            line = (f"  {row['group']} u={row['uni_size']} attrs={row['attributes']} "
+                    f"{row['policy_shape'] or '-'}/{row['policy_size']} {row['operation']}: "
+                    f"{base_mean:.3f} -> {row['mean_ms']:.3f} ms ({change:+.1f}%)")
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+
+        if regressions and fail_on_regression:
+            raise CommandError(f"{regressions} operation(s) regressed by more than {threshold}%.")
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(f"No regressions beyond {threshold}%."))
@@ -0,0 +1,97 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from backend.abe_utils import (
+    claim_next_keygen_job,
+    run_keygen_job,
+    requeue_stale_keygen_jobs,
+    purge_finished_keygen_jobs,
+    load_public_parameters,
+    load_master_secret_key,
+)
+
+
+def _worker_loop(worker_id, poll_interval, once):
+    """
+    Vòng lặp của một worker process: nhận job đang chờ và generate key.
+    Mỗi process có DB connection và bản PK/MSK đã load riêng.
+    """
+    import django
+    django.setup()
+
+    load_public_parameters()
+    load_master_secret_key()
+    print(f"[keygen-worker {worker_id}] started")
+
+    while True:
+        job = claim_next_keygen_job()
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        started = time.perf_counter()
+        job = run_keygen_job(job)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"[keygen-worker {worker_id}] job {job.id} for {job.user.email}: "
+              f"{job.status} in {elapsed_ms:.1f} ms")
+
+    print(f"[keygen-worker {worker_id}] no pending jobs, exiting")
+
+
+class Command(BaseCommand):
+    help = ('Runs CP-ABE keygen worker processes that consume KeygenJob entries '
+            'queued at login time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes (default: 1).')
+        parser.add_argument('--poll-interval', type=float, default=0.5,
+                            help='Seconds to wait between polls when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue and exit instead of polling forever.')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='Requeue jobs left running longer than this many seconds.')
+        parser.add_argument('--purge-after', type=int, default=86400,
+                            help='Delete finished jobs older than this many seconds.')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        poll_interval = options['poll_interval']
+        once = options['once']
+
+        requeued = requeue_stale_keygen_jobs(options['stale_after'])
+        purged = purge_finished_keygen_jobs(options['purge_after'])
+        if requeued or purged:
+            self.stdout.write(f"Requeued {requeued} stale job(s), purged {purged} finished job(s).")
+
+        if workers == 1:
+            _worker_loop(0, poll_interval, once)
+            return
+
+        # Không chia sẻ DB connection của process cha cho các worker con
+        connections.close_all()
+
+        self.stdout.write(self.style.NOTICE(f"Starting {workers} keygen worker processes..."))
+        processes = [
+            multiprocessing.Process(target=_worker_loop, args=(i, poll_interval, once), daemon=True)
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Stopping keygen workers..."))
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+
+        self.stdout.write(self.style.SUCCESS("Keygen workers stopped."))
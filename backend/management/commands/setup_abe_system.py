@@ -1,8 +1,8 @@
 import os
-import pickle
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Max
 
 from backend.abe_utils import (
     get_charm_group,
@@ -12,26 +12,7 @@ from backend.abe_utils import (
     ABE_PARAMS_DIR,
     ABE_SECURE_KEYS_DIR
 )
-
-def serialize_charm_object(group, charm_object):
-    """
-    Serialize một đối tượng Charm (có thể là dictionary chứa pairing.Element).
-    Chuyển đổi tất cả các pairing.Element thành bytes sử dụng group.serialize().
-    """
-    if isinstance(charm_object, dict):
-        serialized_dict = {}
-        for key, value in charm_object.items():
-            serialized_dict[key] = serialize_charm_object(group, value)
-        return serialized_dict
-    elif isinstance(charm_object, list):
-        return [serialize_charm_object(group, item) for item in charm_object]
-    else:
-        # Thử serialize đối tượng bằng group.serialize()
-        try:
-            return group.serialize(charm_object)
-        except (TypeError, AttributeError):
-            # Nếu không serialize được, trả về nguyên đối tượng
-            return charm_object
+from abe_common.key_format import KIND_MASTER_KEY, KIND_PUBLIC_KEY, encode_key
 
 class Command(BaseCommand):
     help = ('Sets up the CP-ABE Waters11 system: generates and saves '
@@ -50,7 +31,16 @@ class Command(BaseCommand):
             self.stdout.write("Charm-Crypto group and Waters11 scheme retrieved.")
             # Sửa lỗi hiển thị groupType:
             self.stdout.write(f"Using pairing group: {group.groupType()}")
-            self.stdout.write(f"Waters11 scheme universe size: {waters11_scheme.uni_size}")
+            self.stdout.write(f"Waters11 scheme universe size: {waters11_scheme.uni_size} (ABE_UNIVERSE_SIZE)")
+
+            # cpabe_id đã cấp phải nằm trong universe mới, nếu không keygen của các attribute đó sẽ lỗi
+            from backend.models import Attribute
+            max_cpabe_id = Attribute.objects.aggregate(m=Max('cpabe_id'))['m'] or 0
+            if max_cpabe_id > waters11_scheme.uni_size:
+                raise CommandError(
+                    f"Existing attributes use cpabe_id up to {max_cpabe_id}, larger than the universe size "
+                    f"{waters11_scheme.uni_size}. Set ABE_UNIVERSE_SIZE >= {max_cpabe_id} and run setup again."
+                )
 
             self.stdout.write("Generating Public Parameters (PK) and Master Secret Key (MSK)...")
             pk_charm, msk_charm = waters11_scheme.setup() # Đây là các dict chứa pairing.Element
@@ -61,34 +51,36 @@ class Command(BaseCommand):
             self.stdout.write(f"Ensured directory exists: {ABE_PARAMS_DIR}")
             self.stdout.write(f"Ensured directory exists: {ABE_SECURE_KEYS_DIR}")
 
-            # Serialize pk_charm và msk_charm trước khi pickle
-            self.stdout.write("Serializing PK and MSK components...")
-            serialized_pk = serialize_charm_object(group, pk_charm)
-            serialized_msk = serialize_charm_object(group, msk_charm)
-            self.stdout.write(self.style.SUCCESS("PK and MSK components serialized."))
+            # Encode PK và MSK sang định dạng key nhị phân có version (abe_common.key_format)
+            self.stdout.write("Encoding PK and MSK components...")
+            encoded_pk = encode_key(group, KIND_PUBLIC_KEY, pk_charm)
+            encoded_msk = encode_key(group, KIND_MASTER_KEY, msk_charm)
+            self.stdout.write(self.style.SUCCESS(f"PK ({len(encoded_pk)} bytes) and MSK ({len(encoded_msk)} bytes) encoded."))
 
             try:
                 with open(PK_FILE_PATH, 'wb') as f_pk:
-                    pickle.dump(serialized_pk, f_pk) # Lưu dictionary đã serialize các phần tử
-                self.stdout.write(self.style.SUCCESS(f"Serialized Public Parameters (PK) saved to: {PK_FILE_PATH}"))
+                    f_pk.write(encoded_pk)
+                self.stdout.write(self.style.SUCCESS(f"Public Parameters (PK) saved to: {PK_FILE_PATH}"))
             except Exception as e:
-                raise CommandError(f"Error saving serialized PK: {e}")
+                raise CommandError(f"Error saving PK: {e}")
 
             try:
                 with open(MSK_FILE_PATH, 'wb') as f_msk:
-                    pickle.dump(serialized_msk, f_msk) # Lưu dictionary đã serialize các phần tử
+                    f_msk.write(encoded_msk)
                 if os.name == 'posix':
                     os.chmod(MSK_FILE_PATH, 0o600)
                     self.stdout.write(self.style.SUCCESS(f"Permissions for MSK file set to 600."))
                 else:
                     self.stdout.write(self.style.WARNING(f"Cannot set POSIX permissions for MSK file on {os.name}. Secure manually."))
-                self.stdout.write(self.style.SUCCESS(f"Serialized Master Secret Key (MSK) saved to: {MSK_FILE_PATH}"))
+                self.stdout.write(self.style.SUCCESS(f"Master Secret Key (MSK) saved to: {MSK_FILE_PATH}"))
                 self.stdout.write(self.style.WARNING("IMPORTANT: Add MSK path to .gitignore."))
             except Exception as e:
-                raise CommandError(f"Error saving serialized MSK: {e}")
+                raise CommandError(f"Error saving MSK: {e}")
 
             self.stdout.write(self.style.SUCCESS("CP-ABE Waters11 system setup command finished successfully."))
 
+        except CommandError:
+            raise
         except ImproperlyConfigured as e:
             raise CommandError(f"Configuration error: {e}")
         except Exception as e:
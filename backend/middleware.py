@@ -2,7 +2,8 @@ from django.shortcuts import redirect
 from django.contrib import messages
 from django.urls import reverse
 from django.http import JsonResponse
-from .models import UserAttribute
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from .attribute_snapshot import EMPTY_SNAPSHOT, aget_request_attribute_snapshot, attach_user_attribute_snapshot
 
 class AttributeAccessMiddleware:
     """
@@ -10,8 +11,13 @@ class AttributeAccessMiddleware:
     Chặn truy cập tất cả URLs ngoại trừ home và auth nếu user chưa có attributes.
     """
     
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
         
         # URLs được phép truy cập mà không cần attributes
         self.allowed_urls = [
@@ -25,39 +31,66 @@ class AttributeAccessMiddleware:
             '/accounts/',  # tất cả auth URLs
             '/admin/',     # admin interface
             '/static/',    # static files
+            '/crypto-runtime',  # bundle Pyodide/charm và service worker
         ]
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        # Snapshot attributes dùng chung cho cả request (decorators, context processor, views)
+        snapshot = attach_user_attribute_snapshot(request)
+        
         # Chỉ áp dụng cho user đã đăng nhập
         if request.user.is_authenticated:
-            # Kiểm tra user có attributes hay không
-            has_attributes = UserAttribute.objects.filter(user=request.user).exists()
-            
-            if not has_attributes:
-                request_path = request.path
-                
-                # Kiểm tra nếu URL được phép
-                is_allowed = (
-                    request_path in self.allowed_urls or
-                    any(request_path.startswith(prefix) for prefix in self.allowed_prefixes)
-                )
-                
-                if not is_allowed:
-                    # Kiểm tra nếu là API request
-                    if request.path.startswith('/api/') or request.headers.get('Content-Type') == 'application/json':
-                        return JsonResponse({
-                            'success': False,
-                            'error': 'ACCESS_DENIED',
-                            'message': 'Bạn chưa được gán thuộc tính truy cập. Vui lòng liên hệ quản trị viên.',
-                            'redirect_url': reverse('home')
-                        }, status=403)
-                    else:
-                        # Web request - redirect về home với message
-                        messages.warning(
-                            request, 
-                            'Bạn chưa được gán thuộc tính truy cập. Vui lòng liên hệ quản trị viên để được cấp quyền.'
-                        )
-                        return redirect('home')
+            denied_response = self._deny_without_attributes(request, snapshot)
+            if denied_response is not None:
+                return denied_response
         
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+    async def __acall__(self, request):
+        # ASGI: load user và snapshot trong thread thay vì lazy trên event loop
+        user = await request.auser()
+        if user.is_authenticated:
+            snapshot = await aget_request_attribute_snapshot(request)
+            denied_response = self._deny_without_attributes(request, snapshot)
+            if denied_response is not None:
+                return denied_response
+        else:
+            request.abe_attributes = EMPTY_SNAPSHOT
+        
+        response = await self.get_response(request)
+        return response
+
+    def _deny_without_attributes(self, request, snapshot):
+        """Response chặn truy cập nếu user chưa có attributes và URL không được phép, ngược lại None"""
+        # Kiểm tra user có attributes hay không
+        if snapshot.has_attributes:
+            return None
+        request_path = request.path
+        
+        # Kiểm tra nếu URL được phép
+        is_allowed = (
+            request_path in self.allowed_urls or
+            any(request_path.startswith(prefix) for prefix in self.allowed_prefixes)
+        )
+        if is_allowed:
+            return None
+        
+        # Kiểm tra nếu là API request
+        if request.path.startswith('/api/') or request.headers.get('Content-Type') == 'application/json':
+            return JsonResponse({
+                'success': False,
+                'error': 'ACCESS_DENIED',
+                'message': 'Bạn chưa được gán thuộc tính truy cập. Vui lòng liên hệ quản trị viên.',
+                'redirect_url': reverse('home')
+            }, status=403)
+        
+        # Web request - redirect về home với message
+        messages.warning(
+            request, 
+            'Bạn chưa được gán thuộc tính truy cập. Vui lòng liên hệ quản trị viên để được cấp quyền.'
+        )
+        return redirect('home')
@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+def assign_cpabe_ids(apps, schema_editor):
+    """Gán cpabe_id theo đúng thứ tự mapping cũ (enumerate theo id, bắt đầu từ 1)
+    để các ciphertext đã mã hóa trước đó vẫn giải mã được."""
+    Attribute = apps.get_model('backend', 'Attribute')
+    AttributeIdSequence = apps.get_model('backend', 'AttributeIdSequence')
+
+    last_value = 0
+    for last_value, attribute in enumerate(Attribute.objects.order_by('id'), start=1):
+        attribute.cpabe_id = last_value
+        attribute.save(update_fields=['cpabe_id'])
+
+    AttributeIdSequence.objects.update_or_create(pk=1, defaults={'last_value': last_value})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttributeIdSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Bộ đếm ID thuộc tính',
+                'verbose_name_plural': 'Bộ đếm ID thuộc tính',
+            },
+        ),
+        migrations.AddField(
+            model_name='attribute',
+            name='cpabe_id',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Số nguyên CP-ABE cố định của thuộc tính, được cấp tự động', null=True, unique=True),
+        ),
+        migrations.RunPython(assign_cpabe_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0002_attribute_cpabe_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeygenJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Đang chờ'), ('running', 'Đang xử lý'), ('done', 'Hoàn thành'), ('failed', 'Thất bại')], default='pending', max_length=16)),
+                ('result', models.JSONField(blank=True, help_text='Secret key đã serialize, xóa sau khi giao cho client', null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(help_text='User cần generate secret key', on_delete=django.db.models.deletion.CASCADE, related_name='keygen_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Job tạo khóa',
+                'verbose_name_plural': 'Job tạo khóa',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='backend_key_status_b2e2a9_idx'), models.Index(fields=['user', 'created_at'], name='backend_key_user_id_de8f7a_idx')],
+            },
+        ),
+    ]
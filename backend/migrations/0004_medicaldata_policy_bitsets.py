@@ -0,0 +1,77 @@
+import base64
+import json
+
+from django.db import migrations, models
+
+from backend.policy import PolicySyntaxError, compile_policy, policy_bitsets
+
+
+def _policy_fields(key_blob, prefix):
+    """Giống abe_utils.get_policy_fields - migration không import abe_utils (cần charm)"""
+    try:
+        data = bytes(key_blob)
+        try:
+            ciphertext = json.loads(data)
+        except ValueError:
+            ciphertext = json.loads(base64.b64decode(data))
+        policy = ciphertext['policy']
+        all_bits, required_bits = policy_bitsets(compile_policy(policy))
+    except (TypeError, ValueError, KeyError, PolicySyntaxError):
+        return {}
+    return {
+        f'{prefix}_policy': policy,
+        f'{prefix}_policy_bits': all_bits,
+        f'{prefix}_required_bits': required_bits,
+    }
+
+
+def backfill_policies(apps, schema_editor):
+    MedicalData = apps.get_model('backend', 'MedicalData')
+    queryset = MedicalData.objects.only('id', 'patient_info_aes_key_blob', 'medical_record_aes_key_blob')
+    for record in queryset.iterator(chunk_size=500):
+        fields = {}
+        fields.update(_policy_fields(record.patient_info_aes_key_blob, 'patient_info'))
+        fields.update(_policy_fields(record.medical_record_aes_key_blob, 'medical_record'))
+        if fields:
+            MedicalData.objects.filter(id=record.id).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0003_keygenjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicaldata',
+            name='patient_info_policy',
+            field=models.TextField(blank=True, help_text='Policy CP-ABE của AES key thông tin bệnh nhân', null=True),
+        ),
+        migrations.AddField(
+            model_name='medicaldata',
+            name='patient_info_policy_bits',
+            field=models.BigIntegerField(blank=True, help_text='Bitset các attribute xuất hiện trong policy thông tin bệnh nhân', null=True),
+        ),
+        migrations.AddField(
+            model_name='medicaldata',
+            name='patient_info_required_bits',
+            field=models.BigIntegerField(blank=True, help_text='Bitset các attribute bắt buộc của policy thông tin bệnh nhân', null=True),
+        ),
+        migrations.AddField(
+            model_name='medicaldata',
+            name='medical_record_policy',
+            field=models.TextField(blank=True, help_text='Policy CP-ABE của AES key hồ sơ y tế', null=True),
+        ),
+        migrations.AddField(
+            model_name='medicaldata',
+            name='medical_record_policy_bits',
+            field=models.BigIntegerField(blank=True, help_text='Bitset các attribute xuất hiện trong policy hồ sơ y tế', null=True),
+        ),
+        migrations.AddField(
+            model_name='medicaldata',
+            name='medical_record_required_bits',
+            field=models.BigIntegerField(blank=True, help_text='Bitset các attribute bắt buộc của policy hồ sơ y tế', null=True),
+        ),
+        migrations.RunPython(backfill_policies, migrations.RunPython.noop),
+    ]
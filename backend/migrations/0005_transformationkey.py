@@ -0,0 +1,32 @@
+import uuid
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0004_medicaldata_policy_bitsets'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransformationKey',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('attribute_hash', models.CharField(max_length=64)),
+                ('key_data', models.BinaryField(help_text='Transformation key ở định dạng key_format')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(help_text='User sở hữu transformation key', on_delete=django.db.models.deletion.CASCADE, related_name='transformation_keys', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Khóa chuyển đổi',
+                'verbose_name_plural': 'Khóa chuyển đổi',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'created_at'], name='backend_tra_user_id_9a65a1_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_transformationkey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attributeidsequence',
+            name='mapping_version',
+            field=models.CharField(blank=True, default='', help_text='Đổi mỗi khi bảng Attribute thay đổi để mọi worker load lại mapping name <-> cpabe_id', max_length=32),
+        ),
+    ]
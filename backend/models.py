@@ -2,7 +2,8 @@ import uuid
 import secrets
 import string
 import logging
-from django.db import models, transaction
+from django.db import models, transaction, IntegrityError
+from django.db.models import Max
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db.models.signals import post_save
@@ -82,16 +83,123 @@ class Attribute(models.Model):
         null=True, blank=True,
         help_text="Mô tả chi tiết về thuộc tính này"
     )
+    # Số nguyên cố định dùng trong Waters11 (h[cpabe_id]); không thay đổi khi xóa attribute khác
+    cpabe_id = models.PositiveIntegerField(
+        unique=True,
+        null=True, blank=True,
+        editable=False,
+        help_text="Số nguyên CP-ABE cố định của thuộc tính, được cấp tự động"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.name
 
+    def clean(self):
+        super().clean()
+        if self.cpabe_id is None and AttributeIdSequence.peek() > get_attribute_universe_size():
+            raise ValidationError(attribute_universe_exhausted_message())
+
+    def save(self, *args, **kwargs):
+        if self.cpabe_id is not None:
+            return super().save(*args, **kwargs)
+
+        # Cấp cpabe_id mới; thử lại nếu bị trùng do nhiều worker cùng tạo attribute
+        for attempt in range(3):
+            try:
+                with transaction.atomic():
+                    self.cpabe_id = AttributeIdSequence.allocate()
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                self.cpabe_id = None
+                if attempt == 2:
+                    raise
+
+    @classmethod
+    def assign_missing_cpabe_ids(cls):
+        """
+        Cấp cpabe_id cho các attribute được insert không qua save() (seed SQL, bulk_create, SQL tay).
+        Trả về số attribute đã được cấp; raise ValidationError khi vượt quá universe của Waters11.
+        """
+        assigned = 0
+        with transaction.atomic():
+            missing = cls.objects.select_for_update().filter(cpabe_id__isnull=True).order_by('id')
+            for attribute in missing:
+                attribute.cpabe_id = AttributeIdSequence.allocate()
+                attribute.save(update_fields=['cpabe_id'])
+                assigned += 1
+        return assigned
+
     class Meta:
         verbose_name = "Thuộc tính"
         verbose_name_plural = "Thuộc tính"
         ordering = ['name']
 
+def get_attribute_universe_size():
+    """Số cpabe_id hợp lệ (1..N): PK của Waters11 chỉ có h[1..uni_size]"""
+    return settings.ABE_UNIVERSE_SIZE
+
+def attribute_universe_exhausted_message():
+    return (
+        f"Đã cấp hết {get_attribute_universe_size()} cpabe_id của Waters11 (ABE_UNIVERSE_SIZE). "
+        "Tăng ABE_UNIVERSE_SIZE rồi chạy lại setup_abe_system để tạo attribute mới."
+    )
+
+class AttributeIdSequence(models.Model):
+    """
+    Bộ đếm cpabe_id đã cấp - ID của attribute đã xóa không bao giờ bị tái sử dụng,
+    nên tổng số attribute từng được tạo bị giới hạn bởi ABE_UNIVERSE_SIZE.
+    """
+    last_value = models.PositiveIntegerField(default=0)
+    mapping_version = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+        help_text="Đổi mỗi khi bảng Attribute thay đổi để mọi worker load lại mapping name <-> cpabe_id"
+    )
+
+    @classmethod
+    def current_mapping_version(cls):
+        """Version của attribute mapping, đọc từ DB nên mọi worker đều thấy cùng một giá trị"""
+        return cls.objects.filter(pk=1).values_list('mapping_version', flat=True).first() or ''
+
+    @classmethod
+    def bump_mapping_version(cls):
+        """Đổi version mapping (cùng transaction với thay đổi Attribute)"""
+        version = uuid.uuid4().hex
+        if not cls.objects.filter(pk=1).update(mapping_version=version):
+            cls.objects.update_or_create(pk=1, defaults={'mapping_version': version})
+        return version
+
+    @classmethod
+    def peek(cls):
+        """cpabe_id sẽ được cấp tiếp theo (không lock, chỉ dùng để validate trước)"""
+        last_value = cls.objects.filter(pk=1).values_list('last_value', flat=True).first() or 0
+        current_max = Attribute.objects.aggregate(m=Max('cpabe_id'))['m'] or 0
+        return max(last_value, current_max) + 1
+
+    @classmethod
+    def allocate(cls):
+        """
+        Cấp cpabe_id tiếp theo (phải gọi bên trong transaction).
+        Raise ValidationError khi vượt quá universe của Waters11 thay vì để keygen lỗi IndexError.
+        """
+        sequence, _ = cls.objects.select_for_update().get_or_create(pk=1)
+        current_max = Attribute.objects.aggregate(m=Max('cpabe_id'))['m'] or 0
+        next_value = max(sequence.last_value, current_max) + 1
+        if next_value > get_attribute_universe_size():
+            raise ValidationError(attribute_universe_exhausted_message())
+        sequence.last_value = next_value
+        sequence.save(update_fields=['last_value'])
+        return sequence.last_value
+
+    def __str__(self):
+        return f"Attribute ID sequence: {self.last_value}"
+
+    class Meta:
+        verbose_name = "Bộ đếm ID thuộc tính"
+        verbose_name_plural = "Bộ đếm ID thuộc tính"
+
 class UserAttribute(models.Model):
     """Bảng trung gian lưu trữ static attributes của từng user"""
     user = models.ForeignKey(
@@ -219,6 +327,33 @@ class MedicalData(models.Model):
         help_text="IV cho AES-GCM encryption hồ sơ y tế"
     )
 
+    # Policy CP-ABE (attribute dạng số nguyên, lấy từ ciphertext) và bitset để lọc trước
+    # các bản ghi user có thể giải mã mà không cần thử giải mã ở client
+    patient_info_policy = models.TextField(
+        null=True, blank=True,
+        help_text="Policy CP-ABE của AES key thông tin bệnh nhân"
+    )
+    patient_info_policy_bits = models.BigIntegerField(
+        null=True, blank=True,
+        help_text="Bitset các attribute xuất hiện trong policy thông tin bệnh nhân"
+    )
+    patient_info_required_bits = models.BigIntegerField(
+        null=True, blank=True,
+        help_text="Bitset các attribute bắt buộc của policy thông tin bệnh nhân"
+    )
+    medical_record_policy = models.TextField(
+        null=True, blank=True,
+        help_text="Policy CP-ABE của AES key hồ sơ y tế"
+    )
+    medical_record_policy_bits = models.BigIntegerField(
+        null=True, blank=True,
+        help_text="Bitset các attribute xuất hiện trong policy hồ sơ y tế"
+    )
+    medical_record_required_bits = models.BigIntegerField(
+        null=True, blank=True,
+        help_text="Bitset các attribute bắt buộc của policy hồ sơ y tế"
+    )
+
     # Metadata không mã hóa
     created_date = models.DateField(
         auto_now_add=True,
@@ -241,4 +376,83 @@ class MedicalData(models.Model):
         indexes = [
             models.Index(fields=['owner_user', 'created_at']),
             models.Index(fields=['patient_id']),
-        ]
\ No newline at end of file
+        ]
+
+# ==================== KEYGEN JOBS ====================
+
+class KeygenJob(models.Model):
+    """Job generate CP-ABE secret key chạy nền (xử lý bởi lệnh run_keygen_worker)"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Đang chờ'),
+        (STATUS_RUNNING, 'Đang xử lý'),
+        (STATUS_DONE, 'Hoàn thành'),
+        (STATUS_FAILED, 'Thất bại'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="keygen_jobs",
+        help_text="User cần generate secret key"
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING
+    )
+    # Key đã serialize; bị xóa sau khi đã chuyển vào session của user
+    result = models.JSONField(
+        null=True, blank=True,
+        help_text="Secret key đã serialize, xóa sau khi giao cho client"
+    )
+    error = models.TextField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Keygen job {self.id} ({self.status}) for user {self.user_id}"
+
+    class Meta:
+        verbose_name = "Job tạo khóa"
+        verbose_name_plural = "Job tạo khóa"
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['user', 'created_at']),
+        ]
+
+# ==================== OUTSOURCED DECRYPTION ====================
+
+class TransformationKey(models.Model):
+    """
+    Transformation key (secret key của user đã blind bằng 1/z phía client) để server làm
+    phần pairing của Waters11 decrypt. z chỉ nằm ở client nên server không giải mã được.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="transformation_keys",
+        help_text="User sở hữu transformation key"
+    )
+    # Hash tập attribute lúc tạo key; khác hash hiện tại thì key bị từ chối (client tạo lại)
+    attribute_hash = models.CharField(max_length=64)
+    key_data = models.BinaryField(help_text="Transformation key ở định dạng key_format")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Transformation key {self.id} for user {self.user_id}"
+
+    class Meta:
+        verbose_name = "Khóa chuyển đổi"
+        verbose_name_plural = "Khóa chuyển đổi"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
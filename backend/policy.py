@@ -0,0 +1,254 @@
+"""
+Parser và evaluator cho CP-ABE access policy.
+
+Ngữ nghĩa giống hệt charm.toolbox.policytree.PolicyParser / MSP.prune:
+- AND và OR cùng độ ưu tiên, kết hợp phải: 'a AND b OR c' == 'a AND (b OR c)'
+- Chỉ 'and', 'AND', 'or', 'OR' là toán tử
+- Tên attribute được uppercase, hậu tố '_N' là index (bị bỏ khi so khớp)
+- '!' ở đầu là một phần của tên attribute ('!A'), không phải phép NOT
+
+Policy được compile một lần thành cây gọn (cache LRU theo nội dung policy),
+sau đó đánh giá trên frozenset attribute mà không cấp phát chuỗi trung gian.
+"""
+import re
+from functools import lru_cache
+
+POLICY_CACHE_SIZE = 1024
+# Số bit dùng cho bitset attribute (vừa BigIntegerField có dấu)
+BITSET_SIZE = 63
+
+# Các ký tự charm chấp nhận trong tên attribute (alphanums + '-_./\?!@#$^&*%')
+_TOKEN_RE = re.compile(r"\s*(?:(\()|(\))|([A-Za-z0-9\-_./\\?!@#$^&*%]+))")
+_AND_OPERATORS = frozenset(['and', 'AND'])
+_OR_OPERATORS = frozenset(['or', 'OR'])
+
+_LPAREN = '('
+_RPAREN = ')'
+
+
+class PolicySyntaxError(ValueError):
+    """Policy không parse được theo cú pháp của charm"""
+
+
+def tokenize_policy(policy_string):
+    """Tách policy thành các token '(', ')' và word"""
+    tokens = []
+    position = 0
+    length = len(policy_string)
+    while position < length:
+        match = _TOKEN_RE.match(policy_string, position)
+        if match is None or match.end() == position:
+            if policy_string[position:].strip() == '':
+                break
+            raise PolicySyntaxError(
+                f"Unexpected character {policy_string[position]!r} at position {position}"
+            )
+        tokens.append(match.group(1) or match.group(2) or match.group(3))
+        position = match.end()
+    return tokens
+
+
+def normalize_attribute(word):
+    """Chuẩn hóa tên leaf giống BinNode.getAttribute() của charm"""
+    negated = word.startswith('!')
+    if negated:
+        word = word[1:]
+    if '_' in word:
+        parts = word.split('_')
+        try:
+            int(parts[1])
+        except ValueError:
+            raise PolicySyntaxError(f"Invalid attribute index in {word!r}")
+        word = parts[0]
+    return ('!' if negated else '') + word.upper()
+
+
+# Node của cây đã compile:
+#   leaf: str (tên attribute đã chuẩn hóa)
+#   gate: (is_and, leaves: frozenset, subtrees: tuple)
+
+def _combine(is_and, left, right):
+    """Gộp hai node thành gate, làm phẳng các gate con cùng loại"""
+    leaves = set()
+    subtrees = []
+    for child in (left, right):
+        if child.__class__ is str:
+            leaves.add(child)
+        elif child[0] is is_and:
+            leaves.update(child[1])
+            subtrees.extend(child[2])
+        else:
+            subtrees.append(child)
+    return (is_and, frozenset(leaves), tuple(subtrees))
+
+
+class _Parser:
+    __slots__ = ('tokens', 'position')
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def parse(self):
+        node = self._parse_expr()
+        if self.position != len(self.tokens):
+            raise PolicySyntaxError(f"Unexpected token {self.tokens[self.position]!r}")
+        return node
+
+    def _next(self):
+        if self.position >= len(self.tokens):
+            raise PolicySyntaxError("Unexpected end of policy")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def _parse_term(self):
+        token = self._next()
+        if token == _LPAREN:
+            node = self._parse_expr()
+            if self._next() != _RPAREN:
+                raise PolicySyntaxError("Missing closing parenthesis")
+            return node
+        if token == _RPAREN:
+            raise PolicySyntaxError("Unexpected ')'")
+        # Giống charm: Optional("!") + Word(...) nên '! a' tương đương '!a'
+        if token == '!':
+            following = self._next()
+            if following in (_LPAREN, _RPAREN):
+                raise PolicySyntaxError("Expected attribute after '!'")
+            token = '!' + following
+        return normalize_attribute(token)
+
+    def _parse_expr(self):
+        # expr := term (op expr)? -> thu thập chuỗi rồi gộp từ phải sang trái
+        terms = [self._parse_term()]
+        operators = []
+        while self.position < len(self.tokens):
+            token = self.tokens[self.position]
+            if token in _AND_OPERATORS:
+                operators.append(True)
+            elif token in _OR_OPERATORS:
+                operators.append(False)
+            elif token == _RPAREN:
+                break
+            else:
+                raise PolicySyntaxError(f"Expected AND/OR but found {token!r}")
+            self.position += 1
+            terms.append(self._parse_term())
+
+        node = terms[-1]
+        for index in range(len(operators) - 1, -1, -1):
+            node = _combine(operators[index], terms[index], node)
+        return node
+
+
+def _evaluate(node, attributes):
+    if node.__class__ is str:
+        return node in attributes
+    is_and, leaves, subtrees = node
+    if is_and:
+        if not leaves <= attributes:
+            return False
+        for subtree in subtrees:
+            if not _evaluate(subtree, attributes):
+                return False
+        return True
+    if not leaves.isdisjoint(attributes):
+        return True
+    for subtree in subtrees:
+        if _evaluate(subtree, attributes):
+            return True
+    return False
+
+
+def _collect_required(node):
+    """Các attribute bắt buộc phải có trong mọi tập thỏa mãn policy"""
+    if node.__class__ is str:
+        return {node}
+    is_and, leaves, subtrees = node
+    if is_and:
+        required = set(leaves)
+        for subtree in subtrees:
+            required |= _collect_required(subtree)
+        return required
+    children = [{leaf} for leaf in leaves] + [_collect_required(subtree) for subtree in subtrees]
+    return set.intersection(*children)
+
+
+def _collect_attributes(node, result):
+    if node.__class__ is str:
+        result.add(node)
+        return
+    result.update(node[1])
+    for subtree in node[2]:
+        _collect_attributes(subtree, result)
+
+
+class CompiledPolicy:
+    """Policy đã compile, dùng chung giữa các request (immutable)"""
+    __slots__ = ('source', 'tree', 'attributes', 'required_attributes')
+
+    def __init__(self, source, tree):
+        self.source = source
+        self.tree = tree
+        attributes = set()
+        _collect_attributes(tree, attributes)
+        self.attributes = frozenset(attributes)
+        self.required_attributes = frozenset(_collect_required(tree))
+
+    def evaluate(self, attributes):
+        """True nếu tập attribute (đã chuẩn hóa) thỏa mãn policy"""
+        if not isinstance(attributes, (set, frozenset)):
+            attributes = frozenset(attributes)
+        return _evaluate(self.tree, attributes)
+
+    def __repr__(self):
+        return f"CompiledPolicy({self.source!r})"
+
+
+@lru_cache(maxsize=POLICY_CACHE_SIZE)
+def compile_policy(policy_string):
+    """Compile policy (có cache LRU theo nội dung). Raise PolicySyntaxError nếu sai cú pháp"""
+    tokens = tokenize_policy(policy_string)
+    if not tokens:
+        raise PolicySyntaxError("Empty policy")
+    return CompiledPolicy(policy_string, _Parser(tokens).parse())
+
+
+def attribute_bits(attribute_ids):
+    """Bitset của các attribute dạng số nguyên; None nếu có attribute không biểu diễn được"""
+    bits = 0
+    for attribute_id in attribute_ids:
+        if not attribute_id.isdigit() or int(attribute_id) >= BITSET_SIZE:
+            return None
+        bits |= 1 << int(attribute_id)
+    return bits
+
+
+def policy_bitsets(compiled):
+    """
+    (bitset mọi attribute trong policy, bitset attribute bắt buộc) để lọc trước trong DB.
+    Trả về (None, None) nếu policy có attribute không phải số nguyên nhỏ (không lọc được).
+    """
+    all_bits = attribute_bits(compiled.attributes)
+    required_bits = attribute_bits(compiled.required_attributes)
+    if all_bits is None or required_bits is None:
+        return None, None
+    return all_bits, required_bits
+
+
+def translate_policy(policy_string, name_to_int):
+    """
+    Thay tên attribute trong policy bằng số nguyên CP-ABE (không phân biệt hoa thường),
+    giống cách client chuyển policy trước khi encrypt.
+    """
+    lookup = {name.lower(): str(value) for name, value in name_to_int.items()}
+    translated = []
+    for token in tokenize_policy(policy_string):
+        if token in (_LPAREN, _RPAREN) or token in _AND_OPERATORS or token in _OR_OPERATORS:
+            translated.append(token)
+            continue
+        prefix = '!' if token.startswith('!') else ''
+        name = token[len(prefix):]
+        translated.append(prefix + lookup.get(name.lower(), name))
+    return ' '.join(translated)
@@ -1,6 +1,11 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from allauth.account.models import EmailAddress
 from allauth.account.signals import email_added, user_signed_up
+from . import abe_utils
+from .attribute_snapshot import invalidate_user_attribute_snapshot
+from .models import Attribute, UserAttribute, MedicalData
 
 @receiver(email_added)
 def auto_verify_email_on_add(sender, request, email_address, **kwargs):
@@ -32,4 +37,34 @@ def auto_verify_email_on_signup(sender, request, user, **kwargs):
         # If using CustomSignupForm, an email address should already exist.
         print(f"No primary email found for user {user} during signup for auto-verification.")
     except Exception as e:
-        print(f"Error auto-verifying email for {user} on signup: {e}")
\ No newline at end of file
+        print(f"Error auto-verifying email for {user} on signup: {e}")
+
+@receiver([post_save, post_delete], sender=Attribute)
+def invalidate_attribute_mapping_on_change(sender, instance, **kwargs):
+    """
+    Làm mới attribute mapping cache (name <-> cpabe_id) khi Attribute thay đổi.
+    Version mới được ghi trong cùng transaction nên các worker khác chỉ thấy sau commit.
+    """
+    abe_utils.invalidate_attribute_mapping()
+
+
+@receiver([post_save, post_delete], sender=UserAttribute)
+def invalidate_user_secret_key_on_change(sender, instance, **kwargs):
+    """
+    Xóa secret key và attribute snapshot đã cache của user khi attributes của user thay đổi.
+    """
+    user_id = instance.user_id
+    abe_utils.invalidate_user_secret_key(user_id)
+    invalidate_user_attribute_snapshot(user_id)
+    transaction.on_commit(lambda: abe_utils.invalidate_user_secret_key(user_id))
+    transaction.on_commit(lambda: invalidate_user_attribute_snapshot(user_id))
+
+
+@receiver([post_save, post_delete], sender=MedicalData)
+def invalidate_medical_data_count_on_change(sender, instance, created=True, **kwargs):
+    """
+    Xóa tổng số medical record đã cache khi có bản ghi mới hoặc bị xóa.
+    """
+    if created:
+        abe_utils.invalidate_medical_data_count()
+        transaction.on_commit(abe_utils.invalidate_medical_data_count)
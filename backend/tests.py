@@ -1,3 +1,1310 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import pickle
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import QuerySet
+from django.urls import reverse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from hypothesis import given, settings, strategies as st
+
+try:
+    from charm.schemes.abenc.waters11 import Waters11
+    from charm.toolbox.msp import MSP
+    from charm.toolbox.pairinggroup import GT, ZR, PairingGroup
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    HAS_CHARM = True
+except ImportError:
+    # Charm cần thư viện PBC; các test chỉ dùng phần thuần Python vẫn chạy được khi thiếu
+    HAS_CHARM = False
+
+from abe_common.metrics import CACHE_LOOKUPS, OPERATION_DURATION, increment, metrics_view, render_metrics
+from abe_common.key_format import (
+    KIND_MASTER_KEY, KIND_PUBLIC_KEY, KIND_SECRET_KEY, KIND_TRANSFORM_KEY, KeyFormatError, decode_key, encode_key
+)
+
+from .abe_utils import (
+    RECORD_CONTAINER_CONTENT_TYPE, RECORD_CONTAINER_MAGIC, CharmEngine, aget_user_secret_key_entry,
+    build_medical_data_record, claim_next_keygen_job, compute_attribute_set_hash, convert_attributes_to_integers,
+    encode_medical_data_cursor, enqueue_keygen_job, generate_user_secret_key, get_attribute_mapping,
+    get_cached_user_secret_key, get_medical_data_page, get_medical_record_container_length,
+    invalidate_attribute_mapping, iter_medical_record_container, prefilter_decryptable_medical_data,
+    run_in_crypto_executor, run_keygen_job, transform_ciphertext, transform_medical_record_keys,
+)
+from .benchmarks.crypto import (
+    BenchmarkError, build_policy, compare_results, load_results, run_sweep, write_csv, write_json
+)
+from .attribute_snapshot import attach_user_attribute_snapshot, load_user_attribute_snapshot
+from .management.commands.run_keygen_worker import _worker_loop
+from .ingest import IngestError, PLAINTEXT_FIELDS, encrypt_record, read_records, resolve_access_policies
+from .models import (
+    AccessPolicy, Attribute, AttributeIdSequence, KeygenJob, MedicalData, TransformationKey, User, UserAttribute
+)
+from .policy import PolicySyntaxError, compile_policy, policy_bitsets, translate_policy
+from .views import handle_user_login
+
+# Tên attribute dạng số (giống policy sau khi convert) và dạng chữ, có cả index/negation
+ATTRIBUTE_NAMES = ['1', '2', '3', '10', 'doctor', 'Nurse', 'CARDIO']
+ATTRIBUTE_UNIVERSE = sorted({name.upper() for name in ATTRIBUTE_NAMES} | {'!1', '!DOCTOR'})
+
+
+@st.composite
+def leaves(draw):
+    name = draw(st.sampled_from(ATTRIBUTE_NAMES))
+    if draw(st.booleans()):
+        name = f"{name}_{draw(st.integers(min_value=0, max_value=9))}"
+    if draw(st.integers(min_value=0, max_value=5)) == 0:
+        name = '!' + name
+    return name
+
+
+def policies():
+    operators = st.sampled_from(['and', 'AND', 'or', 'OR'])
+    return st.recursive(
+        leaves(),
+        lambda children: st.one_of(
+            st.tuples(children, operators, children).map(' '.join),
+            children.map(lambda policy: f"({policy})"),
+        ),
+        max_leaves=12,
+    )
+
+
+class PolicyEvaluatorDifferentialTest(SimpleTestCase):
+    """Compiled evaluator phải cho cùng kết quả với charm MSP.prune"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.msp = MSP(PairingGroup('SS512'), verbose=False) if HAS_CHARM else None
+
+    def charm_satisfies(self, policy_string, attributes):
+        tree = self.msp.createPolicy(policy_string)
+        return self.msp.prune(tree, list(attributes)) is not False
+
+    @skipUnless(HAS_CHARM, "charm-crypto is not installed")
+    @settings(max_examples=500, deadline=None)
+    @given(policy_string=policies(), attributes=st.frozensets(st.sampled_from(ATTRIBUTE_UNIVERSE)))
+    def test_matches_charm_msp(self, policy_string, attributes):
+        compiled = compile_policy(policy_string)
+        self.assertEqual(
+            compiled.evaluate(attributes),
+            self.charm_satisfies(policy_string, attributes),
+            policy_string,
+        )
+
+    @settings(max_examples=300, deadline=None)
+    @given(policy_string=policies(), attributes=st.frozensets(st.sampled_from(ATTRIBUTE_UNIVERSE)))
+    def test_required_attributes_are_necessary(self, policy_string, attributes):
+        compiled = compile_policy(policy_string)
+        if compiled.evaluate(attributes):
+            self.assertLessEqual(compiled.required_attributes, attributes)
+            self.assertFalse(compiled.attributes.isdisjoint(attributes))
+
+    def test_policy_bitsets(self):
+        self.assertEqual(policy_bitsets(compile_policy('1 and (2 or 3)')), (0b1110, 0b10))
+        self.assertEqual(policy_bitsets(compile_policy('doctor or 2')), (None, None))
+
+    def test_mixed_operators_are_right_associative(self):
+        compiled = compile_policy('doctor AND nurse OR cardio')
+        self.assertFalse(compiled.evaluate(frozenset({'CARDIO'})))
+        self.assertTrue(compiled.evaluate(frozenset({'DOCTOR', 'CARDIO'})))
+
+    def test_invalid_policy_raises(self):
+        for policy_string in ['', 'doctor nurse', '(doctor', 'doctor AND', 'doctor_x']:
+            with self.assertRaises(PolicySyntaxError):
+                compile_policy(policy_string)
+
+    def test_translate_policy_is_case_insensitive(self):
+        translated = translate_policy('Doctor OR (hospital_1 AND nurse)', {'doctor': 1, 'hospital_1': 2, 'nurse': 3})
+        self.assertEqual(translated, '1 OR ( 2 AND 3 )')
+        self.assertTrue(compile_policy(translated).evaluate(frozenset({'2', '3'})))
+
+
+@override_settings(ABE_UNIVERSE_SIZE=3)
+class AttributeIdAllocationTest(TestCase):
+    """cpabe_id cố định, không tái sử dụng và không vượt quá universe của Waters11"""
+
+    def test_ids_are_stable_and_not_reused(self):
+        doctor = Attribute.objects.create(name='doctor')
+        nurse = Attribute.objects.create(name='nurse')
+        self.assertEqual((doctor.cpabe_id, nurse.cpabe_id), (1, 2))
+
+        nurse.delete()
+        cardio = Attribute.objects.create(name='cardio')
+        self.assertEqual(cardio.cpabe_id, 3)
+        doctor.refresh_from_db()
+        self.assertEqual(doctor.cpabe_id, 1)
+
+    def test_allocation_fails_when_universe_is_exhausted(self):
+        for name in ('doctor', 'nurse', 'cardio'):
+            Attribute.objects.create(name=name)
+        # ID đã xóa vẫn tính vào universe
+        Attribute.objects.get(name='nurse').delete()
+
+        with self.assertRaisesMessage(ValidationError, 'ABE_UNIVERSE_SIZE'):
+            Attribute.objects.create(name='surgeon')
+        self.assertFalse(Attribute.objects.filter(name='surgeon').exists())
+        with self.assertRaises(ValidationError):
+            Attribute(name='surgeon').full_clean()
+
+        # Attribute đã có cpabe_id vẫn lưu được
+        cardio = Attribute.objects.get(name='cardio')
+        cardio.description = 'Khoa tim mạch'
+        cardio.full_clean()
+        cardio.save()
+
+
+@override_settings(ABE_UNIVERSE_SIZE=3)
+class AttributeMappingTest(TestCase):
+    """Mapping name <-> cpabe_id: cấp id cho attribute insert ngoài ORM, version dùng chung qua DB"""
+
+    def setUp(self):
+        invalidate_attribute_mapping()
+
+    def test_attributes_inserted_without_save_get_ids(self):
+        # Giống attribute.sql cũ / bulk_create: không đi qua Attribute.save()
+        Attribute.objects.bulk_create([Attribute(name='doctor'), Attribute(name='nurse')])
+        self.assertTrue(Attribute.objects.filter(cpabe_id__isnull=True).exists())
+
+        self.assertEqual(convert_attributes_to_integers(['nurse', 'doctor']), [2, 1])
+        self.assertEqual(AttributeIdSequence.objects.get(pk=1).last_value, 2)
+
+    def test_backfill_respects_universe(self):
+        Attribute.objects.bulk_create([Attribute(name=f"attr_{i}") for i in range(4)])
+        with self.assertRaisesMessage(ValidationError, 'ABE_UNIVERSE_SIZE'):
+            get_attribute_mapping()
+
+    def test_other_workers_see_changes_through_db_version(self):
+        Attribute.objects.create(name='doctor')
+        self.assertEqual(get_attribute_mapping()[0], {'doctor': 1})
+
+        # Worker khác đổi Attribute: signal chỉ bump version trong DB, không đụng cache của process này
+        with mock.patch('backend.signals.abe_utils.invalidate_attribute_mapping',
+                        side_effect=AttributeIdSequence.bump_mapping_version):
+            Attribute.objects.filter(name='doctor').update(name='bac_si')
+            Attribute.objects.create(name='nurse')
+        self.assertEqual(get_attribute_mapping()[0], {'bac_si': 1, 'nurse': 2})
+
+    def test_missing_name_reloads_mapping(self):
+        Attribute.objects.create(name='doctor')
+        get_attribute_mapping()
+        # Insert bằng SQL không bump version
+        Attribute.objects.bulk_create([Attribute(name='nurse')])
+        self.assertEqual(convert_attributes_to_integers(['nurse']), [2])
+
+
+class FakeElement:
+    """Element giả cho test định dạng key khi không có charm"""
+
+    def __init__(self, tag, raw):
+        self.tag = tag
+        self.raw = raw
+
+    def __eq__(self, other):
+        return isinstance(other, FakeElement) and (self.tag, self.raw) == (other.tag, other.raw)
+
+    def __repr__(self):
+        return f"FakeElement({self.tag}, {self.raw!r})"
+
+
+class FakeGroup:
+    """serialize/deserialize giống PairingGroup của charm: b'<tag>:<base64>'"""
+
+    def groupType(self):
+        return 'SS512'
+
+    def serialize(self, element):
+        return f"{element.tag}:".encode('ascii') + base64.b64encode(element.raw)
+
+    def deserialize(self, data):
+        tag, _, payload = data.partition(b':')
+        return FakeElement(int(tag), base64.b64decode(payload))
+
+
+def fake_element(tag, index):
+    return FakeElement(tag, bytes([index]) * 64)
+
+
+class KeyFormatTest(SimpleTestCase):
+    """Round trip của key_format với key có cùng cấu trúc Waters11 (PK, MSK, SK, transformation key)"""
+
+    def setUp(self):
+        self.group = FakeGroup()
+        # Waters11.setup(): h = [0, h_1, ..., h_n]
+        self.public_key = {
+            'g1': fake_element(1, 1), 'g2': fake_element(2, 2), 'g1_a': fake_element(1, 3),
+            'h': [0] + [fake_element(1, 10 + i) for i in range(3)],
+            'e_g1g2_alpha': fake_element(3, 4),
+        }
+        self.master_key = {'g1_alpha': fake_element(1, 5)}
+        # Waters11.keygen với attr_list số nguyên (compute_user_secret_key)
+        self.secret_key = {
+            'attr_list': [1, 3], 'k0': fake_element(1, 6), 'L': fake_element(2, 7),
+            'K': {1: fake_element(1, 8), 3: fake_element(1, 9)},
+        }
+
+    def assert_round_trip(self, kind, key):
+        decoded = decode_key(self.group, encode_key(self.group, kind, key), expected_kind=kind)
+        self.assertEqual(decoded, key)
+        return decoded
+
+    def test_public_key_keeps_integer_placeholder_in_h(self):
+        decoded = self.assert_round_trip(KIND_PUBLIC_KEY, self.public_key)
+        self.assertIs(type(decoded['h'][0]), int)
+        self.assertEqual(decoded['h'][1:], self.public_key['h'][1:])
+
+    def test_master_key_round_trip(self):
+        self.assert_round_trip(KIND_MASTER_KEY, self.master_key)
+
+    def test_secret_key_keeps_integer_attributes_and_map_keys(self):
+        decoded = self.assert_round_trip(KIND_SECRET_KEY, self.secret_key)
+        self.assertEqual(decoded['attr_list'], [1, 3])
+        self.assertEqual(set(decoded['K']), set(decoded['attr_list']))
+
+    def test_transform_key_with_string_attributes(self):
+        transform_key = {'attr_list': ['1', '3'], 'k0': fake_element(1, 6), 'K': {'1': fake_element(1, 8)}}
+        decoded = self.assert_round_trip(KIND_TRANSFORM_KEY, transform_key)
+        self.assertEqual(list(decoded['K']), ['1'])
+
+    def test_version_1_keys_are_still_readable(self):
+        data = bytearray(encode_key(self.group, KIND_MASTER_KEY, self.master_key))
+        data[4] = 1
+        self.assertEqual(decode_key(self.group, bytes(data)), self.master_key)
+
+    def test_invalid_keys_are_rejected(self):
+        with self.assertRaises(KeyFormatError):
+            encode_key(self.group, KIND_SECRET_KEY, {'K': {1: fake_element(1, 1), '2': fake_element(1, 2)}})
+        with self.assertRaises(KeyFormatError):
+            encode_key(self.group, KIND_SECRET_KEY, {'flag': True})
+        with self.assertRaises(KeyFormatError):
+            encode_key(self.group, KIND_PUBLIC_KEY, {'h': [0, 1.5]})
+
+        data = encode_key(self.group, KIND_PUBLIC_KEY, self.public_key)
+        with self.assertRaises(KeyFormatError):
+            decode_key(self.group, data, expected_kind=KIND_SECRET_KEY)
+        with self.assertRaises(KeyFormatError):
+            decode_key(self.group, data[:-10])
+
+
+@skipUnless(HAS_CHARM, "charm-crypto is not installed")
+class Waters11KeyFormatTest(SimpleTestCase):
+    """Round trip với key thật của Waters11 (setup + keygen từ attribute số nguyên)"""
+
+    def test_real_keys_round_trip(self):
+        group = PairingGroup('SS512')
+        scheme = Waters11(group, uni_size=5, verbose=False)
+        public_key, master_key = scheme.setup()
+        secret_key = scheme.keygen(public_key, master_key, [1, 4])
+
+        decoded_pk = decode_key(group, encode_key(group, KIND_PUBLIC_KEY, public_key), KIND_PUBLIC_KEY)
+        decoded_msk = decode_key(group, encode_key(group, KIND_MASTER_KEY, master_key), KIND_MASTER_KEY)
+        decoded_sk = decode_key(group, encode_key(group, KIND_SECRET_KEY, secret_key), KIND_SECRET_KEY)
+        self.assertEqual(decoded_pk, public_key)
+        self.assertEqual(decoded_msk, master_key)
+        self.assertEqual(decoded_sk, secret_key)
+        self.assertEqual(set(decoded_sk['K']), {1, 4})
+
+        # PK/MSK decode ra vẫn dùng được cho keygen
+        scheme.keygen(decoded_pk, decoded_msk, [2, 5])
+
+
+@skipUnless(HAS_CHARM, "charm-crypto is not installed")
+@override_settings(ABE_UNIVERSE_SIZE=5, ABE_FIXED_BASE_PRECOMPUTATION=True)
+class PublicKeyPrecomputationTest(SimpleTestCase):
+    """PK mới setup (h[0] = 0) load được với precomputation và key sinh ra vẫn giải mã đúng"""
+
+    def test_fresh_public_key_loads_with_precomputation(self):
+        engine = CharmEngine()
+        engine.init_scheme()
+        group, scheme = engine.group, engine.scheme
+        public_key, master_key = scheme.setup()
+
+        with tempfile.TemporaryDirectory() as directory:
+            pk_path = Path(directory) / 'public_parameters.bin'
+            pk_path.write_bytes(encode_key(group, KIND_PUBLIC_KEY, public_key))
+            with mock.patch('backend.abe_utils.PK_FILE_PATH', pk_path), \
+                    mock.patch('backend.abe_utils.get_charm_group', return_value=group):
+                loaded_key = engine.load_public_key()
+
+        self.assertEqual(loaded_key['h'][0], 0)
+        message = group.random(GT)
+        ciphertext = scheme.encrypt(public_key, message, '1 and 4')
+        secret_key = scheme.keygen(loaded_key, master_key, ['1', '4'])
+        self.assertEqual(scheme.decrypt(public_key, ciphertext, secret_key), message)
+
+
+def benchmark_row(operation, mean_ms, **case):
+    row = {
+        'group': 'SS512', 'uni_size': 11, 'attributes': 2, 'policy_size': 2, 'policy_shape': 'and',
+        'operation': operation, 'iterations': 10, 'mean_ms': mean_ms,
+    }
+    row.update(case)
+    return row
+
+
+class CryptoBenchmarkHelpersTest(SimpleTestCase):
+    """Phần không cần charm của backend.benchmarks.crypto"""
+
+    def test_build_policy_shapes(self):
+        attributes = ['1', '2', '3', '4']
+        self.assertEqual(build_policy(attributes, 'and'), '1 and 2 and 3 and 4')
+        self.assertEqual(build_policy(attributes, 'or'), '1 or 2 or 3 or 4')
+        self.assertEqual(build_policy(attributes, 'mixed'), '((1 or 2) and (3 or 4))')
+        self.assertEqual(build_policy(['7'], 'mixed'), '7')
+        with self.assertRaises(BenchmarkError):
+            build_policy(attributes, 'xor')
+
+    def test_policies_are_satisfied_by_all_attributes(self):
+        attributes = [str(i) for i in range(1, 6)]
+        for shape in ('and', 'or', 'mixed'):
+            compiled = compile_policy(build_policy(attributes, shape))
+            self.assertTrue(compiled.evaluate(frozenset(attributes)), shape)
+
+    def test_compare_results_across_csv_and_json(self):
+        baseline = [
+            benchmark_row('keygen', 2.0, policy_size=0, policy_shape=''),
+            benchmark_row('encrypt', 4.0),
+            benchmark_row('decrypt', 0.0),
+        ]
+        current = [
+            benchmark_row('keygen', 2.1, policy_size=0, policy_shape=''),
+            benchmark_row('encrypt', 5.0),
+            benchmark_row('decrypt', 1.0),
+            benchmark_row('encrypt', 1.0, policy_shape='or'),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = str(Path(directory) / 'baseline.csv')
+            json_path = str(Path(directory) / 'current.json')
+            write_csv(csv_path, baseline)
+            write_json(json_path, {}, {}, current)
+            # CSV trả về chuỗi, JSON trả về số - vẫn phải ghép được theo case
+            comparisons = compare_results(load_results(csv_path), load_results(json_path), threshold_percent=10)
+
+        by_operation = {row['operation']: (base_mean, round(change, 1), regressed)
+                        for row, base_mean, change, regressed in comparisons}
+        # decrypt có baseline 0 và encrypt 'or' không có baseline nên bị bỏ qua
+        self.assertEqual(by_operation, {'keygen': (2.0, 5.0, False), 'encrypt': (4.0, 25.0, True)})
+
+
+@skipUnless(HAS_CHARM, "charm-crypto is not installed")
+class CryptoBenchmarkSweepTest(SimpleTestCase):
+    def test_small_sweep_runs(self):
+        rows = list(run_sweep(['SS512'], [3], [2], [2], ['and', 'mixed'], iterations=1, warmup=0, setup_iterations=1))
+        operations = {row['operation'] for row in rows}
+        self.assertLessEqual(
+            {'setup', 'pk_serialize_binary', 'pk_deserialize_binary', 'keygen', 'sk_serialize_binary',
+             'encrypt', 'decrypt', 'ct_serialize_json'},
+            operations,
+        )
+
+
+class MetricsViewAccessTest(SimpleTestCase):
+    """/metrics cần token; không có token thì chỉ mở khi DEBUG"""
+
+    def get(self, **headers):
+        return metrics_view(RequestFactory().get('/metrics', headers=headers))
+
+    @override_settings(DEBUG=False, METRICS_AUTH_TOKEN=None)
+    def test_closed_in_production_without_token(self):
+        self.assertEqual(self.get().status_code, 403)
+
+    @override_settings(DEBUG=True, METRICS_AUTH_TOKEN=None)
+    def test_open_in_debug_without_token(self):
+        increment(CACHE_LOOKUPS, cache='test', result='hit')
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'cache_lookups_total{cache="test",result="hit"}', response.content)
+
+    @override_settings(DEBUG=True, METRICS_AUTH_TOKEN='s3cret')
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.get().status_code, 401)
+        self.assertEqual(self.get(authorization='Bearer wrong').status_code, 401)
+        self.assertEqual(self.get(authorization='Bearer s3cret').status_code, 200)
+
+
+class MultiprocessMetricsTest(SimpleTestCase):
+    """Với PROMETHEUS_MULTIPROC_DIR, /metrics tổng hợp số liệu của mọi process (worker gunicorn)"""
+
+    def run_python(self, code, metrics_dir):
+        environment = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=metrics_dir)
+        result = subprocess.run(
+            [sys.executable, '-c', code], env=environment, cwd=str(Path(__file__).resolve().parent.parent),
+            capture_output=True, text=True, check=True,
+        )
+        return result.stdout
+
+    def test_counters_and_histograms_are_summed_across_processes(self):
+        record = (
+            "from abe_common.metrics import CACHE_LOOKUPS, OPERATION_DURATION, increment, observe\n"
+            "increment(CACHE_LOOKUPS, 2, cache='jwt', result='hit')\n"
+            "observe(OPERATION_DURATION, 0.003, operation='keygen')\n"
+        )
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            for _ in range(3):
+                self.run_python(record, metrics_dir)
+            output = self.run_python(
+                "from abe_common.metrics import render_metrics; print(render_metrics().decode())", metrics_dir
+            )
+
+        self.assertIn('cache_lookups_total{cache="jwt",result="hit"} 6.0', output)
+        self.assertIn('operation_duration_seconds_count{operation="keygen"} 3.0', output)
+        self.assertIn('operation_duration_seconds_bucket{le="0.005",operation="keygen"} 3.0', output)
+
+
+class CryptoExecutorTimingTest(SimpleTestCase):
+    """Thời gian thao tác chạy trong crypto executor được đo ở process gọi, kể cả executor 'process'"""
+
+    @staticmethod
+    def operation_count(operation):
+        prefix = f'{OPERATION_DURATION}_count{{operation="{operation}"}} '.encode()
+        for line in render_metrics().splitlines():
+            if line.startswith(prefix):
+                return float(line[len(prefix):])
+        return 0.0
+
+    def test_operation_is_recorded_in_calling_process(self):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            with mock.patch('backend.abe_utils.get_crypto_executor', return_value=executor):
+                worker_pid = async_to_sync(run_in_crypto_executor)(os.getpid, operation='test_executor_op')
+        self.assertNotEqual(worker_pid, os.getpid())
+        self.assertEqual(self.operation_count('test_executor_op'), 1.0)
+
+
+class IngestInputTest(SimpleTestCase):
+    """read_records đọc CSV/JSONL thành dict plaintext đã chuẩn hóa"""
+
+    def write_input(self, name, content):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / name
+        path.write_text(content, encoding='utf-8')
+        return str(path)
+
+    def test_csv_records_are_normalized(self):
+        path = self.write_input('records.csv', (
+            '\ufeffpatient_id,patient_name,diagnosis,extra\n'
+            'BN001, Nguyễn Văn A ,Cúm,ignored\n'
+            'BN002,Trần Thị B,,\n'
+        ))
+        records = list(read_records(path, 'csv'))
+
+        self.assertEqual([record['patient_id'] for record in records], ['BN001', 'BN002'])
+        self.assertEqual(records[0]['patient_name'], 'Nguyễn Văn A')
+        self.assertEqual(records[0]['diagnosis'], 'Cúm')
+        self.assertEqual(records[1]['diagnosis'], '')
+        self.assertEqual(set(records[0]), set(PLAINTEXT_FIELDS))
+
+    def test_jsonl_records_skip_blank_lines(self):
+        path = self.write_input('records.jsonl', (
+            '{"patient_id": "BN001", "patient_age": 42}\n'
+            '\n'
+            '{"patient_id": "BN002", "status": " stable "}\n'
+        ))
+        records = list(read_records(path, 'jsonl'))
+
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['patient_age'], '42')
+        self.assertEqual(records[1]['status'], 'stable')
+
+    def test_invalid_input_is_rejected(self):
+        cases = [
+            ('no_id.csv', 'csv', 'patient_name\nA\n', 'patient_id column'),
+            ('empty_id.csv', 'csv', 'patient_id,patient_name\n,A\n', 'Line 2: missing patient_id'),
+            ('bad.jsonl', 'jsonl', '{"patient_id": "BN001"}\nnot json\n', 'Line 2: invalid JSON'),
+            ('list.jsonl', 'jsonl', '["BN001"]\n', 'expected a JSON object'),
+            ('long.jsonl', 'jsonl', json.dumps({'patient_id': 'x' * 51}) + '\n', 'longer than 50'),
+        ]
+        for name, input_format, content, message in cases:
+            with self.subTest(name=name):
+                with self.assertRaisesMessage(IngestError, message):
+                    list(read_records(self.write_input(name, content), input_format))
+
+
+class IngestPolicyTest(TestCase):
+    """resolve_access_policies ghép AccessPolicy (theo id hoặc tên) giống trang upload"""
+
+    def setUp(self):
+        Attribute.objects.create(name='doctor')
+        Attribute.objects.create(name='nurse')
+        self.doctor = AccessPolicy.objects.create(name='doctors', policy_template='doctor')
+        AccessPolicy.objects.create(name='night_shift', policy_template='nurse AND doctor')
+
+    def test_single_policy_is_used_as_is(self):
+        policy, translated = resolve_access_policies([str(self.doctor.pk)])
+        self.assertEqual(policy, 'doctor')
+        self.assertEqual(translated, '1')
+
+    def test_multiple_policies_are_joined_with_or(self):
+        policy, translated = resolve_access_policies(['doctors', 'night_shift'])
+        self.assertEqual(policy, '((doctor) OR (nurse AND doctor))')
+        self.assertEqual(translated.split(), ['(', '(', '1', ')', 'OR', '(', '2', 'AND', '1', ')', ')'])
+
+    def test_unknown_or_missing_policy_is_rejected(self):
+        with self.assertRaisesMessage(IngestError, "'surgeons' does not exist"):
+            resolve_access_policies(['surgeons'])
+        with self.assertRaisesMessage(IngestError, 'At least one AccessPolicy'):
+            resolve_access_policies([])
+
+
+@skipUnless(HAS_CHARM, "charm-crypto is not installed")
+class IngestEncryptionTest(SimpleTestCase):
+    """Bản ghi ingest giải mã được theo đúng cách client (abe_bulk_decrypt.js) giải mã"""
+
+    def client_decrypt_group(self, group, scheme, public_key, secret_key, encrypted_data, prefix, fields):
+        # Giống _bulk_decrypt_aes_key: key blob là JSON, element là base64(group.serialize())
+        def load(value):
+            if isinstance(value, dict):
+                return {key: load(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [load(item) for item in value]
+            try:
+                return group.deserialize(base64.b64decode(value))
+            except Exception:
+                return value
+
+        ct_data = json.loads(encrypted_data[f'{prefix}_aes_key_blob'])
+        ciphertext = {key: load(value) for key, value in ct_data.items() if key != 'policy'}
+        ciphertext['policy'] = scheme.util.createPolicy(str(ct_data['policy']).strip())
+        gt_message = scheme.decrypt(public_key, ciphertext, secret_key)
+        if gt_message is None or gt_message is False:
+            return None
+        aesgcm = AESGCM(hashlib.sha256(group.serialize(gt_message)).digest())
+        iv = encrypted_data[f'{prefix}_aes_iv_blob']
+        return {field: aesgcm.decrypt(iv, encrypted_data[f'{field}_blob'], None).decode('utf-8') for field in fields}
+
+    def test_encrypted_record_round_trips_through_client_format(self):
+        group = PairingGroup('SS512')
+        scheme = Waters11(group, uni_size=5, verbose=False)
+        public_key, master_key = scheme.setup()
+        record = {field: f'{field} giá trị' for field in PLAINTEXT_FIELDS}
+        record['patient_id'] = 'BN001'
+
+        with mock.patch('backend.abe_utils.get_charm_group', return_value=group), \
+                mock.patch('backend.abe_utils.get_waters11_scheme', return_value=scheme), \
+                mock.patch('backend.abe_utils.load_public_parameters', return_value=public_key):
+            patient_id, encrypted_data = encrypt_record(record, '1', '2 and 3')
+        self.assertEqual(patient_id, 'BN001')
+
+        doctor_key = scheme.keygen(public_key, master_key, ['1'])
+        patient_fields = ('patient_name', 'patient_age', 'patient_gender', 'patient_phone')
+        medical_fields = ('chief_complaint', 'past_medical_history', 'diagnosis', 'status')
+        decrypted = self.client_decrypt_group(
+            group, scheme, public_key, doctor_key, encrypted_data, 'patient_info', patient_fields
+        )
+        self.assertEqual(decrypted, {field: record[field] for field in patient_fields})
+        self.assertIsNone(self.client_decrypt_group(
+            group, scheme, public_key, doctor_key, encrypted_data, 'medical_record', medical_fields
+        ))
+
+        specialist_key = scheme.keygen(public_key, master_key, ['2', '3'])
+        decrypted = self.client_decrypt_group(
+            group, scheme, public_key, specialist_key, encrypted_data, 'medical_record', medical_fields
+        )
+        self.assertEqual(decrypted, {field: record[field] for field in medical_fields})
+
+
+def key_blob(policy):
+    """AES key blob tối thiểu: JSON ciphertext CP-ABE chỉ cần 'policy' để lưu policy/bitset"""
+    return json.dumps({'policy': policy}).encode('utf-8')
+
+
+def create_medical_record(owner, policy, created_at, patient_id='BN001'):
+    """MedicalData với cùng policy cho hai nhóm field (policy None: bản ghi cũ không có key blob)"""
+    blobs = {'patient_name_blob': b'name', 'diagnosis_blob': b'diagnosis'}
+    if policy is not None:
+        blobs.update(patient_info_aes_key_blob=key_blob(policy), medical_record_aes_key_blob=key_blob(policy))
+    record = build_medical_data_record(owner, patient_id, **blobs)
+    record.save()
+    MedicalData.objects.filter(id=record.id).update(created_at=created_at)
+    record.refresh_from_db()
+    return record
+
+
+class MedicalDataKeysetPaginationTest(TestCase):
+    """get_medical_data_page: keyset (created_at, id), bỏ bản ghi không giải mã được, không đọc blob"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(email='doctor@example.com', password='secret')
+        # cpabe_id 1; user không có attribute bị middleware chặn khỏi /api/
+        UserAttribute.objects.create(user=cls.owner, attribute=Attribute.objects.create(name='doctor'))
+        base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        policies = ['1', '2', '1 and 2', None, '1 or 3', '2', '1', '2 and 3', '1']
+        # Từng cặp bản ghi có cùng created_at
+        for index, policy in enumerate(policies):
+            create_medical_record(cls.owner, policy, base + timedelta(minutes=index // 2))
+        cls.expected = list(MedicalData.objects.order_by('-created_at', '-id').values_list('id', 'patient_info_policy'))
+
+    def collect(self, attribute_ids, page_size, decryptable_only):
+        records, cursor = [], None
+        while True:
+            page, cursor = get_medical_data_page(attribute_ids, cursor, page_size, decryptable_only)
+            self.assertLessEqual(len(page), page_size)
+            records.extend(page)
+            if cursor is None:
+                return records
+
+    def test_all_records_in_order_without_duplicates(self):
+        records = self.collect(frozenset({'1'}), page_size=2, decryptable_only=False)
+        self.assertEqual([record.id for record in records], [record_id for record_id, _ in self.expected])
+        flags = {record.id: record.can_decrypt_patient_info for record in records}
+        for record_id, policy in self.expected:
+            self.assertEqual(flags[record_id], None if policy is None else policy in ('1', '1 or 3'))
+
+    def test_decryptable_only_skips_unsatisfied_policies(self):
+        records = self.collect(frozenset({'1'}), page_size=2, decryptable_only=True)
+        # Bản ghi cũ không có policy vẫn được giữ (không xác định được)
+        self.assertEqual(
+            [record.id for record in records],
+            [record_id for record_id, policy in self.expected if policy in (None, '1', '1 or 3')],
+        )
+
+    def test_blob_columns_are_not_loaded(self):
+        records, _ = get_medical_data_page(frozenset({'1'}), page_size=3)
+        self.assertIn('patient_name_blob', records[0].get_deferred_fields())
+        self.assertEqual(records[0].owner_user.email, 'doctor@example.com')
+
+    def test_invalid_cursor(self):
+        record = MedicalData.objects.get(id=self.expected[0][0])
+        records, _ = get_medical_data_page(frozenset({'1'}), cursor=encode_medical_data_cursor(record),
+                                           decryptable_only=False)
+        self.assertEqual([r.id for r in records], [record_id for record_id, _ in self.expected[1:]])
+
+        with self.assertRaises(ValueError):
+            get_medical_data_page(frozenset({'1'}), cursor='not-a-cursor')
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('list_medical_records'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_view_pages_with_user_attributes(self):
+        self.client.force_login(self.owner)
+        first = self.client.get(reverse('list_medical_records'), {'limit': 3}).json()['data']
+        second = self.client.get(reverse('list_medical_records'), {'limit': 3, 'cursor': first['next_cursor']}).json()['data']
+        self.assertEqual(
+            [record['id'] for record in first['records'] + second['records']],
+            [record_id for record_id, policy in self.expected if policy in (None, '1', '1 or 3')],
+        )
+        self.assertIsNone(second['next_cursor'])
+
+
+def parse_medical_record_container(data):
+    """Đọc container giống medical_record_detail.js: (metadata, {tên blob: bytes})"""
+    if data[:4] != RECORD_CONTAINER_MAGIC:
+        raise ValueError('bad magic')
+    header_length = int.from_bytes(data[4:8], 'big')
+    position = 8 + header_length
+    metadata = json.loads(data[8:position].decode('utf-8'))
+    parts = {}
+    while position < len(data):
+        name_length = data[position]
+        name = data[position + 1:position + 1 + name_length].decode('ascii')
+        position += 1 + name_length
+        data_length = int.from_bytes(data[position:position + 4], 'big')
+        position += 4
+        parts[name] = data[position:position + data_length]
+        position += data_length
+    return metadata, parts
+
+
+class MedicalRecordContainerTest(TestCase):
+    """Container nhị phân của một medical record: Content-Length đúng và đọc lại được từng blob"""
+
+    def test_container_round_trip_and_length(self):
+        metadata = {'id': 1, 'patient_id': 'BN-Đức', 'can_decrypt_patient_info': True}
+        # DB driver (psycopg) trả memoryview cho BinaryField
+        parts = [('patient_name_blob', memoryview(b'\x00name')), ('diagnosis_blob', b'\xffdiag' * 100)]
+        data = b''.join(bytes(chunk) for chunk in iter_medical_record_container(metadata, parts))
+
+        self.assertEqual(len(data), get_medical_record_container_length(metadata, parts))
+        self.assertEqual(parse_medical_record_container(data),
+                         (metadata, {'patient_name_blob': b'\x00name', 'diagnosis_blob': b'\xffdiag' * 100}))
+
+    def test_binary_endpoint_streams_record(self):
+        owner = User.objects.create_user(email='doctor@example.com', password='secret')
+        UserAttribute.objects.create(user=owner, attribute=Attribute.objects.create(name='doctor'))
+        record = create_medical_record(owner, '2', datetime(2026, 1, 1, tzinfo=timezone.utc))
+        self.client.force_login(owner)
+
+        response = self.client.get(reverse('get_encrypted_medical_record_binary', args=[record.id]))
+        self.assertEqual(response['Content-Type'], RECORD_CONTAINER_CONTENT_TYPE)
+        data = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(data))
+
+        metadata, parts = parse_medical_record_container(data)
+        self.assertEqual(metadata['id'], record.id)
+        self.assertIs(metadata['can_decrypt_patient_info'], False)
+        # Blob rỗng không có trong container
+        self.assertEqual(parts, {
+            'patient_info_aes_key_blob': key_blob('2'), 'patient_name_blob': b'name',
+            'diagnosis_blob': b'diagnosis', 'medical_record_aes_key_blob': key_blob('2'),
+        })
+
+        missing = self.client.get(reverse('get_encrypted_medical_record_binary', args=[record.id + 1]))
+        self.assertEqual(missing.status_code, 404)
+
+
+def upload_item(patient_id, policy='1'):
+    """Một record upload như medical_upload.js gửi (blob dạng base64)"""
+    encode = lambda data: base64.b64encode(data).decode('ascii')
+    return {
+        'patient_id': patient_id,
+        'patient_info_aes_key_blob': encode(key_blob(policy)),
+        'patient_info_aes_iv_blob': encode(b'\x00' * 12),
+        'patient_name_blob': encode(b'name'),
+        'medical_record_aes_key_blob': encode(key_blob(policy)),
+        'medical_record_aes_iv_blob': encode(b'\x01' * 12),
+    }
+
+
+@override_settings(MEDICAL_DATA_BATCH_CHUNK_SIZE=2)
+class BatchUploadTest(TestCase):
+    """Batch upload NDJSON/JSON: record lỗi không ảnh hưởng record khác, lưu theo chunk"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = User.objects.create_user(email='doctor@example.com', password='secret')
+        UserAttribute.objects.create(user=cls.doctor, attribute=Attribute.objects.create(name='doctor'))
+
+    def setUp(self):
+        self.client.force_login(self.doctor)
+        self.url = reverse('upload_medical_records_batch')
+
+    def test_ndjson_reports_each_line(self):
+        missing_field = upload_item('BN003')
+        del missing_field['medical_record_aes_iv_blob']
+        bad_base64 = dict(upload_item('BN004'), patient_name_blob='abc')
+        lines = [
+            json.dumps(upload_item('BN001')), 'not json', '', json.dumps(missing_field),
+            json.dumps(bad_base64), json.dumps(upload_item('BN002', '1 and 2')), json.dumps(upload_item('BN005')),
+        ]
+        response = self.client.post(self.url, '\n'.join(lines) + '\n', content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual((data['total'], data['created'], data['failed']), (6, 3, 3))
+        self.assertEqual([result['index'] for result in data['results']], list(range(6)))
+        self.assertEqual([result['success'] for result in data['results']], [True, False, False, False, True, True])
+        self.assertEqual(data['results'][1]['error'], 'Invalid JSON data')
+        self.assertEqual(data['results'][2]['error'], 'Missing required field: medical_record_aes_iv_blob')
+        self.assertEqual(data['results'][3]['error'], 'Invalid base64 data for field: patient_name_blob')
+
+        stored = MedicalData.objects.get(id=data['results'][4]['id'])
+        self.assertEqual((stored.patient_id, stored.patient_info_policy), ('BN002', '1 and 2'))
+        self.assertEqual(bytes(stored.patient_name_blob), b'name')
+        self.assertEqual(stored.owner_user, self.doctor)
+        self.assertEqual(MedicalData.objects.count(), 3)
+
+    def test_json_array_and_invalid_body(self):
+        body = json.dumps({'records': [upload_item('BN001'), upload_item('BN002')]})
+        response = self.client.post(self.url, body, content_type='application/json')
+        self.assertEqual(response.json()['data']['created'], 2)
+        self.assertTrue(response.json()['success'])
+
+        response = self.client.post(self.url, '{"records": "nope"}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(MedicalData.objects.count(), 2)
+
+    def test_only_doctors_can_upload(self):
+        nurse = User.objects.create_user(email='nurse@example.com', password='secret')
+        UserAttribute.objects.create(user=nurse, attribute=Attribute.objects.create(name='nurse'))
+        self.client.force_login(nurse)
+        response = self.client.post(self.url, json.dumps([upload_item('BN001')]), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(MedicalData.objects.exists())
+
+
+class PublicParametersETagTest(TestCase):
+    """Public parameters build một lần cho mỗi (PK, attribute mapping), revalidate bằng ETag"""
+
+    def setUp(self):
+        # Mapping (name <-> cpabe_id) cache trong process/cache của Django tồn tại qua các test
+        invalidate_attribute_mapping()
+        self.build_count = 0
+
+        def fake_public_parameters():
+            from .abe_utils import get_attribute_mapping
+            self.build_count += 1
+            return {'public_key': {'g': 'pk'}, 'attribute_mapping': {'name_to_int': get_attribute_mapping()[0]}}
+
+        for target, value in (
+            ('backend.abe_utils._public_parameters_payload', None),
+            ('backend.abe_utils.get_public_parameters_fingerprint', mock.Mock(return_value='pk-v1')),
+            ('backend.abe_utils.get_public_parameters_for_client', fake_public_parameters),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.url = reverse('get_public_parameters')
+
+    def test_conditional_get_returns_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        etag = response['ETag']
+        self.assertEqual(response['Content-Location'],
+                         reverse('get_public_parameters_versioned', args=[etag.strip('"')]))
+        self.assertEqual(json.loads(response.content)['data']['public_key'], {'g': 'pk'})
+
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertEqual(self.build_count, 1)
+
+    def test_attribute_change_invalidates_payload(self):
+        etag = self.client.get(self.url)['ETag']
+        Attribute.objects.create(name='doctor')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content)['data']['attribute_mapping']['name_to_int'], {'doctor': 1})
+        self.assertEqual(self.build_count, 2)
+
+    def test_versioned_url_is_immutable_and_redirects_stale_hash(self):
+        content_hash = self.client.get(self.url)['ETag'].strip('"')
+        current_url = reverse('get_public_parameters_versioned', args=[content_hash])
+
+        response = self.client.get(current_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        stale = self.client.get(reverse('get_public_parameters_versioned', args=['0' * 32]))
+        self.assertRedirects(stale, current_url, fetch_redirect_response=False)
+
+
+class DecryptablePrefilterTest(TestCase):
+    """Bitset trong DB là điều kiện cần: không bao giờ bỏ bản ghi user giải mã được"""
+
+    POLICIES = ['1', '2', '1 and 2', '1 or 3', '(1 and 2) or 4', '2 and 3', 'doctor or 2', None]
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user(email='doctor@example.com', password='secret')
+        cls.records = {
+            create_medical_record(owner, policy, datetime(2026, 1, 1, tzinfo=timezone.utc)).id: policy
+            for policy in cls.POLICIES
+        }
+
+    def prefiltered(self, attribute_ids):
+        return set(prefilter_decryptable_medical_data(MedicalData.objects.all(), attribute_ids)
+                   .values_list('patient_info_policy', flat=True))
+
+    def test_prefilter_keeps_every_satisfiable_record(self):
+        for attribute_ids in (frozenset(), {'1'}, {'2'}, {'1', '2'}, {'3'}, {'4'}, {'2', '3'}, {'1', '2', '3', '4'}):
+            with self.subTest(attributes=sorted(attribute_ids)):
+                kept = self.prefiltered(frozenset(attribute_ids))
+                for policy in self.POLICIES:
+                    if policy is None or compile_policy(policy).evaluate(attribute_ids):
+                        self.assertIn(policy, kept)
+
+    def test_prefilter_drops_records_by_bitset(self):
+        # Policy không có bitset (attribute chưa convert, bản ghi cũ) luôn được giữ
+        # '1 and 2' / '2 and 3' thiếu attribute bắt buộc; '(1 and 2) or 4' chỉ là ứng viên (không có bit bắt buộc)
+        self.assertEqual(self.prefiltered(frozenset({'2'})), {'2', '(1 and 2) or 4', 'doctor or 2', None})
+        self.assertEqual(self.prefiltered(frozenset({'4'})), {'(1 and 2) or 4', 'doctor or 2', None})
+        # Attribute không biểu diễn được bằng bitset: không lọc trong DB
+        self.assertEqual(self.prefiltered(frozenset({'99'})), set(self.POLICIES))
+
+
+class EncryptedBatchFetchTest(TestCase):
+    """Batch fetch: giữ thứ tự ids, chỉ gửi blob của nhóm được yêu cầu và user có thể giải mã"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(email='doctor@example.com', password='secret')
+        UserAttribute.objects.create(user=cls.owner, attribute=Attribute.objects.create(name='doctor'))
+        created_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        cls.readable = create_medical_record(cls.owner, '1', created_at)
+        cls.unreadable = create_medical_record(cls.owner, '2', created_at)
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+        self.url = reverse('get_encrypted_medical_records_batch')
+
+    def fetch(self, **params):
+        return self.client.get(self.url, params)
+
+    def test_ids_keep_order_and_skip_missing(self):
+        ids = [self.unreadable.id, self.readable.id + 100, self.readable.id]
+        records = self.fetch(ids=','.join(map(str, ids))).json()['data']['records']
+        self.assertEqual([record['id'] for record in records], [self.unreadable.id, self.readable.id])
+
+        unreadable, readable = records
+        self.assertEqual(base64.b64decode(readable['patient_name_blob']), b'name')
+        self.assertEqual(base64.b64decode(readable['diagnosis_blob']), b'diagnosis')
+        # Nhóm mà policy cho biết user không giải mã được: không gửi blob
+        self.assertIs(unreadable['can_decrypt_patient_info'], False)
+        self.assertNotIn('patient_name_blob', unreadable)
+
+    def test_groups_limit_returned_blobs(self):
+        records = self.fetch(ids=str(self.readable.id), groups='medical_record').json()['data']['records']
+        self.assertIn('diagnosis_blob', records[0])
+        self.assertNotIn('patient_name_blob', records[0])
+
+    def test_page_mode_uses_listing_cursor(self):
+        data = self.fetch(limit=1, show='all').json()['data']
+        self.assertEqual(len(data['records']), 1)
+        second = self.fetch(limit=1, show='all', cursor=data['next_cursor']).json()['data']
+        self.assertEqual({data['records'][0]['id'], second['records'][0]['id']},
+                         {self.readable.id, self.unreadable.id})
+        # Mặc định chỉ bản ghi có thể giải mã
+        self.assertEqual([record['id'] for record in self.fetch().json()['data']['records']], [self.readable.id])
+
+    def test_invalid_parameters(self):
+        for params in ({'groups': 'secrets'}, {'ids': 'abc'}, {'ids': ','.join(map(str, range(1, 1000)))}):
+            with self.subTest(params=params):
+                self.assertEqual(self.fetch(**params).status_code, 400)
+
+
+class UserAttributeSnapshotTest(TestCase):
+    """Snapshot attribute của user: một query cho cả request, cache được và làm mới khi attribute đổi"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='doctor@example.com', password='secret')
+        UserAttribute.objects.create(user=cls.user, attribute=Attribute.objects.create(name='doctor'))
+
+    def setUp(self):
+        # Snapshot đã cache (test bật ABE_USER_ATTRIBUTE_CACHE_TTL) không bị rollback cùng DB giữa các test
+        cache.clear()
+        invalidate_attribute_mapping()
+
+    @override_settings(ABE_USER_ATTRIBUTE_CACHE_TTL=0)
+    def test_request_snapshot_is_loaded_once(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            snapshot = attach_user_attribute_snapshot(request)
+        with self.assertNumQueries(1):
+            self.assertTrue(snapshot.is_doctor)
+            self.assertEqual(snapshot.names, frozenset({'doctor'}))
+            self.assertTrue(request.abe_attributes.has_attributes)
+
+    @override_settings(ABE_USER_ATTRIBUTE_CACHE_TTL=60)
+    def test_cached_snapshot_is_invalidated_on_change(self):
+        snapshot = load_user_attribute_snapshot(self.user)
+        # Chỉ đọc attribute mapping version
+        with self.assertNumQueries(1):
+            self.assertEqual(load_user_attribute_snapshot(self.user).names, snapshot.names)
+
+        UserAttribute.objects.create(user=self.user, attribute=Attribute.objects.create(name='cardio'))
+        self.assertEqual(load_user_attribute_snapshot(self.user).names, frozenset({'doctor', 'cardio'}))
+
+    def test_doctor_aliases_are_display_only(self):
+        nurse = User.objects.create_user(email='bacsi@example.com', password='secret')
+        UserAttribute.objects.create(user=nurse, attribute=Attribute.objects.create(name='bác sĩ'))
+        snapshot = load_user_attribute_snapshot(nurse)
+        self.assertEqual((snapshot.is_doctor, snapshot.has_doctor_role), (True, False))
+        self.assertTrue(load_user_attribute_snapshot(self.user).has_doctor_role)
+
+    def test_snapshot_pickles_for_shared_cache(self):
+        snapshot = pickle.loads(pickle.dumps(load_user_attribute_snapshot(self.user)))
+        self.assertEqual((snapshot.names, snapshot.is_doctor), (frozenset({'doctor'}), True))
+
+
+class KeygenJobQueueTest(TestCase):
+    """Keygen chạy nền: login chỉ tạo job, worker nhận job và client polling status tới khi có key"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='doctor@example.com', password='secret')
+        UserAttribute.objects.create(user=cls.user, attribute=Attribute.objects.create(name='doctor'))
+
+    def setUp(self):
+        # Secret key cache (LocMem) không bị rollback cùng DB giữa các test
+        cache.clear()
+        invalidate_attribute_mapping()
+        for target, value in (
+            ('backend.abe_utils.get_public_parameters_fingerprint', mock.Mock(return_value='pk-v1')),
+            ('backend.abe_utils.compute_user_secret_key', mock.Mock(return_value=({'K': 'sk'}, b'sk-binary'))),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def login_request(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        handle_user_login(sender=User, request=request, user=self.user)
+        return request
+
+    def test_claim_uses_skip_locked_and_marks_running(self):
+        first = KeygenJob.objects.create(user=self.user)
+        second = KeygenJob.objects.create(user=self.user)
+        select_for_update = QuerySet.select_for_update
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True,
+                               side_effect=select_for_update) as locked:
+            claimed = claim_next_keygen_job()
+        self.assertTrue(locked.call_args.kwargs['skip_locked'])
+
+        self.assertEqual(claimed.id, first.id)
+        self.assertEqual((claimed.status, claimed.attempts), (KeygenJob.STATUS_RUNNING, 1))
+        self.assertIsNotNone(claimed.started_at)
+        self.assertEqual(claim_next_keygen_job().id, second.id)
+        self.assertIsNone(claim_next_keygen_job())
+
+    @mock.patch('sys.stdout', mock.Mock())
+    def test_run_job_records_result_or_error(self):
+        KeygenJob.objects.create(user=self.user)
+        job = run_keygen_job(claim_next_keygen_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, KeygenJob.STATUS_DONE)
+        self.assertEqual(job.result['secret_key'], {'K': 'sk'})
+        self.assertIsNotNone(job.finished_at)
+
+        cache.clear()
+        KeygenJob.objects.create(user=self.user)
+        with mock.patch('backend.abe_utils.compute_user_secret_key', side_effect=RuntimeError('no MSK')):
+            job = run_keygen_job(claim_next_keygen_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error, job.result), (KeygenJob.STATUS_FAILED, 'no MSK', None))
+
+    def test_worker_loop_drains_queue(self):
+        other = User.objects.create_user(email='nurse@example.com', password='secret')
+        UserAttribute.objects.create(user=other, attribute=Attribute.objects.create(name='nurse'))
+        enqueue_keygen_job(self.user)
+        enqueue_keygen_job(other)
+        with mock.patch('backend.management.commands.run_keygen_worker.load_public_parameters'), \
+                mock.patch('backend.management.commands.run_keygen_worker.load_master_secret_key'), \
+                mock.patch('sys.stdout'):
+            _worker_loop(0, 0, once=True)
+        self.assertEqual(
+            list(KeygenJob.objects.values_list('status', flat=True)),
+            [KeygenJob.STATUS_DONE, KeygenJob.STATUS_DONE]
+        )
+
+    def test_login_does_not_load_public_key(self):
+        with mock.patch('backend.abe_utils.get_public_parameters_fingerprint',
+                        side_effect=AssertionError('PK loaded during login')), mock.patch('sys.stdout'):
+            request = self.login_request()
+        job = KeygenJob.objects.get(user=self.user)
+        self.assertEqual(request.session['abe_keygen_job_id'], job.id)
+        self.assertNotIn('abe_secret_key', request.session)
+
+    def test_login_uses_cached_key(self):
+        with mock.patch('sys.stdout'):
+            generate_user_secret_key(self.user)
+            request = self.login_request()
+        self.assertEqual(request.session['abe_secret_key']['secret_key'], {'K': 'sk'})
+        self.assertFalse(KeygenJob.objects.exists())
+
+    def test_login_queues_job_when_cache_check_fails(self):
+        with mock.patch('backend.views.peek_cached_user_secret_key', side_effect=RuntimeError('cache down')), \
+                mock.patch('sys.stdout'):
+            request = self.login_request()
+        self.assertEqual(request.session['abe_keygen_job_id'], KeygenJob.objects.get(user=self.user).id)
+
+    def test_status_goes_from_pending_to_ready(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('get_session_secret_key'))
+        self.assertEqual(response.status_code, 202)
+        status_url = json.loads(response.content)['data']['status_url']
+
+        response = self.client.get(status_url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(json.loads(response.content)['data']['status'], KeygenJob.STATUS_PENDING)
+
+        with mock.patch('sys.stdout'):
+            run_keygen_job(claim_next_keygen_job())
+        response = self.client.get(status_url)
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual((body['source'], body['data']['secret_key']), ('generated', {'K': 'sk'}))
+        # Key đã chuyển vào session, không còn nằm trong DB
+        self.assertIsNone(KeygenJob.objects.get(user=self.user).result)
+        self.assertEqual(json.loads(self.client.get(status_url).content)['source'], 'session')
+
+
+def serialize_ciphertext_blob(group, ciphertext, policy):
+    """AES key blob giống client: JSON các element base64(group.serialize()) kèm policy dạng chuỗi"""
+    def encode(element):
+        return base64.b64encode(group.serialize(element)).decode('utf-8')
+
+    data = {'policy': policy}
+    for name, value in ciphertext.items():
+        if name == 'policy':
+            continue
+        data[name] = {k: encode(v) for k, v in value.items()} if isinstance(value, dict) else encode(value)
+    return json.dumps(data).encode('utf-8')
+
+
+@skipUnless(HAS_CHARM, "charm-crypto is not installed")
+class OutsourcedDecryptionMathTest(SimpleTestCase):
+    """message * transformed**z (finishOutsourcedDecryption) bằng đúng kết quả Waters11.decrypt đầy đủ"""
+
+    def setUp(self):
+        self.group = PairingGroup('SS512')
+        self.scheme = Waters11(self.group, uni_size=5, verbose=False)
+        self.public_key, self.master_key = self.scheme.setup()
+        for target, value in (
+            ('backend.abe_utils.get_charm_group', lambda: self.group),
+            ('backend.abe_utils.get_waters11_scheme', lambda: self.scheme),
+            ('backend.abe_utils.load_public_parameters', lambda: self.public_key),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def blind(self, secret_key, z):
+        """Như createTransformKey: mọi element của secret key lũy thừa 1/z, attr_list do server đặt"""
+        z_inverse = self.group.init(ZR, 1) / z
+        transform_key = {'attr_list': list(secret_key['attr_list'])}
+        for name, value in secret_key.items():
+            if name == 'attr_list':
+                continue
+            if isinstance(value, dict):
+                transform_key[name] = {k: v ** z_inverse for k, v in value.items()}
+            else:
+                transform_key[name] = value ** z_inverse
+        return encode_key(self.group, KIND_TRANSFORM_KEY, transform_key)
+
+    def test_transformed_key_finishes_to_full_decrypt(self):
+        message = self.group.random(GT)
+        ciphertext = self.scheme.encrypt(self.public_key, message, '1 and (2 or 3)')
+        secret_key = self.scheme.keygen(self.public_key, self.master_key, ['1', '3'])
+        z = self.group.random(ZR)
+
+        result = transform_medical_record_keys(
+            self.blind(secret_key, z),
+            {'patient_info': serialize_ciphertext_blob(self.group, ciphertext, '1 and (2 or 3)'), 'medical_record': None},
+        )
+        self.assertIsNone(result['medical_record'])
+        transformed = result['patient_info']
+        finished = (self.group.deserialize(base64.b64decode(transformed['message']))
+                    * self.group.deserialize(base64.b64decode(transformed['transformed'])) ** z)
+        self.assertEqual(finished, self.scheme.decrypt(self.public_key, ciphertext, secret_key))
+        self.assertEqual(finished, message)
+
+    def test_unsatisfied_policy_is_not_transformed(self):
+        ciphertext = self.scheme.encrypt(self.public_key, self.group.random(GT), '1 and 2')
+        secret_key = self.scheme.keygen(self.public_key, self.master_key, ['1', '3'])
+        transform_key = decode_key(self.group, self.blind(secret_key, self.group.random(ZR)), KIND_TRANSFORM_KEY)
+        with mock.patch('sys.stdout'):
+            self.assertIsNone(transform_ciphertext(transform_key, ciphertext))
+
+
+class TransformationKeyViewTest(TestCase):
+    """/api/abe/transform-key/ và /transform/: 409 khi key không tồn tại, đã cũ hoặc thuộc user khác"""
+
+    @classmethod
+    def setUpTestData(cls):
+        doctor = Attribute.objects.create(name='doctor')
+        cls.user = User.objects.create_user(email='doctor@example.com', password='secret')
+        cls.other = User.objects.create_user(email='other@example.com', password='secret')
+        for user in (cls.user, cls.other):
+            UserAttribute.objects.create(user=user, attribute=doctor)
+        cls.record = create_medical_record(cls.user, '1', datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+    def setUp(self):
+        invalidate_attribute_mapping()
+        patcher = mock.patch('backend.abe_utils.get_public_parameters_fingerprint', mock.Mock(return_value='pk-v1'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.attribute_hash = compute_attribute_set_hash(['doctor'], [1])
+        self.client.force_login(self.user)
+
+    def transform(self, key_id):
+        return self.client.get(reverse('transform_medical_record', args=[self.record.id]), {'key_id': key_id})
+
+    def test_store_rejects_non_object_key(self):
+        response = self.client.post(reverse('create_transformation_key'), json.dumps({'transform_key': 'x'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TransformationKey.objects.exists())
+
+    def test_unknown_key_returns_409(self):
+        for key_id in (str(uuid.uuid4()), 'not-a-uuid', ''):
+            self.assertEqual(self.transform(key_id).status_code, 409)
+
+    def test_stale_key_returns_409_and_is_deleted(self):
+        stale = TransformationKey.objects.create(user=self.user, attribute_hash='old', key_data=b'tk')
+        self.assertEqual(self.transform(stale.id).status_code, 409)
+        self.assertFalse(TransformationKey.objects.filter(id=stale.id).exists())
+
+    def test_other_users_key_is_rejected(self):
+        foreign = TransformationKey.objects.create(user=self.other, attribute_hash=self.attribute_hash, key_data=b'tk')
+        with mock.patch('backend.views.transform_medical_record_keys') as transform:
+            response = self.transform(foreign.id)
+        self.assertEqual(response.status_code, 409)
+        transform.assert_not_called()
+        self.assertTrue(TransformationKey.objects.filter(id=foreign.id).exists())
+
+    def test_valid_key_is_transformed(self):
+        key = TransformationKey.objects.create(user=self.user, attribute_hash=self.attribute_hash, key_data=b'tk')
+        fake_result = {'patient_info': {'message': 'm', 'transformed': 't'}, 'medical_record': None}
+        with mock.patch('backend.views.transform_medical_record_keys', return_value=fake_result) as transform:
+            response = self.transform(key.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertEqual(json.loads(response.content)['data'], fake_result)
+        key_data, key_blobs = transform.call_args.args
+        self.assertEqual(bytes(key_data), b'tk')
+        self.assertEqual(set(key_blobs), {'patient_info', 'medical_record'})
+
+
+class UserSecretKeyCacheTest(TestCase):
+    """Secret key cache theo user: keygen chạy một lần, làm mới khi attribute hoặc PK đổi"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='doctor@example.com', password='secret')
+        UserAttribute.objects.create(user=cls.user, attribute=Attribute.objects.create(name='doctor'))
+
+    def setUp(self):
+        cache.clear()
+        invalidate_attribute_mapping()
+        self.fingerprint = mock.Mock(return_value='pk-v1')
+        self.keygen = mock.Mock(side_effect=lambda attr_integers: ({'K': list(attr_integers)}, b'sk-binary'))
+        for target, value in (
+            ('backend.abe_utils.get_public_parameters_fingerprint', self.fingerprint),
+            ('backend.abe_utils.compute_user_secret_key', self.keygen),
+            ('sys.stdout', mock.Mock()),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_key_is_generated_once(self):
+        first = generate_user_secret_key(self.user)
+        self.assertEqual(generate_user_secret_key(self.user), first)
+        self.assertEqual(async_to_sync(aget_user_secret_key_entry)(self.user)['key_data'], first)
+        self.keygen.assert_called_once_with([1])
+
+    def test_attribute_change_invalidates_key(self):
+        generate_user_secret_key(self.user)
+        UserAttribute.objects.create(user=self.user, attribute=Attribute.objects.create(name='cardio'))
+        self.assertEqual(sorted(generate_user_secret_key(self.user)['secret_key']['K']), [1, 2])
+
+        UserAttribute.objects.filter(user=self.user, attribute__name='cardio').delete()
+        self.assertEqual(generate_user_secret_key(self.user)['secret_key']['K'], [1])
+        self.assertEqual(self.keygen.call_count, 3)
+
+    def test_secret_key_endpoint_serves_cached_binary_key(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('get_user_secret_key'), {'format': 'binary'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'sk-binary')
+        self.assertEqual(json.loads(self.client.get(reverse('get_user_secret_key')).content)['data']['secret_key'], {'K': [1]})
+        self.keygen.assert_called_once_with([1])
+
+    def test_new_public_key_invalidates_key(self):
+        generate_user_secret_key(self.user)
+        self.fingerprint.return_value = 'pk-v2'
+        self.assertIsNone(get_cached_user_secret_key(self.user))
+        generate_user_secret_key(self.user)
+        self.assertEqual(self.keygen.call_count, 2)
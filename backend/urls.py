@@ -14,13 +14,25 @@ urlpatterns = [
     # Medical Record Detail
     path('medical-record/<int:record_id>/', views.medical_record_detail_view, name='medical_record_detail'),
     
+    # Crypto runtime (Pyodide + charm) tự host
+    path('crypto-runtime-sw.js', views.crypto_runtime_service_worker, name='crypto_runtime_service_worker'),
+    path('crypto-runtime/<str:version>/<str:filename>', views.crypto_runtime_file, name='crypto_runtime_file'),
+    
     # CP-ABE Waters11 API endpoints
     path('api/abe/secret-key/', views.get_user_secret_key, name='get_user_secret_key'),
     path('api/abe/public-key/', views.get_public_parameters, name='get_public_parameters'),
+    path('api/abe/public-key/<str:content_hash>/', views.get_public_parameters_versioned, name='get_public_parameters_versioned'),
     path('api/abe/session-key/', views.get_session_secret_key, name='get_session_secret_key'),
+    path('api/abe/session-key/status/', views.get_session_secret_key_status, name='get_session_secret_key_status'),
+    path('api/abe/transform-key/', views.create_transformation_key, name='create_transformation_key'),
     
     # Medical Record API endpoints
     path('api/access-policies/', views.get_access_policies, name='get_access_policies'),
     path('api/upload-medical-record/', views.upload_medical_record, name='upload_medical_record'),
+    path('api/upload-medical-records/batch/', views.upload_medical_records_batch, name='upload_medical_records_batch'),
+    path('api/medical-records/', views.list_medical_records, name='list_medical_records'),
+    path('api/medical-records/encrypted/', views.get_encrypted_medical_records_batch, name='get_encrypted_medical_records_batch'),
     path('api/medical-record/<int:record_id>/', views.get_encrypted_medical_record, name='get_encrypted_medical_record'),
+    path('api/medical-record/<int:record_id>/binary/', views.get_encrypted_medical_record_binary, name='get_encrypted_medical_record_binary'),
+    path('api/medical-record/<int:record_id>/transform/', views.transform_medical_record, name='transform_medical_record'),
 ]
\ No newline at end of file
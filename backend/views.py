@@ -1,59 +1,202 @@
 import json
+import re
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.conf import settings
 from django.views.decorators.http import require_http_methods
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.utils.decorators import method_decorator
 from django.views.generic import TemplateView
 from allauth.account.signals import user_logged_in
 from django.dispatch import receiver
-from .models import User, UserAttribute, MedicalData, AccessPolicy
-from .abe_utils import generate_user_secret_key, get_public_parameters_for_client, create_medical_data_record
+from .models import User, MedicalData, AccessPolicy, KeygenJob
+from .abe_utils import (
+    get_cached_user_secret_key, peek_cached_user_secret_key, enqueue_keygen_job, get_latest_keygen_job,
+    get_attribute_ids, annotate_decrypt_flags, get_medical_data_page,
+    get_medical_data_count, serialize_medical_data_summary,
+    get_encrypted_medical_data_batch, get_encrypted_medical_data_page, MEDICAL_DATA_GROUP_BLOB_FIELDS,
+    get_medical_record_container_parts, get_medical_record_container_length,
+    iter_medical_record_container, RECORD_CONTAINER_CONTENT_TYPE,
+    decode_medical_record_payload, MedicalRecordPayloadError,
+    build_medical_data_record, bulk_create_medical_data_records,
+    aget_user_secret_key_entry, aget_public_parameters_payload, acreate_medical_data_record,
+    aget_attribute_ids, store_transformation_key, TransformationKeyError,
+    aget_transformation_key_data, aget_transform_key_blobs, transform_medical_record_keys,
+    run_in_crypto_executor
+)
+from .crypto_runtime import find_runtime_file, get_precache_urls, get_runtime_config
+from .attribute_snapshot import aget_request_attribute_snapshot, get_request_attribute_snapshot
+from abe_common.metrics import timed
 from .decorators import requires_attributes, api_requires_attributes, requires_doctor_role, api_requires_doctor_role
 
+DASHBOARD_PAGE_SIZE = 50
+KEY_BINARY_CONTENT_TYPE = 'application/octet-stream'
+MAX_PAGE_SIZE = 200
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# wasm phải có đúng MIME type để trình duyệt compile streaming
+CRYPTO_RUNTIME_CONTENT_TYPES = {
+    '.wasm': 'application/wasm',
+    '.js': 'text/javascript',
+    '.json': 'application/json',
+    '.zip': 'application/zip',
+    '.whl': 'application/zip',
+}
+CRYPTO_RUNTIME_VERSION_RE = re.compile(r'[0-9a-f]{16}')
+
 class HomeView(TemplateView):
     template_name = 'home.html'
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         if self.request.user.is_authenticated:
-            context['user_attributes'] = UserAttribute.objects.filter(user=self.request.user)
+            # user_attributes / has_attributes đã có từ context processor (snapshot của request)
             context['user_data_count'] = MedicalData.objects.filter(owner_user=self.request.user).count()
-            context['has_attributes'] = UserAttribute.objects.filter(user=self.request.user).exists()
         return context
 
 @login_required
 def dashboard_view(request):
-    """Dashboard cho user đã đăng nhập - hiển thị toàn bộ dữ liệu"""
-    user_attributes = UserAttribute.objects.filter(user=request.user)
-    # Query toàn bộ dữ liệu thay vì chỉ dữ liệu của user hiện tại
-    all_data = MedicalData.objects.all().order_by('-created_at')
+    """
+    Dashboard cho user đã đăng nhập - chỉ hiển thị các bản ghi user có thể giải mã
+    theo policy đã lưu (?show=all để hiển thị toàn bộ dữ liệu kèm cờ giải mã).
+    Phân trang keyset qua ?cursor=...
+    """
+    snapshot = get_request_attribute_snapshot(request)
+    show_all = request.GET.get('show') == 'all'
+    
+    try:
+        all_data, next_cursor = get_medical_data_page(
+            get_attribute_ids(snapshot.names),
+            cursor=request.GET.get('cursor'),
+            page_size=DASHBOARD_PAGE_SIZE,
+            decryptable_only=not show_all
+        )
+    except ValueError:
+        return redirect('dashboard')
     
     context = {
-        'user_attributes': user_attributes,
+        'user_attributes': snapshot.user_attributes,
         'all_data': all_data,  # Đổi tên từ user_data thành all_data
-        'total_attributes': user_attributes.count(),
-        'total_data_items': all_data.count(),
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'show_all': show_all,
+        'total_attributes': len(snapshot.user_attributes),
+        'total_data_items': get_medical_data_count(),
+        'crypto_runtime': get_runtime_config(),
     }
     
     return render(request, 'dashboard.html', context)
 
 @login_required
 @require_http_methods(["GET"])
-def get_user_secret_key(request):
+def list_medical_records(request):
+    """
+    API danh sách medical record (không kèm dữ liệu mã hóa), phân trang keyset.
+    Query params: cursor, limit (tối đa MAX_PAGE_SIZE), show=all
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', DASHBOARD_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        records, next_cursor = get_medical_data_page(
+            get_attribute_ids(get_request_attribute_snapshot(request).names),
+            cursor=request.GET.get('cursor'),
+            page_size=limit,
+            decryptable_only=request.GET.get('show') != 'all'
+        )
+    except ValueError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'message': 'Tham số phân trang không hợp lệ'
+        }, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'data': {
+            'records': [serialize_medical_data_summary(record) for record in records],
+            'next_cursor': next_cursor,
+            'total_count': get_medical_data_count(),
+        }
+    })
+
+def _parse_batch_groups(value):
+    """?groups=patient_info,medical_record (mặc định cả hai nhóm)"""
+    if not value:
+        return tuple(MEDICAL_DATA_GROUP_BLOB_FIELDS)
+    groups = tuple(dict.fromkeys(group.strip() for group in value.split(',') if group.strip()))
+    unknown = [group for group in groups if group not in MEDICAL_DATA_GROUP_BLOB_FIELDS]
+    if unknown or not groups:
+        raise ValueError(f"Unknown field groups: {', '.join(unknown) or value}")
+    return groups
+
+@login_required
+@require_http_methods(["GET"])
+@timed('get_encrypted_medical_records_batch')
+def get_encrypted_medical_records_batch(request):
+    """
+    API lấy nhiều medical record đã mã hóa trong một response (dashboard giải mã hàng loạt).
+    Query params: ids=1,2,3 (tối đa MAX_PAGE_SIZE) hoặc cursor/limit/show=all như /api/medical-records/;
+    groups=patient_info,medical_record để chỉ lấy blob của các nhóm cần.
+    Record dạng giống /api/medical-record/<id>/; blob của nhóm user chắc chắn không giải mã được bị bỏ.
+    """
+    try:
+        groups = _parse_batch_groups(request.GET.get('groups'))
+        user_attribute_ids = get_attribute_ids(get_request_attribute_snapshot(request).names)
+        
+        if request.GET.get('ids'):
+            record_ids = list(dict.fromkeys(int(record_id) for record_id in request.GET['ids'].split(',')))
+            if len(record_ids) > MAX_PAGE_SIZE:
+                raise ValueError(f"At most {MAX_PAGE_SIZE} ids per request")
+            records = get_encrypted_medical_data_batch(record_ids, user_attribute_ids, groups)
+            next_cursor = None
+        else:
+            limit = min(max(int(request.GET.get('limit', DASHBOARD_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            records, next_cursor = get_encrypted_medical_data_page(
+                user_attribute_ids,
+                cursor=request.GET.get('cursor'),
+                page_size=limit,
+                decryptable_only=request.GET.get('show') != 'all',
+                groups=groups
+            )
+    except ValueError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'message': 'Tham số không hợp lệ'
+        }, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'data': {
+            'records': records,
+            'next_cursor': next_cursor,
+        }
+    })
+
+@login_required
+@require_http_methods(["GET"])
+async def get_user_secret_key(request):
     """
     API endpoint để lấy CP-ABE Waters11 secret key của user hiện tại.
+    ?format=binary trả về key ở định dạng nhị phân (abe_common.key_format) thay cho JSON.
+    Async: keygen chạy trong crypto executor nên worker vẫn phục vụ các request khác.
     """
     try:
         # Generate secret key cho user
-        key_data = generate_user_secret_key(request.user)
+        entry = await aget_user_secret_key_entry(await request.auser())
+        
+        if request.GET.get('format') == 'binary':
+            response = HttpResponse(entry['key_binary'], content_type=KEY_BINARY_CONTENT_TYPE)
+            response['Cache-Control'] = 'no-store'
+            return response
         
         return JsonResponse({
             'success': True,
-            'data': key_data,
+            'data': entry['key_data'],
             'message': 'Secret key generated successfully'
         })
         
@@ -71,28 +214,54 @@ def get_user_secret_key(request):
             'message': 'Error generating secret key'
         }, status=500)
 
+def _public_parameters_response(request, body, content_hash, cache_control):
+    """Response public parameters kèm ETag; 304 nếu If-None-Match khớp content hash"""
+    etag = quote_etag(content_hash)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+        response['Content-Location'] = reverse('get_public_parameters_versioned', args=[content_hash])
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+def _public_parameters_error(e):
+    return JsonResponse({
+        'success': False,
+        'error': str(e),
+        'message': 'Error retrieving public parameters'
+    }, status=500)
+
 @ensure_csrf_cookie
 @require_http_methods(["GET"])
-def get_public_parameters(request):
+async def get_public_parameters(request):
     """
     API endpoint để lấy CP-ABE Waters11 public parameters.
     Endpoint này có thể public vì PK không cần bảo mật.
+    Payload được build sẵn; client revalidate bằng ETag (304 nếu không đổi).
     """
     try:
-        pk_data = get_public_parameters_for_client()
-        
-        return JsonResponse({
-            'success': True,
-            'data': pk_data,
-            'message': 'Public parameters retrieved successfully'
-        })
-        
+        body, content_hash = await aget_public_parameters_payload()
     except Exception as e:
-        return JsonResponse({
-            'success': False,
-            'error': str(e),
-            'message': 'Error retrieving public parameters'
-        }, status=500)
+        return _public_parameters_error(e)
+    
+    return _public_parameters_response(request, body, content_hash, 'no-cache')
+
+@require_http_methods(["GET"])
+async def get_public_parameters_versioned(request, content_hash):
+    """
+    Public parameters tại URL chứa content hash - nội dung không bao giờ đổi nên
+    browser/proxy được cache vĩnh viễn. Hash cũ được redirect về URL hiện tại.
+    """
+    try:
+        body, current_hash = await aget_public_parameters_payload()
+    except Exception as e:
+        return _public_parameters_error(e)
+    
+    if content_hash != current_hash:
+        return redirect('get_public_parameters_versioned', content_hash=current_hash)
+    
+    return _public_parameters_response(request, body, current_hash, 'public, max-age=31536000, immutable')
 
 @login_required
 def profile_view(request):
@@ -125,28 +294,54 @@ def health_check(request):
 @receiver(user_logged_in)
 def handle_user_login(sender, request, user, **kwargs):
     """
-    Khi user đăng nhập thành công, tự động generate secret key
-    và store vào session để client có thể lấy.
+    Khi user đăng nhập thành công, nếu key đã có trong cache thì đưa ngay vào session,
+    ngược lại tạo job generate key cho worker xử lý (không chặn request login).
+    Kiểm tra cache không load charm/PK; lỗi khi kiểm tra vẫn tạo job để client polling không bị treo.
     """
     try:
-        # Generate secret key cho user
-        key_data = generate_user_secret_key(user)
-        
-        # Store key data vào session
+        key_data = peek_cached_user_secret_key(user)
+    except ValueError:
+        # User chưa có attribute: không có key để generate
+        request.session.pop('abe_secret_key', None)
+        return
+    except Exception as e:
+        print(f"Error checking cached ABE secret key for user {user.email}: {e}")
+        key_data = None
+    
+    if key_data:
         request.session['abe_secret_key'] = key_data
         request.session['abe_key_generated_at'] = str(user.last_login or 'now')
-        
-        print(f"ABE secret key generated and stored in session for user: {user.email}")
-        
+        print(f"ABE secret key loaded from cache into session for user: {user.email}")
+        return
+    
+    request.session.pop('abe_secret_key', None)
+    try:
+        job = enqueue_keygen_job(user)
+        request.session['abe_keygen_job_id'] = job.id
+        print(f"ABE keygen job {job.id} queued for user: {user.email}")
     except Exception as e:
-        print(f"Error generating ABE secret key for user {user.email}: {e}")
-        
+        print(f"Error queueing ABE keygen job for user {user.email}: {e}")
+
+
+def _keygen_pending_response(request, job):
+    request.session['abe_keygen_job_id'] = job.id
+    return JsonResponse({
+        'success': True,
+        'data': {
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': reverse('get_session_secret_key_status'),
+        },
+        'message': 'Secret key is being generated'
+    }, status=202)
+
 
 @login_required
 @require_http_methods(["GET"])
 def get_session_secret_key(request):
     """
     Lấy secret key từ session (đã được generate khi login).
+    Nếu chưa có thì trả về 202 kèm status_url để client polling.
     """
     try:
         key_data = request.session.get('abe_secret_key')
@@ -158,17 +353,19 @@ def get_session_secret_key(request):
                 'message': 'Secret key retrieved from session',
                 'source': 'session'
             })
-        else:
-            # Nếu không có trong session, generate mới
-            key_data = generate_user_secret_key(request.user)
+        
+        key_data = get_cached_user_secret_key(request.user)
+        if key_data:
             request.session['abe_secret_key'] = key_data
-            
             return JsonResponse({
                 'success': True,
                 'data': key_data,
-                'message': 'Secret key generated and stored in session',
-                'source': 'generated'
+                'message': 'Secret key retrieved from cache',
+                'source': 'cache'
             })
+        
+        # Không generate đồng bộ nữa, giao cho worker
+        return _keygen_pending_response(request, enqueue_keygen_job(request.user))
             
     except ValueError as e:
         return JsonResponse({
@@ -185,10 +382,63 @@ def get_session_secret_key(request):
         }, status=500)
 
 
+@login_required
+@require_http_methods(["GET"])
+def get_session_secret_key_status(request):
+    """
+    Kiểm tra trạng thái job generate key của user.
+    Khi job hoàn thành, key được chuyển vào session và xóa khỏi job.
+    """
+    key_data = request.session.get('abe_secret_key')
+    if key_data:
+        return JsonResponse({
+            'success': True,
+            'data': key_data,
+            'message': 'Secret key retrieved from session',
+            'source': 'session'
+        })
+    
+    job = get_latest_keygen_job(request.user)
+    if job is None:
+        return JsonResponse({
+            'success': False,
+            'error': 'No keygen job found',
+            'message': 'Request the secret key first'
+        }, status=404)
+    
+    if job.status == KeygenJob.STATUS_DONE and job.result:
+        request.session['abe_secret_key'] = job.result
+        request.session['abe_key_generated_at'] = str(job.finished_at)
+        request.session.pop('abe_keygen_job_id', None)
+        key_data = job.result
+        # Không giữ secret key trong DB lâu hơn cần thiết
+        job.result = None
+        job.save(update_fields=['result'])
+        return JsonResponse({
+            'success': True,
+            'data': key_data,
+            'message': 'Secret key generated and stored in session',
+            'source': 'generated'
+        })
+    
+    if job.status == KeygenJob.STATUS_FAILED:
+        return JsonResponse({
+            'success': False,
+            'error': job.error,
+            'message': 'Error generating secret key'
+        }, status=500)
+    
+    if job.status == KeygenJob.STATUS_DONE:
+        # Key đã giao cho session khác (hoặc đã bị xóa), tạo job mới
+        job = enqueue_keygen_job(request.user)
+    
+    return _keygen_pending_response(request, job)
+
+
 @requires_doctor_role()
 def medical_upload_view(request):
     """Trang upload medical record - chỉ dành cho bác sĩ"""
-    return render(request, 'medical_upload.html')
+    return render(request, 'medical_upload.html', {'crypto_runtime': get_runtime_config()})
 
 @login_required
 @require_http_methods(["GET"])
@@ -224,7 +474,8 @@ def get_access_policies(request):
 
 @api_requires_doctor_role()
 @require_http_methods(["POST"])
-def upload_medical_record(request):
+@timed('upload_medical_record')
+async def upload_medical_record(request):
     """
     API endpoint để upload medical record đã mã hóa - chỉ dành cho bác sĩ
     """
@@ -232,50 +483,20 @@ def upload_medical_record(request):
         # Parse JSON data từ request
         data = json.loads(request.body)
         
-        # Validate required fields
-        required_fields = [
-            'patient_id',
-            'patient_info_aes_key_blob',
-            'patient_info_aes_iv_blob',
-            'medical_record_aes_key_blob', 
-            'medical_record_aes_iv_blob'
-        ]
-        
-        for field in required_fields:
-            if field not in data:
-                return JsonResponse({
-                    'success': False,
-                    'error': f'Missing required field: {field}',
-                    'message': 'Thiếu thông tin bắt buộc'
-                }, status=400)
-        
-        # Convert base64 strings to bytes
-        encrypted_data = {}
-        binary_fields = [
-            'patient_info_aes_key_blob', 'patient_info_aes_iv_blob',
-            'medical_record_aes_key_blob', 'medical_record_aes_iv_blob',
-            'patient_name_blob', 'patient_age_blob',
-            'patient_gender_blob', 'patient_phone_blob',
-            'chief_complaint_blob', 'past_medical_history_blob',
-            'diagnosis_blob', 'status_blob'
-        ]
-        
-        import base64
-        for field in binary_fields:
-            if field in data and data[field]:
-                try:
-                    encrypted_data[field] = base64.b64decode(data[field])
-                except Exception as e:
-                    return JsonResponse({
-                        'success': False,
-                        'error': f'Invalid base64 data for field: {field}',
-                        'message': f'Dữ liệu mã hóa không hợp lệ: {field}'
-                    }, status=400)
+        # Validate required fields và convert base64 strings to bytes
+        try:
+            patient_id, encrypted_data = decode_medical_record_payload(data)
+        except MedicalRecordPayloadError as e:
+            return JsonResponse({
+                'success': False,
+                'error': e.error,
+                'message': e.message
+            }, status=400)
         
         # Create medical record
-        medical_record = create_medical_data_record(
-            owner_user=request.user,
-            patient_id=data['patient_id'],
+        medical_record = await acreate_medical_data_record(
+            owner_user=await request.auser(),
+            patient_id=patient_id,
             **encrypted_data
         )
         
@@ -310,16 +531,136 @@ def upload_medical_record(request):
             'message': 'Lỗi khi upload medical record'
         }, status=500)
 
+@login_required
+@require_http_methods(["GET"])
+@timed('get_encrypted_medical_record_binary')
+def get_encrypted_medical_record_binary(request, record_id):
+    """
+    Giống get_encrypted_medical_record nhưng trả về container nhị phân (stream) thay vì
+    JSON base64 - client đưa thẳng các phần vào WebCrypto dưới dạng ArrayBuffer.
+    """
+    try:
+        metadata, parts = get_medical_record_container_parts(record_id, get_attribute_ids(get_request_attribute_snapshot(request).names))
+    except MedicalData.DoesNotExist:
+        return JsonResponse({
+            'success': False,
+            'message': 'Medical record không tồn tại.'
+        }, status=404)
+    
+    response = StreamingHttpResponse(
+        iter_medical_record_container(metadata, parts),
+        content_type=RECORD_CONTAINER_CONTENT_TYPE
+    )
+    response['Content-Length'] = str(get_medical_record_container_length(metadata, parts))
+    response['Cache-Control'] = 'no-store'
+    return response
+
+def _iter_batch_upload_items(request):
+    """
+    Đọc các record của batch upload: NDJSON (đọc dần theo dòng, không giới hạn kích thước body)
+    hoặc JSON array / {"records": [...]}. Yield (index, item) - item là None nếu dòng không phải JSON.
+    """
+    content_type = request.content_type or ''
+    if content_type in ('application/x-ndjson', 'application/jsonl'):
+        index = 0
+        for line in request:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError:
+                yield index, None
+            index += 1
+        return
+    
+    data = json.loads(request.body)
+    if isinstance(data, dict):
+        data = data.get('records')
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array of records')
+    yield from enumerate(data)
+
+
+def _flush_batch_upload_chunk(pending, results):
+    """Lưu chunk bằng bulk_create, ghi kết quả cho từng item (cả chunk thất bại nếu insert lỗi)"""
+    if not pending:
+        return 0
+    indexes = [index for index, _ in pending]
+    try:
+        created = bulk_create_medical_data_records([record for _, record in pending])
+    except Exception as e:
+        print(f"Error bulk creating medical data records: {e}")
+        for index in indexes:
+            results.append({'index': index, 'success': False, 'error': 'Database error', 'message': 'Không thể lưu hồ sơ y tế'})
+        return 0
+    for index, record in zip(indexes, created):
+        results.append({'index': index, 'success': True, 'id': record.pk, 'patient_id': record.patient_id})
+    return len(created)
+
+
+@api_requires_doctor_role()
+@require_http_methods(["POST"])
+@timed('upload_medical_records_batch')
+def upload_medical_records_batch(request):
+    """
+    API upload nhiều medical record đã mã hóa trong một request - chỉ dành cho bác sĩ.
+    Mỗi record có cùng định dạng với upload_medical_record; record lỗi không ảnh hưởng
+    các record khác. Các record hợp lệ được lưu bằng bulk_create theo từng chunk (transaction riêng).
+    """
+    chunk_size = getattr(settings, 'MEDICAL_DATA_BATCH_CHUNK_SIZE', 500)
+    results = []
+    pending = []
+    created_count = 0
+    
+    try:
+        for index, item in _iter_batch_upload_items(request):
+            if item is None:
+                results.append({'index': index, 'success': False, 'error': 'Invalid JSON data', 'message': 'Dữ liệu JSON không hợp lệ'})
+                continue
+            try:
+                patient_id, encrypted_data = decode_medical_record_payload(item)
+            except MedicalRecordPayloadError as e:
+                results.append({'index': index, 'success': False, 'error': e.error, 'message': e.message})
+                continue
+            
+            pending.append((index, build_medical_data_record(request.user, patient_id, **encrypted_data)))
+            if len(pending) >= chunk_size:
+                created_count += _flush_batch_upload_chunk(pending, results)
+                pending = []
+        
+        created_count += _flush_batch_upload_chunk(pending, results)
+        
+    except ValueError as e:
+        # Body không phải JSON array hợp lệ (chưa có record nào được đọc)
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'message': 'Dữ liệu JSON không hợp lệ'
+        }, status=400)
+    
+    results.sort(key=lambda result: result['index'])
+    return JsonResponse({
+        'success': created_count == len(results),
+        'data': {
+            'total': len(results),
+            'created': created_count,
+            'failed': len(results) - created_count,
+            'results': results,
+        },
+        'message': f'Uploaded {created_count}/{len(results)} medical records'
+    })
+
 @login_required
 def medical_record_detail_view(request, record_id):
     """View để hiển thị chi tiết một medical record"""
     try:
         medical_record = MedicalData.objects.get(id=record_id)
-        user_attributes = UserAttribute.objects.filter(user=request.user)
         
         context = {
             'medical_record': medical_record,
-            'user_attributes': user_attributes,
+            'user_attributes': get_request_attribute_snapshot(request).user_attributes,
+            'crypto_runtime': get_runtime_config(),
         }
         
         return render(request, 'medical_record_detail.html', context)
@@ -330,10 +671,13 @@ def medical_record_detail_view(request, record_id):
 
 @login_required
 @require_http_methods(["GET"])
-def get_encrypted_medical_record(request, record_id):
+@timed('get_encrypted_medical_record')
+async def get_encrypted_medical_record(request, record_id):
     """API endpoint để lấy dữ liệu medical record đã mã hóa cho client-side decryption"""
     try:
-        medical_record = MedicalData.objects.get(id=record_id)
+        medical_record = await MedicalData.objects.select_related('owner_user').aget(id=record_id)
+        snapshot = await aget_request_attribute_snapshot(request)
+        annotate_decrypt_flags(medical_record, await aget_attribute_ids(snapshot.names))
         
         # Convert binary data to base64 for JSON transport
         import base64
@@ -345,6 +689,10 @@ def get_encrypted_medical_record(request, record_id):
             'created_at': medical_record.created_at.isoformat(),
             'created_date': medical_record.created_date.isoformat(),
             
+            # Kết quả đánh giá policy đã lưu (None nếu bản ghi cũ không có policy)
+            'can_decrypt_patient_info': medical_record.can_decrypt_patient_info,
+            'can_decrypt_medical_record': medical_record.can_decrypt_medical_record,
+            
             # Patient info encrypted fields
             'patient_name_blob': base64.b64encode(medical_record.patient_name_blob).decode('utf-8') if medical_record.patient_name_blob else None,
             'patient_age_blob': base64.b64encode(medical_record.patient_age_blob).decode('utf-8') if medical_record.patient_age_blob else None,
@@ -382,3 +730,127 @@ def get_encrypted_medical_record(request, record_id):
             'message': f'Lỗi khi lấy dữ liệu: {str(e)}'
         }, status=500)
         
+
+@login_required
+@require_http_methods(["POST"])
+def create_transformation_key(request):
+    """
+    Lưu transformation key (secret key đã blind bằng 1/z phía client) cho outsourced decryption.
+    Body: {"transform_key": {...}} cùng dạng 'secret_key' của /api/abe/secret-key/.
+    """
+    try:
+        data = json.loads(request.body)
+        transformation_key = store_transformation_key(request.user, data.get('transform_key') if isinstance(data, dict) else None)
+        return JsonResponse({
+            'success': True,
+            'data': {
+                'key_id': str(transformation_key.id),
+                'created_at': transformation_key.created_at.isoformat()
+            },
+            'message': 'Transformation key stored successfully'
+        })
+        
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON data',
+            'message': 'Dữ liệu JSON không hợp lệ'
+        }, status=400)
+        
+    except TransformationKeyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': e.error,
+            'message': e.message
+        }, status=400)
+        
+    except ValueError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'message': 'User has no attributes assigned'
+        }, status=400)
+        
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e),
+            'message': 'Lỗi khi lưu transformation key'
+        }, status=500)
+
+@login_required
+@require_http_methods(["GET"])
+@timed('transform_medical_record')
+async def transform_medical_record(request, record_id):
+    """
+    Outsourced decryption: server làm phần pairing của Waters11 decrypt cho AES key blob của
+    record bằng transformation key ?key_id=..., trả về (message, transformed) cho mỗi nhóm;
+    client hoàn tất bằng message * transformed^z. Nhóm không thỏa mãn policy trả về null.
+    409 khi key không tồn tại hoặc attributes đã thay đổi (client tạo key mới).
+    """
+    try:
+        key_data = await aget_transformation_key_data(await request.auser(), request.GET.get('key_id', ''))
+        snapshot = await aget_request_attribute_snapshot(request)
+        key_blobs = await aget_transform_key_blobs(record_id, await aget_attribute_ids(snapshot.names))
+        transformed = await run_in_crypto_executor(
+            transform_medical_record_keys, key_data, key_blobs, operation='waters11_transform'
+        )
+        
+        response = JsonResponse({
+            'success': True,
+            'data': transformed
+        })
+        response['Cache-Control'] = 'no-store'
+        return response
+        
+    except TransformationKeyError as e:
+        return JsonResponse({
+            'success': False,
+            'error': e.error,
+            'message': e.message
+        }, status=409)
+        
+    except MedicalData.DoesNotExist:
+        return JsonResponse({
+            'success': False,
+            'message': 'Medical record không tồn tại.'
+        }, status=404)
+        
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'message': f'Lỗi khi transform dữ liệu: {str(e)}'
+        }, status=500)
+
+@require_http_methods(["GET", "HEAD"])
+def crypto_runtime_file(request, version, filename):
+    """
+    File của bundle crypto runtime (Pyodide + charm). Thư mục đặt tên theo hash nội dung
+    nên response được cache vĩnh viễn (immutable).
+    """
+    path = find_runtime_file(f'{version}/{filename}') if CRYPTO_RUNTIME_VERSION_RE.fullmatch(version) else None
+    if path is None:
+        raise Http404('Crypto runtime file not found')
+    
+    content_type = CRYPTO_RUNTIME_CONTENT_TYPES.get(path.suffix, 'application/octet-stream')
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+@require_http_methods(["GET"])
+def crypto_runtime_service_worker(request):
+    """
+    Service worker precache bundle crypto runtime hiện tại. Danh sách file nằm trong script
+    nên trình duyệt tự cài lại service worker khi bundle đổi.
+    """
+    version, precache_urls = get_precache_urls()
+    response = render(request, 'crypto_runtime_sw.js', {
+        'runtime_json': json.dumps({
+            'version': version,
+            'prefix': precache_urls[0].rsplit('/', 2)[0] + '/' if precache_urls else None,
+            'urls': precache_urls,
+        }),
+    }, content_type='text/javascript')
+    response['Cache-Control'] = 'no-cache'
+    response['Service-Worker-Allowed'] = '/'
+    return response
@@ -0,0 +1,66 @@
+"""
+Cấu hình gunicorn cho project chính:  gunicorn -c gunicorn.conf.py
+GUNICORN_ASGI=True chạy project.asgi với worker uvicorn (async view không chặn worker khi keygen).
+
+Với preload_app (mặc định bật), Django và Charm (group, PK, MSK, bảng precomputation)
+được load một lần trong master rồi các worker fork ra dùng chung copy-on-write,
+nên restart/scale worker không phải trả lại chi phí khởi tạo.
+"""
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+if os.getenv('GUNICORN_ASGI', 'False').lower() in ('true', '1', 'yes'):
+    wsgi_app = 'project.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'project.wsgi:application'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+preload_app = os.getenv('GUNICORN_PRELOAD_APP', 'True').lower() in ('true', '1', 'yes')
+
+# prometheus_client multiprocess mode: mỗi worker ghi metrics vào file trong thư mục chung để
+# /metrics tổng hợp từ mọi worker. Phải đặt trước khi load app (prometheus_client đọc biến lúc import)
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'abe-metrics-main'))
+
+
+def _warm_up(log):
+    from backend.abe_utils import warm_up
+    try:
+        log.info(f"CP-ABE warm-up loaded: {', '.join(warm_up())}")
+    except Exception as e:
+        # Không chặn server khởi động - worker sẽ tự khởi tạo lazy ở request đầu tiên
+        log.error(f"CP-ABE warm-up failed: {e}")
+
+
+def on_starting(server):
+    """Xóa file metrics của lần chạy trước để counter bắt đầu lại từ 0 sau khi restart"""
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    """Chạy trong master sau khi app đã preload, trước khi fork worker"""
+    if not preload_app:
+        return
+    _warm_up(server.log)
+    # Không để worker kế thừa connection DB mở trong master
+    from django.db import connections
+    connections.close_all()
+    # Đưa các object đã load vào permanent generation để GC trong worker không ghi lên
+    # các trang nhớ dùng chung (giữ copy-on-write)
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Không preload: mỗi worker tự warm-up sau khi load app, trước request đầu tiên"""
+    if not preload_app:
+        _warm_up(worker.log)
+
+
+def child_exit(server, worker):
+    """Worker đã dừng: giữ số liệu counter/histogram của nó, bỏ file gauge theo pid"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -12,10 +12,16 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Thư mục gốc của repo chứa các module dùng chung giữa các project (abe_common)
+REPO_ROOT = BASE_DIR.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.append(str(REPO_ROOT))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -44,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'abe_common.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -160,9 +167,24 @@ SIMPLE_JWT = {
 
     'JTI_CLAIM': 'jti',
 }
+# Token đã xác thực được cache trong memory mỗi process (không quá exp của token)
+JWT_CACHE_TTL = 300
+JWT_CACHE_SIZE = 1024
     
 STATIC_URL = 'static/'
 
+# Ciphertext EHR (FileField) lưu trong MEDIA_ROOT; không có MEDIA_URL vì file chỉ được
+# tải qua /api/ehr/<id>/content/ sau khi kiểm tra policy
+MEDIA_ROOT = BASE_DIR / 'media'
+# Giới hạn kích thước request upload nhị phân /api/ehr/upload/binary/
+EHR_MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+
 # CP-ABE Configuration
 # PHẢI KHỚP VỚI PAIRING GROUP DÙNG Ở AUTH CENTER VÀ CLIENT
-CPABE_PAIRING_GROUP = 'SS512'
\ No newline at end of file
+CPABE_PAIRING_GROUP = 'SS512'
+# Số policy tree đã parse và số kết quả (policy, tập thuộc tính) giữ trong memory mỗi process
+CPABE_POLICY_CACHE_SIZE = 1024
+CPABE_POLICY_DECISION_CACHE_SIZE = 16384
+
+# Nếu đặt, /metrics yêu cầu header 'Authorization: Bearer <token>'; không đặt thì /metrics chỉ mở khi DEBUG
+METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN')
\ No newline at end of file
@@ -2,18 +2,93 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from collections import OrderedDict
+import hashlib
 import logging
+import threading
+import time
+
+from abe_common.metrics import CACHE_LOOKUPS, increment
 
 logger = logging.getLogger(__name__)
 
+
+def parse_cpabe_attributes(user_attributes):
+    """Claim user_attributes ("A,B,C") -> frozenset thuộc tính CP-ABE"""
+    if not user_attributes:
+        return frozenset()
+    return frozenset(attr.strip() for attr in user_attributes.split(',') if attr.strip())
+
+
+class AuthCenterUser:
+    """User dựng từ claims của token Auth Center (không có bản ghi trong DB của Resource Server)"""
+    __slots__ = ('id', 'username', 'email', 'user_attributes', 'cpabe_attributes')
+
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+
+    def __init__(self, user_id, username, email, user_attributes):
+        self.id = user_id
+        self.username = username
+        self.email = email
+        self.user_attributes = user_attributes
+        # Tách sẵn một lần cho mỗi token để permission không phải parse lại
+        self.cpabe_attributes = parse_cpabe_attributes(user_attributes)
+
+
+# Token đã xác thực: sha256(raw token) -> (hết hạn lúc, validated token, user)
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
 class CustomJWTAuthentication(JWTAuthentication):
     """
     Custom JWT Authentication class cho Resource Server
     Xác thực JWT tokens từ Auth Center sử dụng EC public key
-    và parse các custom claims như user_attributes
+    và parse các custom claims như user_attributes.
+    Token đã xác thực được cache (LRU, tối đa JWT_CACHE_TTL giây và không quá exp của token)
+    để các request liên tiếp với cùng token không phải verify ECDSA lại.
     """
-    
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        cache_key = hashlib.sha256(raw_token).digest()
+        now = time.time()
+        with _token_cache_lock:
+            entry = _token_cache.get(cache_key)
+            if entry is not None:
+                if entry[0] > now:
+                    _token_cache.move_to_end(cache_key)
+                else:
+                    del _token_cache[cache_key]
+                    entry = None
+        increment(CACHE_LOOKUPS, cache='jwt', result='miss' if entry is None else 'hit')
+        if entry is not None:
+            return entry[2], entry[1]
+
+        validated_token = self.get_validated_token(raw_token)
+        user = self.get_user(validated_token)
+
+        expires_at = now + getattr(settings, 'JWT_CACHE_TTL', 300)
+        if validated_token.get('exp') is not None:
+            expires_at = min(expires_at, validated_token['exp'])
+        with _token_cache_lock:
+            _token_cache[cache_key] = (expires_at, validated_token, user)
+            _token_cache.move_to_end(cache_key)
+            while len(_token_cache) > getattr(settings, 'JWT_CACHE_SIZE', 1024):
+                _token_cache.popitem(last=False)
+        return user, validated_token
+
     def get_user(self, validated_token):
         """
         Tạo user object từ validated token với custom claims từ Auth Center
@@ -24,30 +99,22 @@ class CustomJWTAuthentication(JWTAuthentication):
             if user_id is None:
                 logger.error("No user_id found in token from Auth Center")
                 raise InvalidToken('Token contained no recognizable user identification')
-            
-            # Tạo user object với thông tin từ Auth Center token
-            class AuthenticatedUser:
-                def __init__(self, user_id):
-                    self.id = user_id
-                    self.is_authenticated = True
-                    self.is_anonymous = False
-                    self.is_active = True
-            
-            user = AuthenticatedUser(user_id)
-            
-            # Parse các thông tin cơ bản
-            user.username = validated_token.get('username', f'user_{user_id}')
-            user.email = validated_token.get('email', '')
-            
-            # Parse custom attributes từ Auth Center (quan trọng cho ABAC)
-            user.user_attributes = validated_token.get('user_attributes', '')
-            
-            # Log thông tin user đã được authenticate
+
+            # Tạo user object với thông tin từ Auth Center token;
+            # user_attributes là custom attributes từ Auth Center (quan trọng cho ABAC)
+            user = AuthCenterUser(
+                user_id,
+                validated_token.get('username', f'user_{user_id}'),
+                validated_token.get('email', ''),
+                validated_token.get('user_attributes', ''),
+            )
+
+            # Chỉ chạy khi token chưa có trong cache (lần đầu thấy token)
             logger.info(f"Successfully authenticated user from Auth Center: id={user.id}, username={user.username}")
             logger.debug(f"User attributes: {user.user_attributes}")
-            
+
             return user
-            
+
         except Exception as e:
             logger.error(f"Error parsing token from Auth Center: {e}")
-            raise InvalidToken('Invalid token from Auth Center') 
\ No newline at end of file
+            raise InvalidToken('Invalid token from Auth Center')
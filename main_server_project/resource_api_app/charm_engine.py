@@ -0,0 +1,146 @@
+"""
+Registry lazy cho các thành phần Charm-Crypto dùng để kiểm tra policy (PairingGroup, MSP).
+Charm chỉ được import và khởi tạo ở lần dùng đầu tiên hoặc khi gọi warm_up()
+(gunicorn master với preload_app), không phải lúc import module.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+from abe_common.metrics import CACHE_LOOKUPS, increment
+
+logger = logging.getLogger(__name__)
+
+_init_lock = threading.Lock()
+_initialized = False
+_pairing_group = None
+_msp = None
+
+
+def _initialize():
+    global _initialized, _pairing_group, _msp
+    with _init_lock:
+        if _initialized:
+            return
+        # Chỉ thử khởi tạo một lần; nếu lỗi thì các permission sẽ từ chối truy cập
+        _initialized = True
+        try:
+            from charm.toolbox.pairinggroup import PairingGroup
+            from charm.toolbox.msp import MSP
+
+            # Lấy tên nhóm từ settings
+            pairing_group_name = getattr(settings, 'CPABE_PAIRING_GROUP', 'SS512')
+            _pairing_group = PairingGroup(pairing_group_name)
+            _msp = MSP(_pairing_group, verbose=False)
+            logger.info(f"Charm-Crypto PairingGroup '{pairing_group_name}' and MSP initialized for policy checking.")
+        except ImportError as e:
+            logger.critical(f"CRITICAL: Failed to import Charm-Crypto: {e}. Install with 'pip install Charm-Crypto==0.50'")
+        except Exception as e:
+            logger.critical(f"CRITICAL: Failed to initialize Charm-Crypto components for policy checking: {e}. ABAC based on CP-ABE policy will not work.")
+
+
+def get_pairing_group():
+    """PairingGroup dùng chung, None nếu không khởi tạo được Charm"""
+    if not _initialized:
+        _initialize()
+    return _pairing_group
+
+
+def get_msp():
+    """MSP dùng chung, None nếu không khởi tạo được Charm"""
+    if not _initialized:
+        _initialize()
+    return _msp
+
+
+def warm_up():
+    """Khởi tạo trước (gọi trong gunicorn master). Trả về True nếu Charm sẵn sàng"""
+    return get_msp() is not None
+
+
+# ==================== POLICY CACHE ====================
+# Cùng một vài trăm policy lặp lại trên rất nhiều bản ghi: giữ policy tree đã parse (LRU) và
+# kết quả đánh giá theo (hash policy, tập thuộc tính) để không parse/prune lại mỗi request.
+
+_policy_cache_lock = threading.Lock()
+_policy_trees = OrderedDict()  # policy digest -> policy tree
+_policy_decisions = OrderedDict()  # (policy digest, frozenset thuộc tính) -> (satisfied, attributes)
+
+
+def _lru_get(cache, key, name):
+    with _policy_cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+    increment(CACHE_LOOKUPS, cache=name, result='miss' if value is None else 'hit')
+    return value
+
+
+def _lru_put(cache, key, value, max_size):
+    with _policy_cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+
+def get_policy_tree(policy_string):
+    """Policy tree đã parse (dùng chung, chỉ đọc) cho policy_string; raise nếu policy không hợp lệ"""
+    msp = get_msp()
+    digest = hashlib.sha256(policy_string.encode('utf-8')).digest()
+    tree = _lru_get(_policy_trees, digest, 'policy_tree')
+    if tree is None:
+        tree = msp.createPolicy(policy_string)
+        if tree is None:
+            raise ValueError(f"Cannot parse policy: {policy_string}")
+        _lru_put(_policy_trees, digest, tree, getattr(settings, 'CPABE_POLICY_CACHE_SIZE', 1024))
+    return tree
+
+
+def evaluate_policy(policy_string, user_attributes):
+    """
+    Đánh giá policy với user_attributes bằng MSP.prune, có memo theo (policy, tập thuộc tính).
+    Trả về (True, tập con thuộc tính thỏa mãn) hoặc (False, toàn bộ thuộc tính của policy).
+    """
+    digest = hashlib.sha256(policy_string.encode('utf-8')).digest()
+    decision_key = (digest, frozenset(user_attributes))
+    decision = _lru_get(_policy_decisions, decision_key, 'policy_decision')
+    if decision is not None:
+        return decision
+
+    msp = get_msp()
+    tree = get_policy_tree(policy_string)
+    satisfied_attributes = msp.prune(tree, list(user_attributes))
+    if satisfied_attributes is not False and satisfied_attributes is not None:
+        decision = (True, tuple(str(attr) for attr in satisfied_attributes))
+    else:
+        decision = (False, tuple(msp.getAttributeList(tree)))
+    _lru_put(_policy_decisions, decision_key, decision,
+             getattr(settings, 'CPABE_POLICY_DECISION_CACHE_SIZE', 16384))
+    return decision
+
+
+def evaluate_policies(policy_strings, user_attributes):
+    """
+    Đánh giá nhiều policy (ví dụ của một trang bản ghi) với cùng tập thuộc tính:
+    mỗi policy khác nhau chỉ đánh giá một lần. Trả về {policy: True/False}; policy lỗi coi như False.
+    """
+    attributes = frozenset(user_attributes)
+    decisions = {}
+    for policy_string in policy_strings:
+        if policy_string in decisions:
+            continue
+        try:
+            decisions[policy_string] = evaluate_policy(policy_string, attributes)[0]
+        except Exception as e:
+            logger.error(f"Lỗi khi đánh giá policy CP-ABE '{policy_string}': {e}")
+            decisions[policy_string] = False
+    return decisions
+
+
+def get_policy_cache_stats():
+    """Số phần tử hiện có của hai cache (hit/miss xem ở cache_lookups_total trên /metrics)"""
+    with _policy_cache_lock:
+        return {'policy_trees': len(_policy_trees), 'policy_decisions': len(_policy_decisions)}
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-17 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resource_api_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='protectedehrtextdata',
+            index=models.Index(fields=['patient_id_on_rs', '-created_at', '-id'], name='resource_ap_patient_107ed3_idx'),
+        ),
+    ]
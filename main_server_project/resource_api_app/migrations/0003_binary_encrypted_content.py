@@ -0,0 +1,78 @@
+# Generated by Django 5.2.3 on 2026-10-17 11:00
+
+import base64
+import binascii
+
+import resource_api_app.models
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+
+
+def _decode_legacy_base64(value):
+    # Bản ghi test cũ có thể chứa chuỗi không phải base64 ("dummy_kek_..."): giữ nguyên bytes của chuỗi
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return value.encode('utf-8')
+
+
+def base64_to_binary(apps, schema_editor):
+    ProtectedEHRTextData = apps.get_model('resource_api_app', 'ProtectedEHRTextData')
+    for entry in ProtectedEHRTextData.objects.iterator(chunk_size=100):
+        entry.encrypted_kek = _decode_legacy_base64(entry.encrypted_kek_b64)
+        entry.encrypted_main_content.save(
+            f'{entry.id}.bin', ContentFile(_decode_legacy_base64(entry.encrypted_main_content_b64)), save=False
+        )
+        entry.save(update_fields=['encrypted_kek', 'encrypted_main_content'])
+
+
+def binary_to_base64(apps, schema_editor):
+    ProtectedEHRTextData = apps.get_model('resource_api_app', 'ProtectedEHRTextData')
+    for entry in ProtectedEHRTextData.objects.iterator(chunk_size=100):
+        entry.encrypted_kek_b64 = base64.b64encode(bytes(entry.encrypted_kek)).decode('ascii')
+        with entry.encrypted_main_content.open('rb') as content:
+            entry.encrypted_main_content_b64 = base64.b64encode(content.read()).decode('ascii')
+        entry.save(update_fields=['encrypted_kek_b64', 'encrypted_main_content_b64'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resource_api_app', '0002_protectedehrtextdata_resource_ap_patient_107ed3_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='protectedehrtextdata',
+            name='encrypted_kek',
+            field=models.BinaryField(default=b'', verbose_name='KEK đã mã hóa CP-ABE'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='protectedehrtextdata',
+            name='encrypted_main_content',
+            field=models.FileField(default='', upload_to=resource_api_app.models.encrypted_content_upload_to, verbose_name='Nội dung chính đã mã hóa AES'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(base64_to_binary, binary_to_base64),
+        # Default rỗng chỉ để khi migrate ngược, cột base64 thêm lại được trên bảng đã có dữ liệu
+        # (binary_to_base64 điền giá trị thật ngay sau đó)
+        migrations.AlterField(
+            model_name='protectedehrtextdata',
+            name='encrypted_kek_b64',
+            field=models.TextField(default='', verbose_name='KEK đã mã hóa CP-ABE (Base64)'),
+        ),
+        migrations.AlterField(
+            model_name='protectedehrtextdata',
+            name='encrypted_main_content_b64',
+            field=models.TextField(default='', verbose_name='Nội dung chính đã mã hóa AES (Base64)'),
+        ),
+        migrations.RemoveField(
+            model_name='protectedehrtextdata',
+            name='encrypted_kek_b64',
+        ),
+        migrations.RemoveField(
+            model_name='protectedehrtextdata',
+            name='encrypted_main_content_b64',
+        ),
+    ]
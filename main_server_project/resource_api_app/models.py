@@ -1,6 +1,13 @@
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 import uuid # Vẫn có thể dùng uuid cho ID của bản ghi nếu muốn
 
+
+def encrypted_content_upload_to(instance, filename):
+    """File ciphertext đặt theo ID bản ghi (không dùng tên file/mã bệnh nhân của client)"""
+    return f"ehr_ciphertext/{instance.id}.bin"
+
 class ProtectedEHRTextData(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
 
@@ -32,14 +39,18 @@ class ProtectedEHRTextData(models.Model):
     cpabe_policy_applied = models.TextField(verbose_name="Chính sách CP-ABE đã áp dụng cho KEK")
 
     # --- Các thành phần đã được mã hóa phía Client ---
-    # KEK (Key Encryption Key - khóa AES) đã được mã hóa bằng CP-ABE, sau đó encode Base64
-    encrypted_kek_b64 = models.TextField(verbose_name="KEK đã mã hóa CP-ABE (Base64)")
+    # KEK (Key Encryption Key - khóa AES) đã được mã hóa bằng CP-ABE, lưu dạng bytes
+    encrypted_kek = models.BinaryField(verbose_name="KEK đã mã hóa CP-ABE")
 
     # IV (Initialization Vector) của AES-GCM, đã được encode Base64
     aes_iv_b64 = models.CharField(max_length=24, verbose_name="AES IV (Base64)") # IV của AES-GCM thường là 12 bytes, Base64 sẽ dài hơn chút
 
-    # Nội dung chính đã được mã hóa bằng AES-GCM (sử dụng KEK), sau đó encode Base64
-    encrypted_main_content_b64 = models.TextField(verbose_name="Nội dung chính đã mã hóa AES (Base64)")
+    # Nội dung chính đã được mã hóa bằng AES-GCM (sử dụng KEK), lưu dạng file nhị phân trong storage
+    # (upload streaming ghi thẳng vào storage, không qua base64/JSON trong memory)
+    encrypted_main_content = models.FileField(
+        upload_to=encrypted_content_upload_to,
+        verbose_name="Nội dung chính đã mã hóa AES"
+    )
 
 
     # (Tùy chọn) Metadata cho việc kiểm soát truy cập API (ABAC trên RS)
@@ -49,6 +60,17 @@ class ProtectedEHRTextData(models.Model):
         verbose_name = "Dữ Liệu EHR Văn Bản Đã Mã Hóa"
         verbose_name_plural = "Các Dữ Liệu EHR Văn Bản Đã Mã Hóa"
         ordering = ['-created_at']
+        indexes = [
+            # Danh sách bản ghi của bệnh nhân phân trang keyset (created_at, id)
+            models.Index(fields=['patient_id_on_rs', '-created_at', '-id']),
+        ]
 
     def __str__(self):
-        return f"EHR Text Entry for Patient {self.patient_id_on_rs} (Type: {self.data_type or 'N/A'}) by UserACID {self.created_by_ac_user_id} on {self.created_at.strftime('%Y-%m-%d')}"
\ No newline at end of file
+        return f"EHR Text Entry for Patient {self.patient_id_on_rs} (Type: {self.data_type or 'N/A'}) by UserACID {self.created_by_ac_user_id} on {self.created_at.strftime('%Y-%m-%d')}"
+
+
+@receiver(post_delete, sender=ProtectedEHRTextData)
+def delete_encrypted_content_file(sender, instance, **kwargs):
+    """Xóa file ciphertext khi bản ghi bị xóa"""
+    if instance.encrypted_main_content:
+        instance.encrypted_main_content.delete(save=False)
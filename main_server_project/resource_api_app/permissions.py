@@ -1,26 +1,22 @@
 from rest_framework.permissions import BasePermission
 import logging
-from django.conf import settings
 
-logger = logging.getLogger(__name__)
+from .authentication import parse_cpabe_attributes
+from .charm_engine import evaluate_policy, get_msp
+from abe_common.metrics import timed
 
-# Khởi tạo Charm-Crypto components một lần
-CHARM_GROUP_FOR_POLICY_CHECK = None
-MSP_UTIL_FOR_POLICY_CHECK = None
+logger = logging.getLogger(__name__)
 
-try:
-    from charm.toolbox.pairinggroup import PairingGroup
-    from charm.toolbox.msp import MSP
-    
-    # Lấy tên nhóm từ settings
-    pairing_group_name = getattr(settings, 'CPABE_PAIRING_GROUP', 'SS512')
-    CHARM_GROUP_FOR_POLICY_CHECK = PairingGroup(pairing_group_name)
-    MSP_UTIL_FOR_POLICY_CHECK = MSP(CHARM_GROUP_FOR_POLICY_CHECK, verbose=False)
-    logger.info(f"Charm-Crypto PairingGroup '{pairing_group_name}' and MSP initialized for policy checking.")
-except ImportError as e:
-    logger.critical(f"CRITICAL: Failed to import Charm-Crypto: {e}. Install with 'pip install Charm-Crypto==0.50'")
-except Exception as e:
-    logger.critical(f"CRITICAL: Failed to initialize Charm-Crypto components for policy checking: {e}. ABAC based on CP-ABE policy will not work.")
+def get_token_cpabe_attributes(request):
+    """
+    Frozenset thuộc tính CP-ABE của user: lấy sẵn từ AuthCenterUser (đã tách khi xác thực token),
+    ngược lại parse claim user_attributes của JWT ("A,B,C")
+    """
+    cpabe_attributes = getattr(request.user, 'cpabe_attributes', None)
+    if cpabe_attributes is not None:
+        return cpabe_attributes
+    token_payload = getattr(request.auth, 'payload', None) or {}
+    return parse_cpabe_attributes(token_payload.get('user_attributes', ""))
 
 class CanUploadTextDataPermission(BasePermission):
     """
@@ -39,6 +35,7 @@ class SatisfiesCPABEPolicyPermission(BasePermission):
     """
     message = "Thuộc tính của bạn không thỏa mãn chính sách truy cập của dữ liệu này."
 
+    @timed('cpabe_policy_check')
     def has_object_permission(self, request, view, obj):
         """
         Kiểm tra quyền trên một đối tượng 'obj' cụ thể (là instance của ProtectedEHRTextData).
@@ -53,30 +50,22 @@ class SatisfiesCPABEPolicyPermission(BasePermission):
             logger.warning(f"request.auth không tồn tại trong SatisfiesCPABEPolicyPermission: hasattr={hasattr(request, 'auth')}, auth={getattr(request, 'auth', 'None')}")
             return False
             
-        if not CHARM_GROUP_FOR_POLICY_CHECK or not MSP_UTIL_FOR_POLICY_CHECK:
-            logger.error(f"Thành phần Charm-Crypto (Group/MSP) chưa được khởi tạo. Group={CHARM_GROUP_FOR_POLICY_CHECK}, MSP={MSP_UTIL_FOR_POLICY_CHECK}")
+        msp_util = get_msp()
+        if msp_util is None:
+            logger.error("Thành phần Charm-Crypto (Group/MSP) chưa được khởi tạo.")
             # Quyết định hành vi: an toàn nhất là từ chối
             self.message = "Lỗi hệ thống: Không thể xác minh chính sách truy cập."
             return False
 
-        # Bước 2: Lấy thuộc tính CP-ABE của người dùng từ JWT
-        token_payload = request.auth.payload
+        # Bước 2: Lấy thuộc tính CP-ABE của người dùng từ JWT (claim user_attributes)
+        user_cpabe_attributes = get_token_cpabe_attributes(request)
         
-        # Đọc từ user_attributes thay vì cpabe_ids (theo JWT payload thực tế)
-        user_cpabe_ids_str = token_payload.get('user_attributes', "")  # Đọc từ user_attributes
-        
-        user_attributes_list_for_charm = []  # Charm MSP thường làm việc với list các string thuộc tính
-        if user_cpabe_ids_str:
-            user_attributes_list_for_charm = [
-                attr.strip() for attr in user_cpabe_ids_str.split(',') if attr.strip()
-            ]
-        
-        if not user_attributes_list_for_charm:
+        if not user_cpabe_attributes:
             logger.warning(f"User {request.user.id} không có thuộc tính CP-ABE nào trong token.")
             self.message = "Bạn không có thuộc tính CP-ABE nào để đối chiếu với chính sách."
             return False
             
-        logger.debug(f"User {request.user.id} CP-ABE attributes for policy check: {user_attributes_list_for_charm}")
+        logger.debug(f"User {request.user.id} CP-ABE attributes for policy check: {user_cpabe_attributes}")
 
         # Bước 3: Lấy chuỗi policy CP-ABE của đối tượng dữ liệu 'obj'
         if not hasattr(obj, 'cpabe_policy_applied') or not obj.cpabe_policy_applied:
@@ -86,52 +75,34 @@ class SatisfiesCPABEPolicyPermission(BasePermission):
         
         resource_cpabe_policy_string = obj.cpabe_policy_applied
         logger.debug(f"Checking policy for resource (ID: {getattr(obj, 'id', 'N/A')}): '{resource_cpabe_policy_string}' "
-                     f"against user attributes {user_attributes_list_for_charm}")
+                     f"against user attributes {user_cpabe_attributes}")
 
-        # Bước 4: Kiểm tra CP-ABE policy toàn diện sử dụng MSP evaluation
+        # Bước 4: Kiểm tra CP-ABE policy bằng MSP.prune (policy tree và kết quả được cache theo policy)
         try:
-            logger.info(f"Starting comprehensive CP-ABE policy evaluation:")
-            logger.info(f"  Resource policy: '{resource_cpabe_policy_string}'")
-            logger.info(f"  User attributes: {user_attributes_list_for_charm}")
-            
-            # 4.1. Parse policy string thành policy tree
-            policy_object = MSP_UTIL_FOR_POLICY_CHECK.createPolicy(resource_cpabe_policy_string)
-            logger.info(f"  Policy object created: {type(policy_object)}")
-            
-            # 4.2. Sử dụng MSP.prune() để kiểm tra toàn diện
-            # prune() trả về False nếu không satisfy, hoặc subset attributes nếu satisfy
-            satisfied_attributes = MSP_UTIL_FOR_POLICY_CHECK.prune(policy_object, user_attributes_list_for_charm)
-            
-            logger.info(f"  MSP.prune() result: {satisfied_attributes}")
-            logger.info(f"  MSP.prune() type: {type(satisfied_attributes)}")
+            satisfied, attributes = evaluate_policy(resource_cpabe_policy_string, user_cpabe_attributes)
             
-            if satisfied_attributes is not False and satisfied_attributes is not None:
-                # Policy được thỏa mãn
-                logger.info(f"✅ Policy '{resource_cpabe_policy_string}' SATISFIED by user attributes "
-                            f"{user_attributes_list_for_charm}")
-                logger.info(f"  Satisfying subset: {satisfied_attributes}")
+            if satisfied:
+                logger.debug(f"Policy '{resource_cpabe_policy_string}' SATISFIED by user attributes "
+                             f"{user_cpabe_attributes}, satisfying subset: {list(attributes)}")
                 return True
             else:
-                # Policy không được thỏa mãn - tìm hiểu nguyên nhân
-                all_policy_attributes = MSP_UTIL_FOR_POLICY_CHECK.getAttributeList(policy_object)
-                user_attrs_set = set(user_attributes_list_for_charm)
-                policy_attrs_set = set(all_policy_attributes)
+                # Policy không được thỏa mãn - attributes là toàn bộ thuộc tính của policy
+                policy_attrs_set = set(attributes)
+                missing_attrs = policy_attrs_set - user_cpabe_attributes
                 
                 logger.warning(f"❌ Policy '{resource_cpabe_policy_string}' NOT SATISFIED")
-                logger.info(f"  All policy attributes: {all_policy_attributes}")
-                logger.info(f"  User has: {user_attrs_set}")
+                logger.info(f"  User has: {user_cpabe_attributes}")
                 logger.info(f"  Policy requires: {policy_attrs_set}")
                 
-                missing_attrs = policy_attrs_set - user_attrs_set
                 if missing_attrs:
-                    self.message = f"Thiếu thuộc tính: {', '.join(missing_attrs)}. Policy cần: {resource_cpabe_policy_string}"
+                    self.message = f"Thiếu thuộc tính: {', '.join(sorted(missing_attrs))}. Policy cần: {resource_cpabe_policy_string}"
                 else:
                     self.message = f"Thuộc tính không thỏa mãn cấu trúc policy: {resource_cpabe_policy_string}"
                 
                 return False
         except Exception as e:
             logger.error(f"Lỗi khi đánh giá policy CP-ABE '{resource_cpabe_policy_string}' "
-                         f"cho resource (ID: {getattr(obj, 'id', 'N/A')}) với thuộc tính {user_attributes_list_for_charm}: {e}")
+                         f"cho resource (ID: {getattr(obj, 'id', 'N/A')}) với thuộc tính {user_cpabe_attributes}: {e}")
             # Trong trường hợp lỗi phân tích policy hoặc lỗi không mong muốn, an toàn nhất là từ chối
             self.message = "Lỗi hệ thống khi xác minh chính sách truy cập dữ liệu."
             return False
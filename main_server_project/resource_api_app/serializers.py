@@ -41,14 +41,30 @@ class UserInfoSerializer(serializers.Serializer):
     email = serializers.EmailField()
     user_attributes = serializers.CharField(allow_blank=True) 
     
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.files.base import ContentFile
 from rest_framework import serializers
 from .models import ProtectedEHRTextData
 
+def _decode_base64_field(value):
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise serializers.ValidationError("Giá trị Base64 không hợp lệ.")
+
 class ProtectedEHRTextDataCreateSerializer(serializers.ModelSerializer):
+    """
+    API upload JSON cũ (ciphertext dạng Base64), giữ để tương thích:
+    KEK và nội dung được decode rồi lưu như upload nhị phân.
+    """
     # Các trường client sẽ gửi lên, khớp với payloadToServer trong JavaScript
     patient_id = serializers.CharField(max_length=100, source='patient_id_on_rs')
-    # description, data_type, cpabe_policy_applied,
-    # encrypted_kek_b64, aes_iv_b64, encrypted_main_content_b64
+    encrypted_kek_b64 = serializers.CharField(write_only=True)
+    encrypted_main_content_b64 = serializers.CharField(write_only=True)
+    # description, data_type, cpabe_policy_applied, aes_iv_b64
     # sẽ được map tự động nếu tên giống nhau.
 
     class Meta:
@@ -63,6 +79,57 @@ class ProtectedEHRTextDataCreateSerializer(serializers.ModelSerializer):
             'encrypted_main_content_b64',
         ]
 
+    def validate_encrypted_kek_b64(self, value):
+        return _decode_base64_field(value)
+
+    def validate_encrypted_main_content_b64(self, value):
+        return _decode_base64_field(value)
+
+    def create(self, validated_data):
+        encrypted_main_content = validated_data.pop('encrypted_main_content_b64')
+        validated_data['encrypted_kek'] = validated_data.pop('encrypted_kek_b64')
+        ehr_entry = ProtectedEHRTextData(**validated_data)
+        ehr_entry.encrypted_main_content.save(f'{ehr_entry.id}.bin', ContentFile(encrypted_main_content), save=False)
+        ehr_entry.save()
+        return ehr_entry
+
+class ProtectedEHRTextDataBinaryUploadSerializer(serializers.ModelSerializer):
+    """
+    Upload multipart/form-data: metadata là field thường, KEK và nội dung đã mã hóa là
+    các part nhị phân (application/octet-stream). Upload handler của Django ghi part lớn
+    ra file tạm theo từng chunk; FileSystemStorage chuyển (move) file tạm vào storage.
+    """
+    patient_id = serializers.CharField(max_length=100, source='patient_id_on_rs')
+    encrypted_kek = serializers.FileField(write_only=True)
+    encrypted_main_content = serializers.FileField(write_only=True)
+
+    class Meta:
+        model = ProtectedEHRTextData
+        fields = [
+            'patient_id',
+            'description',
+            'data_type',
+            'cpabe_policy_applied',
+            'encrypted_kek',
+            'aes_iv_b64',
+            'encrypted_main_content',
+        ]
+
+    def validate_encrypted_kek(self, value):
+        # KEK là ciphertext CP-ABE của khóa AES, chỉ vài KB
+        max_size = getattr(settings, 'EHR_MAX_KEK_SIZE', 1024 * 1024)
+        if value.size > max_size:
+            raise serializers.ValidationError(f"KEK vượt quá {max_size} bytes.")
+        return value.read()
+
+    def validate_encrypted_main_content(self, value):
+        # View chỉ từ chối sớm theo Content-Length; request chunked hoặc không có header đó
+        # vẫn bị giới hạn theo kích thước thật của part sau khi upload handler ghi ra file tạm
+        max_size = getattr(settings, 'EHR_MAX_UPLOAD_SIZE', 100 * 1024 * 1024)
+        if value.size > max_size:
+            raise serializers.ValidationError(f"Nội dung đã mã hóa vượt quá {max_size} bytes.")
+        return value
+
 class ProtectedEHRTextDataResponseSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProtectedEHRTextData
@@ -1,3 +1,416 @@
-from django.test import TestCase
+import base64
+import importlib
+import importlib.util
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.client import RequestFactory
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from . import charm_engine
+from . import authentication
+from .authentication import AuthCenterUser, CustomJWTAuthentication
+from .models import ProtectedEHRTextData
+from .serializers import ProtectedEHRTextDataBinaryUploadSerializer
+from .views import decode_ehr_cursor, encode_ehr_cursor, get_ehr_page
+
+migration_0003 = importlib.import_module('resource_api_app.migrations.0003_binary_encrypted_content')
+# Charm cần thư viện PBC; các test chỉ dùng phần thuần Python vẫn chạy được khi thiếu
+HAS_CHARM = importlib.util.find_spec('charm') is not None
+
+
+class TemporaryMediaMixin:
+    """MEDIA_ROOT riêng cho mỗi test để file ciphertext không ghi vào thư mục media thật"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+
+def auth_client(user_attributes='doctor', user_id=7):
+    client = APIClient()
+    client.force_authenticate(
+        user=AuthCenterUser(user_id, f'user_{user_id}', '', user_attributes),
+        token={'user_id': user_id, 'user_attributes': user_attributes},
+    )
+    return client
+
+
+def upload_payload(content=b'\x00\x01ciphertext', kek=b'kek-bytes'):
+    return {
+        'patient_id': 'BN001',
+        'description': 'Ghi chú khám',
+        'data_type': 'CONSULTATION_NOTE',
+        'cpabe_policy_applied': 'doctor',
+        'aes_iv_b64': base64.b64encode(b'\x00' * 12).decode('ascii'),
+        'encrypted_kek': SimpleUploadedFile('kek.bin', kek, 'application/octet-stream'),
+        'encrypted_main_content': SimpleUploadedFile('content.bin', content, 'application/octet-stream'),
+    }
+
+
+class BinaryUploadSizeTest(TemporaryMediaMixin, TestCase):
+    """Giới hạn EHR_MAX_UPLOAD_SIZE áp dụng cả khi request không có Content-Length"""
+
+    @override_settings(EHR_MAX_UPLOAD_SIZE=4096)
+    def test_upload_within_limit_is_stored(self):
+        response = auth_client().post(
+            reverse('resource_api_app:api_upload_ehr_binary'), upload_payload(), format='multipart'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        entry = ProtectedEHRTextData.objects.get(id=response.data['entry_id'])
+        self.assertEqual(bytes(entry.encrypted_kek), b'kek-bytes')
+        with entry.encrypted_main_content.open('rb') as content:
+            self.assertEqual(content.read(), b'\x00\x01ciphertext')
+
+    @override_settings(EHR_MAX_UPLOAD_SIZE=4096)
+    def test_oversized_request_is_rejected_by_content_length(self):
+        response = auth_client().post(
+            reverse('resource_api_app:api_upload_ehr_binary'), upload_payload(content=b'x' * 8192), format='multipart'
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(ProtectedEHRTextData.objects.exists())
+
+    @override_settings(EHR_MAX_UPLOAD_SIZE=16)
+    def test_oversized_content_is_rejected_by_serializer(self):
+        # Upload chunked: view không có Content-Length để kiểm tra, chỉ serializer thấy kích thước part
+        serializer = ProtectedEHRTextDataBinaryUploadSerializer(data=upload_payload(content=b'x' * 17))
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('encrypted_main_content', serializer.errors)
+
+        serializer = ProtectedEHRTextDataBinaryUploadSerializer(data=upload_payload(content=b'x' * 16))
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+
+@mock.patch('resource_api_app.permissions.evaluate_policy', return_value=(True, ('doctor',)))
+@mock.patch('resource_api_app.permissions.get_msp', return_value=object())
+class RetrieveInlineContentTest(TemporaryMediaMixin, TestCase):
+    """Retrieve mặc định vẫn kèm nội dung base64 (client cũ); ?inline=0 chỉ trả metadata"""
+
+    def setUp(self):
+        super().setUp()
+        serializer = ProtectedEHRTextDataBinaryUploadSerializer(data=upload_payload())
+        serializer.is_valid(raise_exception=True)
+        self.entry = serializer.save(created_by_ac_user_id=7)
+        self.url = reverse('resource_api_app:api_retrieve_ehr', args=[self.entry.id])
+
+    def test_content_is_inlined_by_default(self, get_msp, evaluate_policy):
+        response = auth_client().get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(base64.b64decode(response.data['encrypted_main_content_b64']), b'\x00\x01ciphertext')
+        self.assertEqual(base64.b64decode(response.data['encrypted_kek_b64']), b'kek-bytes')
+
+    def test_inline_zero_returns_metadata_only(self, get_msp, evaluate_policy):
+        response = auth_client().get(self.url, {'inline': '0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('encrypted_main_content_b64', response.data)
+        self.assertEqual(response.data['encrypted_main_content_size'], len(b'\x00\x01ciphertext'))
+
+        content = auth_client().get(response.data['encrypted_main_content_url'])
+        self.assertEqual(b''.join(content.streaming_content), b'\x00\x01ciphertext')
+
+
+class BinaryContentMigrationTest(TemporaryMediaMixin, TransactionTestCase):
+    """Migration 0003 chuyển KEK/nội dung base64 sang BinaryField/FileField và ngược lại"""
+
+    migrate_from = [('resource_api_app', '0002_protectedehrtextdata_resource_ap_patient_107ed3_idx')]
+    migrate_to = [('resource_api_app', '0003_binary_encrypted_content')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(self.migrate_to)
+        super().tearDown()
+
+    def test_legacy_values_are_decoded(self):
+        self.assertEqual(migration_0003._decode_legacy_base64(base64.b64encode(b'\xffkek').decode()), b'\xffkek')
+        # Dữ liệu test cũ không phải base64 được giữ nguyên bytes
+        self.assertEqual(migration_0003._decode_legacy_base64('dummy_kek_1'), b'dummy_kek_1')
+
+    def test_forward_and_backward_conversion(self):
+        old_apps = self.migrate(self.migrate_from)
+        OldEntry = old_apps.get_model('resource_api_app', 'ProtectedEHRTextData')
+        entry = OldEntry.objects.create(
+            patient_id_on_rs='BN001',
+            created_by_ac_user_id=7,
+            cpabe_policy_applied='doctor',
+            aes_iv_b64=base64.b64encode(b'\x00' * 12).decode('ascii'),
+            encrypted_kek_b64=base64.b64encode(b'\x01kek').decode('ascii'),
+            encrypted_main_content_b64=base64.b64encode(b'\x02content').decode('ascii'),
+        )
+        legacy = OldEntry.objects.create(
+            patient_id_on_rs='BN002',
+            created_by_ac_user_id=7,
+            cpabe_policy_applied='doctor',
+            aes_iv_b64='iv',
+            encrypted_kek_b64='dummy_kek_2',
+            encrypted_main_content_b64='dummy content',
+        )
+
+        new_apps = self.migrate(self.migrate_to)
+        NewEntry = new_apps.get_model('resource_api_app', 'ProtectedEHRTextData')
+        converted = NewEntry.objects.get(id=entry.id)
+        self.assertEqual(bytes(converted.encrypted_kek), b'\x01kek')
+        self.assertEqual(converted.encrypted_main_content.name, f'ehr_ciphertext/{entry.id}.bin')
+        with converted.encrypted_main_content.open('rb') as content:
+            self.assertEqual(content.read(), b'\x02content')
+        converted_legacy = NewEntry.objects.get(id=legacy.id)
+        self.assertEqual(bytes(converted_legacy.encrypted_kek), b'dummy_kek_2')
+
+        old_apps = self.migrate(self.migrate_from)
+        reverted = old_apps.get_model('resource_api_app', 'ProtectedEHRTextData').objects.get(id=entry.id)
+        self.assertEqual(base64.b64decode(reverted.encrypted_kek_b64), b'\x01kek')
+        self.assertEqual(base64.b64decode(reverted.encrypted_main_content_b64), b'\x02content')
+
+
+class FakeMSP:
+    """MSP giả: policy là 'A and B' / 'A or B', đếm số lần parse và prune"""
+
+    def __init__(self):
+        self.parsed = []
+        self.pruned = []
+
+    def createPolicy(self, policy_string):
+        self.parsed.append(policy_string)
+        if 'invalid' in policy_string:
+            return None
+        operator = ' or ' if ' or ' in policy_string else ' and '
+        return operator.strip(), tuple(policy_string.split(operator))
+
+    def prune(self, tree, attributes):
+        self.pruned.append((tree, frozenset(attributes)))
+        operator, leaves = tree
+        satisfied = [leaf for leaf in leaves if leaf in attributes]
+        if operator == 'and':
+            return satisfied if len(satisfied) == len(leaves) else False
+        return satisfied[:1] or False
+
+    def getAttributeList(self, tree):
+        return list(tree[1])
+
+
+class PolicyCacheTest(SimpleTestCase):
+    """Policy tree (LRU) và kết quả đánh giá theo (policy, tập thuộc tính) được cache trong process"""
+
+    def setUp(self):
+        self.msp = FakeMSP()
+        patcher = mock.patch.object(charm_engine, 'get_msp', return_value=self.msp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clear_caches()
+        self.addCleanup(self.clear_caches)
+
+    @staticmethod
+    def clear_caches():
+        with charm_engine._policy_cache_lock:
+            charm_engine._policy_trees.clear()
+            charm_engine._policy_decisions.clear()
+
+    def test_decision_is_memoized_per_attribute_set(self):
+        self.assertEqual(charm_engine.evaluate_policy('DOCTOR and CARDIO', ['CARDIO', 'DOCTOR']),
+                         (True, ('DOCTOR', 'CARDIO')))
+        # Cùng tập thuộc tính (khác thứ tự) dùng lại kết quả, không prune lại
+        self.assertEqual(charm_engine.evaluate_policy('DOCTOR and CARDIO', ['DOCTOR', 'CARDIO'])[0], True)
+        self.assertEqual(len(self.msp.pruned), 1)
+
+        # Tập thuộc tính khác: prune lại nhưng dùng policy tree đã parse
+        self.assertEqual(charm_engine.evaluate_policy('DOCTOR and CARDIO', ['NURSE']),
+                         (False, ('DOCTOR', 'CARDIO')))
+        self.assertEqual(len(self.msp.pruned), 2)
+        self.assertEqual(self.msp.parsed, ['DOCTOR and CARDIO'])
+
+    @override_settings(CPABE_POLICY_CACHE_SIZE=2, CPABE_POLICY_DECISION_CACHE_SIZE=2)
+    def test_caches_are_bounded_lru(self):
+        for policy in ('A and B', 'C and D', 'A and B', 'E and F'):
+            charm_engine.get_policy_tree(policy)
+        # 'C and D' ít được dùng gần đây nhất nên bị bỏ
+        self.assertEqual(self.msp.parsed, ['A and B', 'C and D', 'E and F'])
+        charm_engine.get_policy_tree('C and D')
+        self.assertEqual(self.msp.parsed[-1], 'C and D')
+
+        for attributes in (['A'], ['B'], ['C']):
+            charm_engine.evaluate_policy('A or B', attributes)
+        self.assertEqual(charm_engine.get_policy_cache_stats()['policy_decisions'], 2)
+
+    def test_evaluate_policies_deduplicates_and_denies_invalid(self):
+        decisions = charm_engine.evaluate_policies(
+            ['A or B', 'A and B', 'A or B', 'invalid policy'], frozenset({'A'})
+        )
+        self.assertEqual(decisions, {'A or B': True, 'A and B': False, 'invalid policy': False})
+        self.assertEqual(len(self.msp.pruned), 2)
+
+
+@skipUnless(HAS_CHARM, "charm-crypto is not installed")
+class PolicyCacheCharmTest(SimpleTestCase):
+    """Cache cho cùng kết quả với MSP thật của Charm"""
+
+    def test_real_msp_decisions(self):
+        policy = '(DOCTOR and CARDIO) or ADMIN'
+        self.assertTrue(charm_engine.evaluate_policy(policy, {'DOCTOR', 'CARDIO'})[0])
+        self.assertTrue(charm_engine.evaluate_policy(policy, {'ADMIN'})[0])
+        satisfied, attributes = charm_engine.evaluate_policy(policy, {'DOCTOR'})
+        self.assertFalse(satisfied)
+        self.assertEqual(set(attributes), {'DOCTOR', 'CARDIO', 'ADMIN'})
+
+
+def fake_evaluate_policies(policy_strings, user_attributes):
+    """Policy trong test là tên một thuộc tính"""
+    return {policy: policy in user_attributes for policy in policy_strings}
+
+
+@mock.patch('resource_api_app.views.evaluate_policies', side_effect=fake_evaluate_policies)
+class EHRKeysetPaginationTest(TestCase):
+    """get_ehr_page phân trang theo (created_at, id): không trùng/thiếu bản ghi kể cả khi created_at trùng nhau"""
+
+    def setUp(self):
+        base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        # 9 bản ghi, từng cặp có cùng created_at; policy xen kẽ DOCTOR/NURSE
+        for index in range(9):
+            entry = ProtectedEHRTextData.objects.create(
+                patient_id_on_rs='BN001',
+                created_by_ac_user_id=7,
+                cpabe_policy_applied='DOCTOR' if index % 3 else 'NURSE',
+                encrypted_kek=b'kek',
+                aes_iv_b64='iv',
+                encrypted_main_content=f'ehr_ciphertext/{index}.bin',
+            )
+            ProtectedEHRTextData.objects.filter(id=entry.id).update(created_at=base + timedelta(minutes=index // 2))
+        ProtectedEHRTextData.objects.create(
+            patient_id_on_rs='BN002', created_by_ac_user_id=7, cpabe_policy_applied='DOCTOR',
+            encrypted_kek=b'kek', aes_iv_b64='iv', encrypted_main_content='ehr_ciphertext/other.bin',
+        )
+        self.expected = list(
+            ProtectedEHRTextData.objects.filter(patient_id_on_rs='BN001')
+            .order_by('-created_at', '-id').values_list('id', 'cpabe_policy_applied')
+        )
+
+    def collect(self, attributes, page_size, accessible_only):
+        records, cursor, pages = [], None, 0
+        while True:
+            page, cursor = get_ehr_page('BN001', attributes, cursor=cursor, page_size=page_size,
+                                        accessible_only=accessible_only)
+            self.assertLessEqual(len(page), page_size)
+            records.extend(page)
+            pages += 1
+            if cursor is None:
+                return records, pages
+
+    def test_all_records_in_order_without_duplicates(self, evaluate_policies):
+        records, pages = self.collect(frozenset({'DOCTOR'}), page_size=2, accessible_only=False)
+        self.assertEqual([(row['id'], row['cpabe_policy_applied']) for row in records], self.expected)
+        self.assertEqual(pages, 5)
+        self.assertEqual([row['accessible'] for row in records],
+                         [policy == 'DOCTOR' for _, policy in self.expected])
+
+    def test_accessible_only_fills_pages_from_later_batches(self, evaluate_policies):
+        records, pages = self.collect(frozenset({'DOCTOR'}), page_size=2, accessible_only=True)
+        self.assertEqual([row['id'] for row in records],
+                         [entry_id for entry_id, policy in self.expected if policy == 'DOCTOR'])
+        self.assertEqual(pages, 3)
+
+    def test_no_attributes_sees_nothing(self, evaluate_policies):
+        self.assertEqual(get_ehr_page('BN001', frozenset(), page_size=4), ([], None))
+
+    def test_cursor_round_trip_and_invalid_cursor(self, evaluate_policies):
+        created_at = datetime(2026, 1, 1, 8, 30, tzinfo=timezone.utc)
+        entry_id = self.expected[0][0]
+        self.assertEqual(decode_ehr_cursor(encode_ehr_cursor(created_at, entry_id)), (created_at, entry_id))
+        for cursor in ('not-a-cursor', encode_ehr_cursor(created_at, 'nope')):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                get_ehr_page('BN001', frozenset({'DOCTOR'}), cursor=cursor)
+
+    def test_view_paginates_and_rejects_bad_cursor(self, evaluate_policies):
+        url = reverse('resource_api_app:api_list_ehr_by_patient', args=['BN001'])
+        client = auth_client('DOCTOR')
+        first = client.get(url, {'limit': 4, 'show': 'all'})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data['total_records'], 4)
+        second = client.get(url, {'limit': 4, 'show': 'all', 'cursor': first.data['next_cursor']})
+        self.assertEqual([row['id'] for row in first.data['records'] + second.data['records']],
+                         [entry_id for entry_id, _ in self.expected[:8]])
+        self.assertEqual(client.get(url, {'cursor': 'not-a-cursor'}).status_code, 400)
+
+
+class JWTCacheTest(SimpleTestCase):
+    """Token đã verify được cache tối đa JWT_CACHE_TTL giây, không quá exp, và bị bỏ theo LRU"""
+
+    def setUp(self):
+        self.now = 1_000_000.0
+        clock = mock.patch.object(authentication.time, 'time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        validate = mock.patch.object(CustomJWTAuthentication, 'get_validated_token', side_effect=self.validate)
+        self.validate_mock = validate.start()
+        self.addCleanup(validate.stop)
+        self.exp = {}
+        self.clear_cache()
+        self.addCleanup(self.clear_cache)
+
+    @staticmethod
+    def clear_cache():
+        with authentication._token_cache_lock:
+            authentication._token_cache.clear()
+
+    def validate(self, raw_token):
+        return {'user_id': 7, 'user_attributes': 'DOCTOR, CARDIO', 'exp': self.exp.get(raw_token)}
+
+    def authenticate(self, token):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return CustomJWTAuthentication().authenticate(request)
+
+    @override_settings(JWT_CACHE_TTL=300)
+    def test_cached_until_ttl(self):
+        user, _ = self.authenticate('token-a')
+        self.assertEqual(user.cpabe_attributes, frozenset({'DOCTOR', 'CARDIO'}))
+        self.now += 299
+        self.assertIs(self.authenticate('token-a')[0], user)
+        self.assertEqual(self.validate_mock.call_count, 1)
+
+        self.now += 1
+        self.assertIsNot(self.authenticate('token-a')[0], user)
+        self.assertEqual(self.validate_mock.call_count, 2)
+
+    @override_settings(JWT_CACHE_TTL=300)
+    def test_cache_never_outlives_token_exp(self):
+        self.exp[b'token-a'] = self.now + 60
+        self.authenticate('token-a')
+        self.now += 59
+        self.authenticate('token-a')
+        self.assertEqual(self.validate_mock.call_count, 1)
+
+        # Sau exp phải verify lại (simplejwt sẽ từ chối token hết hạn)
+        self.now += 1
+        self.validate_mock.side_effect = authentication.InvalidToken('Token is expired')
+        with self.assertRaises(authentication.InvalidToken):
+            self.authenticate('token-a')
+        self.assertEqual(len(authentication._token_cache), 0)
+
+    @override_settings(JWT_CACHE_SIZE=2)
+    def test_least_recently_used_token_is_evicted(self):
+        for token in ('token-a', 'token-b', 'token-a', 'token-c'):
+            self.authenticate(token)
+        self.assertEqual(self.validate_mock.call_count, 3)
+        # token-b ít được dùng gần đây nhất nên bị bỏ; token-a vẫn nằm trong cache
+        self.authenticate('token-a')
+        self.assertEqual(self.validate_mock.call_count, 3)
+        self.authenticate('token-b')
+        self.assertEqual(self.validate_mock.call_count, 4)
+
+    def test_missing_header_is_not_authenticated(self):
+        self.assertIsNone(CustomJWTAuthentication().authenticate(RequestFactory().get('/')))
+        self.validate_mock.assert_not_called()
@@ -14,7 +14,9 @@ urlpatterns = [
     
     path('api/auth/test/', views.TestAuthView.as_view(), name='api_test_auth'),
     path('api/ehr/upload/', views.UploadEHRTextView.as_view(), name='api_upload_ehr'),
+    path('api/ehr/upload/binary/', views.UploadEHRBinaryView.as_view(), name='api_upload_ehr_binary'),
     path('api/ehr/patient/<str:patient_id>/', views.ListEHRByPatientView.as_view(), name='api_list_ehr_by_patient'),
     path('api/ehr/<uuid:entry_id_uuid>/', views.RetrieveEHRTextView.as_view(), name='api_retrieve_ehr'),
+    path('api/ehr/<uuid:entry_id_uuid>/content/', views.RetrieveEHRContentView.as_view(), name='api_retrieve_ehr_content'),
     path('api/debug/cpabe/<uuid:entry_id_uuid>/', views.DebugCPABEView.as_view(), name='api_debug_cpabe'),
 ]
\ No newline at end of file
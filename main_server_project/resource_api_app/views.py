@@ -8,11 +8,21 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.parsers import MultiPartParser
 from .models import ProtectedEHRTextData
-from .serializers import ProtectedEHRTextDataCreateSerializer, ProtectedEHRTextDataResponseSerializer
-from .permissions import SatisfiesCPABEPolicyPermission, CHARM_GROUP_FOR_POLICY_CHECK, MSP_UTIL_FOR_POLICY_CHECK
-from django.http import Http404
+from .serializers import (
+    ProtectedEHRTextDataCreateSerializer, ProtectedEHRTextDataBinaryUploadSerializer,
+    ProtectedEHRTextDataResponseSerializer,
+)
+from .permissions import SatisfiesCPABEPolicyPermission, get_token_cpabe_attributes
+from .charm_engine import evaluate_policies, get_pairing_group, get_msp, get_policy_cache_stats
+from abe_common.metrics import timed
+from django.db.models import Q
+from django.http import FileResponse, Http404
+from datetime import datetime
+import base64
 import logging
+import uuid
 
 # Logger cho Resource API App
 logger = logging.getLogger(__name__)
@@ -224,8 +234,9 @@ class DebugCPABEView(APIView):
             return Response({
                 'debug_info': debug_info,
                 'charm_crypto_status': {
-                    'group_initialized': CHARM_GROUP_FOR_POLICY_CHECK is not None,
-                    'msp_initialized': MSP_UTIL_FOR_POLICY_CHECK is not None
+                    'group_initialized': get_pairing_group() is not None,
+                    'msp_initialized': get_msp() is not None,
+                    'policy_cache': get_policy_cache_stats()
                 }
             }, status=status.HTTP_200_OK)
             
@@ -239,6 +250,7 @@ class DebugCPABEView(APIView):
 class UploadEHRTextView(APIView):
     permission_classes = [IsAuthenticated] 
 
+    @timed('upload_ehr')
     def post(self, request):
         user_id_from_token = request.user.id # Lấy từ JWT đã được xác thực
 
@@ -266,6 +278,48 @@ class UploadEHRTextView(APIView):
             logger.warning(f"Dữ liệu upload từ user {user_id_from_token} không hợp lệ: {serializer.errors}")
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class UploadEHRBinaryView(APIView):
+    """
+    Upload streaming multipart/form-data (xem ProtectedEHRTextDataBinaryUploadSerializer):
+    nội dung đã mã hóa không đi qua Base64/JSON nên memory của worker không tăng theo kích thước file.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    @timed('upload_ehr_binary')
+    def post(self, request):
+        user_id_from_token = request.user.id
+
+        # Từ chối sớm theo Content-Length, trước khi đọc body
+        max_size = getattr(settings, 'EHR_MAX_UPLOAD_SIZE', 100 * 1024 * 1024)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > max_size:
+            return Response({"error": f"Dữ liệu upload vượt quá {max_size} bytes."},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        serializer = ProtectedEHRTextDataBinaryUploadSerializer(data=request.data)
+
+        if serializer.is_valid():
+            try:
+                ehr_entry = serializer.save(created_by_ac_user_id=user_id_from_token)
+                response_serializer = ProtectedEHRTextDataResponseSerializer(ehr_entry)
+                logger.info(f"User {user_id_from_token} đã upload thành công EHR entry ID: {ehr_entry.id} "
+                            f"({ehr_entry.encrypted_main_content.size} bytes)")
+                return Response({
+                    "message": "Dữ liệu đã được lưu trữ thành công.",
+                    "entry_id": ehr_entry.id,
+                    "data": response_serializer.data
+                }, status=status.HTTP_201_CREATED)
+            except Exception as e:
+                logger.error(f"Lỗi khi lưu ProtectedEHRTextData (binary) cho user {user_id_from_token}: {e}")
+                return Response({"error": "Lỗi phía server khi lưu trữ dữ liệu."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        else:
+            logger.warning(f"Dữ liệu upload binary từ user {user_id_from_token} không hợp lệ: {serializer.errors}")
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 class RetrieveEHRTextView(APIView):
 
     permission_classes = [IsAuthenticated, SatisfiesCPABEPolicyPermission]
@@ -276,7 +330,14 @@ class RetrieveEHRTextView(APIView):
             return ProtectedEHRTextData.objects.get(id=entry_id_uuid)
         except ProtectedEHRTextData.DoesNotExist:
             raise Http404
+    @timed('retrieve_ehr')
     def get(self, request, entry_id_uuid):
+        """
+        Metadata + KEK của bản ghi. Nội dung đã mã hóa tải (streaming) qua encrypted_main_content_url.
+        Mặc định (không có ?inline, hoặc inline khác '0') response VẪN kèm encrypted_main_content_b64
+        (cả file đọc vào memory và base64) để client cũ không bị hỏng; client mới phải gửi ?inline=0
+        (decrypt_record.html đã làm) để chỉ nhận metadata.
+        """
         ehr_entry = self.get_object(entry_id_uuid)
         self.check_object_permissions(request, ehr_entry)
         data_to_return = {
@@ -285,11 +346,15 @@ class RetrieveEHRTextView(APIView):
             'description': ehr_entry.description,
             'data_type': ehr_entry.data_type,
             'cpabe_policy_applied': ehr_entry.cpabe_policy_applied,
-            'encrypted_kek_b64': ehr_entry.encrypted_kek_b64,
+            'encrypted_kek_b64': base64.b64encode(bytes(ehr_entry.encrypted_kek)).decode('ascii'),
             'aes_iv_b64': ehr_entry.aes_iv_b64,
-            'encrypted_main_content_b64': ehr_entry.encrypted_main_content_b64,
+            'encrypted_main_content_url': reverse('resource_api_app:api_retrieve_ehr_content', args=[ehr_entry.id]),
+            'encrypted_main_content_size': ehr_entry.encrypted_main_content.size,
             'created_at': ehr_entry.created_at.isoformat()  # Định dạng ISO cho datetime
         }
+        if request.query_params.get('inline') != '0':
+            with ehr_entry.encrypted_main_content.open('rb') as content:
+                data_to_return['encrypted_main_content_b64'] = base64.b64encode(content.read()).decode('ascii')
         
         logger.info(f"User {request.user.id} được phép truy cập ciphertext của EHR entry ID: {ehr_entry.id} "
                    f"(Policy CP-ABE '{ehr_entry.cpabe_policy_applied}' đã được kiểm tra phía server)")
@@ -297,48 +362,121 @@ class RetrieveEHRTextView(APIView):
         return Response(data_to_return)
 
 
+class RetrieveEHRContentView(RetrieveEHRTextView):
+    """Nội dung đã mã hóa (bytes AES-GCM) của bản ghi, stream từ storage sau khi kiểm tra policy"""
+
+    @timed('retrieve_ehr_content')
+    def get(self, request, entry_id_uuid):
+        ehr_entry = self.get_object(entry_id_uuid)
+        self.check_object_permissions(request, ehr_entry)
+        response = FileResponse(ehr_entry.encrypted_main_content.open('rb'), content_type='application/octet-stream')
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+
+# Các cột metadata cho danh sách bản ghi (không đọc KEK/IV/nội dung đã mã hóa)
+EHR_LIST_FIELDS = (
+    'id', 'description', 'data_type', 'cpabe_policy_applied',
+    'created_at', 'updated_at', 'created_by_ac_user_id',
+)
+EHR_LIST_PAGE_SIZE = 50
+EHR_LIST_MAX_PAGE_SIZE = 200
+
+
+def encode_ehr_cursor(created_at, entry_id):
+    """Cursor keyset (created_at, id) dạng chuỗi an toàn cho URL"""
+    raw = f"{created_at.isoformat()}|{entry_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_ehr_cursor(cursor):
+    """Giải mã cursor, raise ValueError nếu không hợp lệ"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, entry_id = raw.split('|')
+        return datetime.fromisoformat(created_at), uuid.UUID(entry_id)
+    except (UnicodeError, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def get_ehr_page(patient_id, user_attributes, cursor=None, page_size=EHR_LIST_PAGE_SIZE, accessible_only=True):
+    """
+    Một trang bản ghi của bệnh nhân (mới nhất trước) theo keyset (created_at, id), chỉ đọc EHR_LIST_FIELDS.
+    Policy của mỗi batch được đánh giá một lần cho mỗi policy khác nhau (qua cache policy);
+    khi accessible_only, bản ghi không truy cập được bị bỏ và trang được lấp bằng các batch tiếp theo.
+    Trả về (records, next_cursor) - next_cursor là None khi hết dữ liệu.
+    """
+    queryset = ProtectedEHRTextData.objects.filter(
+        patient_id_on_rs=patient_id
+    ).order_by('-created_at', '-id').values(*EHR_LIST_FIELDS)
+
+    position = decode_ehr_cursor(cursor) if cursor else None
+    records = []
+    while len(records) <= page_size:
+        batch_queryset = queryset
+        if position is not None:
+            created_at, entry_id = position
+            batch_queryset = batch_queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=entry_id)
+            )
+        batch = list(batch_queryset[:page_size + 1])
+
+        decisions = evaluate_policies({row['cpabe_policy_applied'] for row in batch}, user_attributes)
+        for row in batch:
+            position = (row['created_at'], row['id'])
+            row['accessible'] = bool(user_attributes) and decisions[row['cpabe_policy_applied']]
+            if row['accessible'] or not accessible_only:
+                records.append(row)
+                if len(records) > page_size:
+                    break
+
+        if len(batch) <= page_size:
+            break
+
+    has_more = len(records) > page_size
+    records = records[:page_size]
+    next_cursor = encode_ehr_cursor(records[-1]['created_at'], records[-1]['id']) if has_more else None
+    return records, next_cursor
+
+
 class ListEHRByPatientView(APIView):
     permission_classes = [IsAuthenticated]
     
+    @timed('list_ehr_by_patient')
     def get(self, request, patient_id):
         """
-        API để lấy danh sách tất cả bản ghi EHR của một patient
+        API danh sách bản ghi EHR của một patient (không kèm dữ liệu mã hóa), phân trang keyset.
+        Query params: cursor, limit (tối đa EHR_LIST_MAX_PAGE_SIZE), show=all để trả cả bản ghi
+        không thỏa mãn policy (kèm cờ accessible); mặc định chỉ bản ghi user truy cập được.
         """
         try:
-            # Lấy tất cả bản ghi của patient này
-            ehr_entries = ProtectedEHRTextData.objects.filter(
-                patient_id_on_rs=patient_id
-            ).order_by('-created_at')
-            
-            if not ehr_entries.exists():
-                return Response({
-                    "message": f"Không tìm thấy bản ghi nào cho bệnh nhân {patient_id}",
-                    "patient_id": patient_id,
-                    "records": []
-                }, status=status.HTTP_200_OK)
-            
-            # Tạo danh sách bản ghi (không bao gồm nội dung mã hóa để giảm payload)
-            records_list = []
-            for entry in ehr_entries:
-                records_list.append({
-                    'id': entry.id,
-                    'description': entry.description,
-                    'data_type': entry.data_type,
-                    'cpabe_policy_applied': entry.cpabe_policy_applied,
-                    'created_at': entry.created_at,
-                    'updated_at': entry.updated_at,
-                    'created_by_ac_user_id': entry.created_by_ac_user_id
-                })
-            
-            logger.info(f"User {request.user.id} accessed {len(records_list)} records for patient {patient_id}")
-            
-            return Response({
-                "message": f"Tìm thấy {len(records_list)} bản ghi cho bệnh nhân {patient_id}",
-                "patient_id": patient_id,
-                "total_records": len(records_list),
-                "records": records_list
-            }, status=status.HTTP_200_OK)
-            
+            limit = min(max(int(request.query_params.get('limit', EHR_LIST_PAGE_SIZE)), 1), EHR_LIST_MAX_PAGE_SIZE)
+            records_list, next_cursor = get_ehr_page(
+                patient_id,
+                get_token_cpabe_attributes(request),
+                cursor=request.query_params.get('cursor'),
+                page_size=limit,
+                accessible_only=request.query_params.get('show') != 'all'
+            )
+        except ValueError as e:
+            return Response({"error": f"Tham số phân trang không hợp lệ: {e}"}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Lỗi khi lấy danh sách EHR cho patient {patient_id}: {e}")
-            return Response({"error": "Lỗi phía server."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"error": "Lỗi phía server."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        logger.info(f"User {request.user.id} accessed {len(records_list)} records for patient {patient_id}")
+        
+        if records_list:
+            message = f"Tìm thấy {len(records_list)} bản ghi cho bệnh nhân {patient_id}"
+        elif request.query_params.get('cursor'):
+            message = f"Không còn bản ghi nào cho bệnh nhân {patient_id}"
+        else:
+            message = f"Không tìm thấy bản ghi nào cho bệnh nhân {patient_id}"
+        
+        return Response({
+            "message": message,
+            "patient_id": patient_id,
+            "total_records": len(records_list),
+            "records": records_list,
+            "next_cursor": next_cursor
+        }, status=status.HTTP_200_OK)
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'abe_common.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +73,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'backend.context_processors.user_attributes_context',
+                'backend.context_processors.abe_public_key_context',
             ],
         },
     },
@@ -96,6 +98,37 @@ DATABASES = {
     }
 }
 
+# Cache - dùng Redis khi có REDIS_URL để các worker dùng chung mapping/version, ngược lại LocMem cho development
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL'),
+    }
+} if os.environ.get('REDIS_URL') else {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Kích thước universe của Waters11 (uni_size): cpabe_id hợp lệ là 1..N.
+# Dùng chung cho setup_abe_system và scheme khi load PK - thay đổi thì phải chạy lại setup_abe_system
+ABE_UNIVERSE_SIZE = int(os.environ.get('ABE_UNIVERSE_SIZE', 11))
+# Thời gian cache secret key CP-ABE đã generate cho mỗi user (giây)
+ABE_SECRET_KEY_CACHE_TTL = int(os.environ.get('ABE_SECRET_KEY_CACHE_TTL', 3600))
+# Build fixed-base precomputation tables cho PK khi load (tăng tốc Waters11.keygen)
+ABE_FIXED_BASE_PRECOMPUTATION = os.environ.get('ABE_FIXED_BASE_PRECOMPUTATION', 'True') == 'True'
+# Thời gian cache attribute snapshot của user giữa các request (giây, 0 = chỉ cache trong request).
+# Chỉ bật khi có REDIS_URL: với LocMem, worker khác không thấy invalidate nên attribute bị thu hồi vẫn còn hiệu lực
+ABE_USER_ATTRIBUTE_CACHE_TTL = int(os.environ.get('ABE_USER_ATTRIBUTE_CACHE_TTL', 0)) if os.environ.get('REDIS_URL') else 0
+# Số record mỗi chunk bulk_create của API batch upload
+MEDICAL_DATA_BATCH_CHUNK_SIZE = int(os.environ.get('MEDICAL_DATA_BATCH_CHUNK_SIZE', 500))
+# Executor cho keygen của async view: 'thread' hoặc 'process' (song song trên nhiều core)
+ABE_CRYPTO_EXECUTOR = os.environ.get('ABE_CRYPTO_EXECUTOR', 'thread')
+# Số worker của crypto executor (mặc định: số CPU)
+ABE_CRYPTO_EXECUTOR_WORKERS = int(os.environ.get('ABE_CRYPTO_EXECUTOR_WORKERS', 0)) or None
+# Nếu đặt, /metrics yêu cầu header 'Authorization: Bearer <token>'; không đặt thì /metrics chỉ mở khi DEBUG
+METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
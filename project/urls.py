@@ -19,9 +19,11 @@ from django.contrib import admin
 from django.urls import path
 from django.urls import include
 from . import views
+from abe_common.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('accounts/', include('allauth.urls')),
     path('', include('backend.urls')),
     path('', views.home, name='home'),
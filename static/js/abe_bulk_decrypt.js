@@ -0,0 +1,157 @@
+// Bulk CP-ABE decryption of many medical records with one Pyodide call
+
+/*
+ * The secret and public key are deserialized once per page (cached in Python globals, reloaded
+ * only when the stored key changes); every AES key blob of the batch is then decrypted in a single
+ * runPythonAsync call. The field blobs are decrypted afterwards with WebCrypto, off the Python side.
+ * Record format: /api/medical-records/encrypted/ (same fields as /api/medical-record/<id>/).
+ */
+
+const BULK_DECRYPT_GROUPS = {
+    patient_info: ['patient_name', 'patient_age', 'patient_gender', 'patient_phone'],
+    medical_record: ['chief_complaint', 'past_medical_history', 'diagnosis', 'status'],
+};
+
+const BULK_DECRYPT_PYTHON = `
+import base64
+import hashlib
+import json
+from charm.toolbox.pairinggroup import PairingGroup
+from charm.schemes.abenc.waters11 import Waters11
+
+_bulk_group = PairingGroup('SS512')
+_bulk_scheme = Waters11(_bulk_group, uni_size=11)
+# ((sk_json, pk_json), sk, pk) của lần gọi trước
+_bulk_keys = None
+_BULK_NON_CRYPTO_FIELDS = ('policy', 'attribute_list', '_key_verification')
+
+def _bulk_load(value):
+    if isinstance(value, dict):
+        return {key: _bulk_load(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_bulk_load(item) for item in value]
+    if not isinstance(value, str):
+        return value
+    try:
+        return _bulk_group.deserialize(base64.b64decode(value + '=' * (-len(value) % 4)))
+    except Exception:
+        return value
+
+def _bulk_get_keys(sk_json, pk_json):
+    global _bulk_keys
+    if _bulk_keys is None or _bulk_keys[0] != (sk_json, pk_json):
+        sk_data = json.loads(sk_json)
+        sk = _bulk_load(sk_data['secret_key'])
+        sk['attr_list'] = [str(attr) for attr in sk_data['attribute_integers']]
+        _bulk_keys = ((sk_json, pk_json), sk, _bulk_load(json.loads(pk_json)))
+    return _bulk_keys[1], _bulk_keys[2]
+
+def _bulk_decrypt_aes_key(sk, pk, key_blob):
+    ct_data = json.loads(base64.b64decode(key_blob))
+    ct = {key: _bulk_load(value) for key, value in ct_data.items() if key not in _BULK_NON_CRYPTO_FIELDS}
+    ct['policy'] = _bulk_scheme.util.createPolicy(str(ct_data['policy']).strip())
+    gt = _bulk_scheme.decrypt(pk, ct, sk)
+    if gt is False:
+        return None
+    return base64.b64encode(hashlib.sha256(_bulk_group.serialize(gt)).digest()).decode('ascii')
+
+def bulk_decrypt_aes_keys(sk_json, pk_json, key_blobs_json):
+    sk, pk = _bulk_get_keys(sk_json, pk_json)
+    results = {}
+    for name, key_blob in json.loads(key_blobs_json).items():
+        try:
+            results[name] = _bulk_decrypt_aes_key(sk, pk, key_blob)
+        except Exception as e:
+            print(f'Bulk decrypt failed for {name}: {e}')
+            results[name] = None
+    return json.dumps(results)
+`;
+
+const bulkDecryptInstalled = new WeakSet();
+
+async function installBulkDecrypt(pyodide) {
+    if (!bulkDecryptInstalled.has(pyodide)) {
+        await pyodide.runPythonAsync(BULK_DECRYPT_PYTHON);
+        bulkDecryptInstalled.add(pyodide);
+    }
+}
+
+function bulkBase64ToBytes(base64) {
+    const binary = atob(base64);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return bytes;
+}
+
+/**
+ * Decrypt many CP-ABE AES key blobs at once: {name: base64 key blob} -> {name: base64 AES key | null}.
+ * null means the policy is not satisfied or the blob is unreadable.
+ */
+async function bulkDecryptAesKeys(pyodide, keyBlobs) {
+    const secretKeyStr = sessionStorage.getItem('abe_secret_key');
+    const publicKeyStr = sessionStorage.getItem('abe_public_key');
+    if (!secretKeyStr || !publicKeyStr) {
+        throw new Error('Không tìm thấy khóa. Vui lòng đăng nhập lại.');
+    }
+
+    await installBulkDecrypt(pyodide);
+    const decrypt = pyodide.globals.get('bulk_decrypt_aes_keys');
+    try {
+        return JSON.parse(decrypt(secretKeyStr, publicKeyStr, JSON.stringify(keyBlobs)));
+    } finally {
+        decrypt.destroy();
+    }
+}
+
+async function bulkDecryptField(cryptoKey, iv, blob) {
+    const plaintext = await crypto.subtle.decrypt({ name: 'AES-GCM', iv }, cryptoKey, bulkBase64ToBytes(blob));
+    return new TextDecoder('utf-8').decode(plaintext);
+}
+
+/**
+ * Decrypt the requested field groups of many records.
+ * Returns {record id: {field: plaintext}}; fields of groups that cannot be decrypted are left out.
+ */
+async function bulkDecryptRecords(pyodide, records, groups = Object.keys(BULK_DECRYPT_GROUPS)) {
+    const keyBlobs = {};
+    for (const record of records) {
+        for (const group of groups) {
+            const keyBlob = record[`${group}_aes_key_blob`];
+            if (keyBlob && record[`can_decrypt_${group}`] !== false) {
+                keyBlobs[`${record.id}:${group}`] = keyBlob;
+            }
+        }
+    }
+
+    const aesKeys = Object.keys(keyBlobs).length ? await bulkDecryptAesKeys(pyodide, keyBlobs) : {};
+
+    const results = {};
+    await Promise.all(records.map(async record => {
+        const fields = {};
+        for (const group of groups) {
+            const aesKey = aesKeys[`${record.id}:${group}`];
+            if (!aesKey) {
+                continue;
+            }
+            const cryptoKey = await crypto.subtle.importKey(
+                'raw', bulkBase64ToBytes(aesKey), { name: 'AES-GCM' }, false, ['decrypt']
+            );
+            const iv = bulkBase64ToBytes(record[`${group}_aes_iv_blob`]);
+            for (const field of BULK_DECRYPT_GROUPS[group]) {
+                const blob = record[`${field}_blob`];
+                if (!blob) {
+                    continue;
+                }
+                try {
+                    fields[field] = await bulkDecryptField(cryptoKey, iv, blob);
+                } catch (error) {
+                    console.error(`Không thể giải mã ${field} của record ${record.id}:`, error);
+                }
+            }
+        }
+        results[record.id] = fields;
+    }));
+    return results;
+}
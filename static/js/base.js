@@ -115,12 +115,20 @@ async function getSecretKey() {
     }
 }
 
+/**
+ * URL of the public parameters document. The page provides a content-hashed URL
+ * that the browser can cache forever; fall back to the revalidated endpoint.
+ */
+function getPublicKeyUrl() {
+    return document.body.dataset.publicKeyUrl || '/api/abe/public-key/';
+}
+
 /**
  * Get ABE public key from server
  */
 async function getPublicKey() {
     try {
-        const response = await fetch('/api/abe/public-key/', {
+        const response = await fetch(getPublicKeyUrl(), {
             method: 'GET',
             headers: {
                 'X-CSRFToken': getCSRFToken(),
@@ -153,29 +161,51 @@ async function getPublicKey() {
 }
 
 /**
- * Get session secret key from server
+ * Poll the session key endpoint until the keygen job finishes.
+ * The server answers 202 with a status_url while the key is being generated.
  */
-async function getSessionSecretKey() {
-    try {
-        const response = await fetch('/api/abe/session-key/', {
+async function fetchSessionKeyWithPolling(onPending = null, pollIntervalMs = 1000, maxAttempts = 60) {
+    let url = '/api/abe/session-key/';
+    
+    for (let attempt = 0; attempt < maxAttempts; attempt++) {
+        const response = await fetch(url, {
             method: 'GET',
             headers: {
                 'X-CSRFToken': getCSRFToken(),
                 'Content-Type': 'application/json'
             }
         });
+        const result = await response.json();
         
-        if (response.ok) {
-            const result = await response.json();
-            if (result.success) {
-                // Store in session storage
-                sessionStorage.setItem('abe_secret_key', JSON.stringify(result.data));
-                window.abeSystem.secretKey = result.data;
-                console.log('Session secret key retrieved:', result.source);
-                return result.data;
-            }
+        if (response.status !== 202) {
+            return result;
+        }
+        
+        if (onPending) {
+            onPending(result.data);
+        }
+        url = result.data.status_url;
+        await new Promise(resolve => setTimeout(resolve, pollIntervalMs));
+    }
+    
+    return { success: false, message: 'Timed out waiting for secret key generation' };
+}
+
+/**
+ * Get session secret key from server
+ */
+async function getSessionSecretKey() {
+    try {
+        const result = await fetchSessionKeyWithPolling();
+        
+        if (result.success) {
+            // Store in session storage
+            sessionStorage.setItem('abe_secret_key', JSON.stringify(result.data));
+            window.abeSystem.secretKey = result.data;
+            console.log('Session secret key retrieved:', result.source);
+            return result.data;
         }
-        throw new Error('Failed to get session secret key');
+        throw new Error(result.message || 'Failed to get session secret key');
     } catch (error) {
         console.error('Error getting session secret key:', error);
         return null;
@@ -252,5 +282,7 @@ function debugABESystem() {
 // Make functions globally available
 window.getSecretKey = getSecretKey;
 window.getPublicKey = getPublicKey;
+window.getPublicKeyUrl = getPublicKeyUrl;
 window.getSessionSecretKey = getSessionSecretKey;
+window.fetchSessionKeyWithPolling = fetchSessionKeyWithPolling;
 window.debugABESystem = debugABESystem; 
\ No newline at end of file
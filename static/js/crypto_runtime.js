@@ -0,0 +1,42 @@
+// Crypto runtime loader shared by the upload and record detail pages
+
+/**
+ * Boot configuration rendered by the page as #crypto-runtime-config (backend.crypto_runtime.get_runtime_config):
+ * the self-hosted, content-hashed bundle when one is built, otherwise the Pyodide CDN + charm wheel URL.
+ */
+function getCryptoRuntimeConfig() {
+    const element = document.getElementById('crypto-runtime-config');
+    if (!element) {
+        throw new Error('Thiếu cấu hình crypto runtime.');
+    }
+    return JSON.parse(element.textContent);
+}
+
+function registerCryptoRuntimeServiceWorker(config) {
+    if (!config.service_worker_url || !('serviceWorker' in navigator)) {
+        return;
+    }
+    navigator.serviceWorker.register(config.service_worker_url, { scope: '/' }).catch(error => {
+        console.log('Crypto runtime service worker registration failed:', error.message);
+    });
+}
+
+/**
+ * Load Pyodide and install charm. With a local bundle everything (stdlib, lockfile packages and
+ * wheels) comes from this server and, after the first visit, from the service worker cache.
+ */
+async function bootCryptoRuntime(options = {}) {
+    const config = getCryptoRuntimeConfig();
+    registerCryptoRuntimeServiceWorker(config);
+    
+    const pyodide = await loadPyodide({ indexURL: config.index_url, ...options });
+    
+    if (config.wheel_urls.length) {
+        await pyodide.loadPackage([...config.packages, ...config.wheel_urls]);
+    } else {
+        await pyodide.loadPackage('micropip');
+        const micropip = pyodide.pyimport('micropip');
+        await micropip.install(config.charm_wheel_url);
+    }
+    return pyodide;
+}
@@ -29,17 +29,11 @@ async function checkKeyStatus() {
             return;
         }
         
-        // Try to get key from server session
-        const response = await fetch('/api/abe/session-key/', {
-            method: 'GET',
-            headers: {
-                'X-CSRFToken': getCSRFToken(),
-                'Content-Type': 'application/json'
-            }
+        // Try to get key from server session (polls while the keygen job runs)
+        const data = await fetchSessionKeyWithPolling(() => {
+            updateKeyStatus('loading', 'Đang tạo Secret Key...');
         });
         
-        const data = await response.json();
-        
         if (data.success) {
             // Store in session storage
             sessionStorage.setItem('abe_secret_key', JSON.stringify(data.data));
@@ -161,7 +155,7 @@ async function refreshKey() {
  */
 async function showPublicKey() {
     try {
-        const response = await fetch('/api/abe/public-key/', {
+        const response = await fetch(getPublicKeyUrl(), {
             method: 'GET',
             headers: {
                 'X-CSRFToken': getCSRFToken(),
@@ -315,11 +309,68 @@ function showNotification(message, type = 'info') {
     }, 5000);
 }
 
+/*
+ * Bulk decryption of the current page: one request for the encrypted patient info of every row
+ * (/api/medical-records/encrypted/) and one Pyodide call for all AES keys (abe_bulk_decrypt.js).
+ */
+
+let dashboardPyodide = null;
+
+async function decryptDashboardPage() {
+    const button = document.getElementById('decrypt-page-btn');
+    const rows = Array.from(document.querySelectorAll('tr[data-record-id]'));
+    if (!rows.length) return;
+    
+    if (!getStoredABEKey()) {
+        showNotification('Chưa có Secret Key. Vui lòng làm mới key.', 'warning');
+        return;
+    }
+    
+    button.disabled = true;
+    button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Đang giải mã...';
+    
+    try {
+        const ids = rows.map(row => row.dataset.recordId);
+        const [response] = await Promise.all([
+            fetch(`/api/medical-records/encrypted/?ids=${ids.join(',')}&groups=patient_info`, {
+                headers: { 'X-CSRFToken': getCSRFToken() }
+            }),
+            dashboardPyodide ? Promise.resolve() : bootCryptoRuntime().then(pyodide => { dashboardPyodide = pyodide; }),
+        ]);
+        const result = await response.json();
+        if (!result.success) {
+            throw new Error(result.message);
+        }
+        
+        const decrypted = await bulkDecryptRecords(dashboardPyodide, result.data.records, ['patient_info']);
+        let count = 0;
+        for (const row of rows) {
+            const fields = decrypted[row.dataset.recordId];
+            const nameSpan = row.querySelector('.decrypted-patient-name');
+            if (fields && fields.patient_name !== undefined) {
+                nameSpan.textContent = `- ${fields.patient_name}`;
+                count++;
+            } else {
+                nameSpan.innerHTML = '<i class="fas fa-lock text-muted"></i>';
+            }
+        }
+        showNotification(`Đã giải mã ${count}/${rows.length} bản ghi`, 'success');
+        
+    } catch (error) {
+        console.error('Error decrypting dashboard page:', error);
+        showNotification('Lỗi khi giải mã: ' + error.message, 'danger');
+    } finally {
+        button.disabled = false;
+        button.innerHTML = '<i class="fas fa-unlock"></i> Giải mã tên bệnh nhân';
+    }
+}
+
 // Export functions for global use
 window.refreshKey = refreshKey;
 window.showPublicKey = showPublicKey;
 window.checkKeyStatus = checkKeyStatus;
 window.checkDecryptAccess = checkDecryptAccess; 
+window.decryptDashboardPage = decryptDashboardPage;
 
 // Helper function to get CSRF token
 function getCSRFToken() {
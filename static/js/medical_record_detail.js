@@ -85,17 +85,11 @@ async function initializeDecryptionSystem() {
         throw new Error('Không thể tải Pyodide. Vui lòng kiểm tra kết nối internet.');
     }
     
-    pyodideInstance = await loadPyodide({
+    pyodideInstance = await bootCryptoRuntime({
         stdout: (text) => console.log(`[Pyodide] ${text}`),
         stderr: (text) => console.error(`[Pyodide ERROR] ${text}`),
     });
 
-    await pyodideInstance.loadPackage("micropip");
-    const micropip = pyodideInstance.pyimport("micropip");
-    
-    const charmWheelURL = "https://quackusarle.github.io/charm_crypto_wheel_for_pyodide/charm_crypto-0.50-cp312-cp312-pyodide_2024_0_wasm32.whl";
-    await micropip.install(charmWheelURL);
-
     await pyodideInstance.runPythonAsync(`
 from charm.toolbox.pairinggroup import PairingGroup
 from charm.schemes.abenc.waters11 import Waters11
@@ -109,25 +103,74 @@ globals()['_waters11_group'] = group
     `);
 }
 
+/**
+ * Parse the binary record container returned by /api/medical-record/<id>/binary/:
+ *   magic "MDR1" | header_len (u32 BE) | header JSON
+ *   then per blob: name_len (u8) | name | data_len (u32 BE) | data
+ * Blob values are Uint8Array views over the response buffer (no copies, no base64).
+ */
+function parseRecordContainer(buffer) {
+    const view = new DataView(buffer);
+    const bytes = new Uint8Array(buffer);
+    const decoder = new TextDecoder('utf-8');
+    
+    if (decoder.decode(bytes.subarray(0, 4)) !== 'MDR1') {
+        throw new Error('Định dạng dữ liệu mã hóa không hợp lệ');
+    }
+    
+    let offset = 4;
+    const headerLength = view.getUint32(offset);
+    offset += 4;
+    const record = JSON.parse(decoder.decode(bytes.subarray(offset, offset + headerLength)));
+    offset += headerLength;
+    
+    while (offset < bytes.length) {
+        const nameLength = view.getUint8(offset);
+        offset += 1;
+        const name = decoder.decode(bytes.subarray(offset, offset + nameLength));
+        offset += nameLength;
+        const dataLength = view.getUint32(offset);
+        offset += 4;
+        record[name] = bytes.subarray(offset, offset + dataLength);
+        offset += dataLength;
+    }
+    
+    return record;
+}
+
 async function fetchEncryptedData() {
-    const response = await fetch(`/api/medical-record/${recordId}/`, {
+    const response = await fetch(`/api/medical-record/${recordId}/binary/`, {
         headers: { 'X-CSRFToken': getCSRFToken() }
     });
     
     if (!response.ok) {
-        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-    }
-    
-    const result = await response.json();
-    if (!result.success) {
-        throw new Error(result.message);
+        let message = `HTTP ${response.status}: ${response.statusText}`;
+        try {
+            message = (await response.json()).message || message;
+        } catch (e) {
+            // Non-JSON error body
+        }
+        throw new Error(message);
     }
     
-    encryptedData = result.data;
+    encryptedData = parseRecordContainer(await response.arrayBuffer());
     return encryptedData;
 }
 
-async function decryptCPABEKey(encryptedKeyBase64) {
+/**
+ * Accept either raw bytes (binary container) or a base64 string (legacy JSON API)
+ */
+function toArrayBuffer(value) {
+    if (value instanceof Uint8Array) {
+        return value;
+    }
+    if (value instanceof ArrayBuffer) {
+        return value;
+    }
+    return base64ToArrayBuffer(value);
+}
+
+async function decryptCPABEKey(encryptedKeyBlob) {
     const secretKeyStr = sessionStorage.getItem('abe_secret_key');
     if (!secretKeyStr) {
         throw new Error('Không tìm thấy khóa bí mật. Vui lòng đăng nhập lại.');
@@ -149,6 +192,9 @@ async function decryptCPABEKey(encryptedKeyBase64) {
     
     const attributeMapping = JSON.parse(attributeMappingStr);
     const nameToInt = attributeMapping.name_to_int;
+    
+    // The key blob is the ciphertext JSON; hand it to Python as text
+    pyodideInstance.globals.set('_ct_json_text', new TextDecoder('utf-8').decode(toArrayBuffer(encryptedKeyBlob)));
 
     // Decrypt in Python using the robust approach from the old file
     const result = await pyodideInstance.runPythonAsync(`
@@ -253,21 +299,7 @@ try:
             pk[key] = value
     
     # Reconstruct ciphertext
-    ct_str = "${encryptedKeyBase64}"
-    
-    # Fix base64 padding if needed
-    ct_str_fixed = ct_str
-    padding_needed = len(ct_str_fixed) % 4
-    if padding_needed:
-        ct_str_fixed += '=' * (4 - padding_needed)
-    
-    # Decode and parse ciphertext
-    try:
-        decoded_bytes = base64.b64decode(ct_str_fixed)
-        decoded_str = decoded_bytes.decode('utf-8')
-        ct_data = json.loads(decoded_str)
-    except Exception as decode_error:
-        raise decode_error
+    ct_data = json.loads(_ct_json_text)
     
     ct = {}
     non_crypto_fields = {'policy', 'attribute_list', '_key_verification'}
@@ -364,10 +396,10 @@ result
     return result;
 }
 
-async function decryptAESField(encryptedDataBase64, keyBase64, ivBase64) {
+async function decryptAESField(encryptedData, keyBase64, iv) {
     const keyBytes = base64ToArrayBuffer(keyBase64);
-    const ivBytes = base64ToArrayBuffer(ivBase64);
-    const encryptedBytes = base64ToArrayBuffer(encryptedDataBase64);
+    const ivBytes = toArrayBuffer(iv);
+    const encryptedBytes = toArrayBuffer(encryptedData);
     
     const cryptoKey = await crypto.subtle.importKey(
         'raw',
@@ -387,10 +419,148 @@ async function decryptAESField(encryptedDataBase64, keyBase64, ivBase64) {
     return decoder.decode(decryptedArrayBuffer);
 }
 
+/*
+ * Outsourced decryption: the secret key is blinded with 1/z (z random, kept in sessionStorage)
+ * and uploaded once as a transformation key. The server runs the Waters11 pairings with it and
+ * returns, per field group, (message, transformed); the AES key is SHA-256(message * transformed^z),
+ * one GT exponentiation here instead of a full decryption. The server never sees z.
+ */
+
+const TRANSFORM_KEY_STORAGE = 'abe_transform_key';
+
+async function sha256Hex(text) {
+    const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function createTransformKey(secretKeyStr, fingerprint) {
+    pyodideInstance.globals.set('_sk_json_text', secretKeyStr);
+    const blinded = JSON.parse(await pyodideInstance.runPythonAsync(`
+import base64
+import json
+from charm.toolbox.pairinggroup import ZR
+
+group = _waters11_group
+sk_data = json.loads(_sk_json_text)
+z = group.random(ZR)
+z_inverse = group.init(ZR, 1) / z
+
+def _blind(value):
+    if isinstance(value, dict):
+        return {k: _blind(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_blind(item) for item in value]
+    if isinstance(value, str):
+        element = group.deserialize(base64.b64decode(value))
+        return base64.b64encode(group.serialize(element ** z_inverse)).decode('utf-8')
+    return value
+
+components = sk_data.get('secret_key', sk_data)
+json.dumps({
+    'transform_key': _blind({k: v for k, v in components.items() if k != 'attr_list'}),
+    'blinding': base64.b64encode(group.serialize(z)).decode('utf-8'),
+})
+    `));
+    
+    const response = await fetch('/api/abe/transform-key/', {
+        method: 'POST',
+        headers: {
+            'X-CSRFToken': getCSRFToken(),
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ transform_key: blinded.transform_key })
+    });
+    const result = await response.json();
+    if (!response.ok || !result.success) {
+        throw new Error(result.message || `HTTP ${response.status}`);
+    }
+    
+    const transformKey = {
+        key_id: result.data.key_id,
+        blinding: blinded.blinding,
+        secret_key_fingerprint: fingerprint
+    };
+    sessionStorage.setItem(TRANSFORM_KEY_STORAGE, JSON.stringify(transformKey));
+    return transformKey;
+}
+
+async function getTransformKey(forceNew = false) {
+    const secretKeyStr = sessionStorage.getItem('abe_secret_key');
+    if (!secretKeyStr) {
+        throw new Error('Không tìm thấy khóa bí mật. Vui lòng đăng nhập lại.');
+    }
+    
+    // A transformation key is only valid for the secret key it was blinded from
+    const fingerprint = await sha256Hex(secretKeyStr);
+    const stored = JSON.parse(sessionStorage.getItem(TRANSFORM_KEY_STORAGE) || 'null');
+    if (!forceNew && stored && stored.secret_key_fingerprint === fingerprint) {
+        return stored;
+    }
+    return createTransformKey(secretKeyStr, fingerprint);
+}
+
+/**
+ * Ask the server to transform both AES key ciphertexts of the record.
+ * Returns { data: {patient_info, medical_record}, blinding } or null to fall back to local decryption.
+ */
+async function fetchTransformedKeys() {
+    try {
+        for (let attempt = 0; attempt < 2; attempt++) {
+            const transformKey = await getTransformKey(attempt > 0);
+            const response = await fetch(
+                `/api/medical-record/${recordId}/transform/?key_id=${encodeURIComponent(transformKey.key_id)}`,
+                { headers: { 'X-CSRFToken': getCSRFToken() } }
+            );
+            if (response.status === 409) {
+                continue;  // Unknown or outdated transformation key: blind a new one
+            }
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+            }
+            const result = await response.json();
+            return { data: result.data, blinding: transformKey.blinding };
+        }
+        throw new Error('Transformation key was rejected');
+    } catch (error) {
+        console.log('Outsourced decryption unavailable, decrypting locally:', error.message);
+        return null;
+    }
+}
+
+async function finishOutsourcedDecryption(transformed, blinding) {
+    pyodideInstance.globals.set('_ot_message', transformed.message);
+    pyodideInstance.globals.set('_ot_transformed', transformed.transformed);
+    pyodideInstance.globals.set('_ot_blinding', blinding);
+    return pyodideInstance.runPythonAsync(`
+import base64
+import hashlib
+
+group = _waters11_group
+z = group.deserialize(base64.b64decode(_ot_blinding))
+message = group.deserialize(base64.b64decode(_ot_message)) * (group.deserialize(base64.b64decode(_ot_transformed)) ** z)
+base64.b64encode(hashlib.sha256(group.serialize(message)).digest()).decode('utf-8')
+    `);
+}
+
+/**
+ * AES key (base64) of a field group ('patient_info' | 'medical_record'): outsourced when the
+ * server transformed it, otherwise full Waters11 decryption in Pyodide.
+ */
+async function decryptGroupKey(prefix, transformedKeys) {
+    if (transformedKeys) {
+        const transformed = transformedKeys.data[prefix];
+        if (!transformed) {
+            throw new Error('Bạn không có đủ quyền để truy cập dữ liệu này. Policy không được thỏa mãn với các thuộc tính hiện tại của bạn.');
+        }
+        return finishOutsourcedDecryption(transformed, transformedKeys.blinding);
+    }
+    return decryptCPABEKey(encryptedData[`${prefix}_aes_key_blob`]);
+}
+
 async function performDecryption() {
     try {
         await initializeDecryptionSystem();
-        await fetchEncryptedData();
+        const [, transformedKeys] = await Promise.all([fetchEncryptedData(), fetchTransformedKeys()]);
         
         const decryptedFields = {};
         let patientDataDecrypted = false;
@@ -398,7 +568,7 @@ async function performDecryption() {
         
         // Try to decrypt patient info
         try {
-            const patientKeyBase64 = await decryptCPABEKey(encryptedData.patient_info_aes_key_blob);
+            const patientKeyBase64 = await decryptGroupKey('patient_info', transformedKeys);
             
             const patientFields = ['patient_name', 'patient_age', 'patient_gender', 'patient_phone'];
             for (const field of patientFields) {
@@ -422,7 +592,7 @@ async function performDecryption() {
         
         // Try to decrypt medical record
         try {
-            const medicalKeyBase64 = await decryptCPABEKey(encryptedData.medical_record_aes_key_blob);
+            const medicalKeyBase64 = await decryptGroupKey('medical_record', transformedKeys);
             
             const medicalFields = ['chief_complaint', 'past_medical_history', 'diagnosis', 'status'];
             for (const field of medicalFields) {
@@ -111,17 +111,11 @@ async function initializeSystem() {
 }
 
 async function initializePyodideAndCharm() {
-    pyodideInstance = await loadPyodide({
+    pyodideInstance = await bootCryptoRuntime({
         stdout: (text) => console.log(`[Pyodide] ${text}`),
         stderr: (text) => console.error(`[Pyodide ERROR] ${text}`),
     });
 
-    await pyodideInstance.loadPackage("micropip");
-    const micropip = pyodideInstance.pyimport("micropip");
-    
-    const charmWheelURL = "https://quackusarle.github.io/charm_crypto_wheel_for_pyodide/charm_crypto-0.50-cp312-cp312-pyodide_2024_0_wasm32.whl";
-    await micropip.install(charmWheelURL);
-
     // Get public key from session storage
     const publicKeyDataStr = sessionStorage.getItem('abe_public_key');
     if (!publicKeyDataStr) {
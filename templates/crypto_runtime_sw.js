@@ -0,0 +1,49 @@
+// Service worker: precache the self-hosted crypto runtime bundle (Pyodide + charm wheels)
+// and serve it cache-first. Rendered by crypto_runtime_service_worker with the current bundle.
+const RUNTIME = {{ runtime_json|safe }};
+const CACHE_PREFIX = 'crypto-runtime-';
+const CACHE_NAME = CACHE_PREFIX + RUNTIME.version;
+
+self.addEventListener('install', (event) => {
+    event.waitUntil((async () => {
+        if (RUNTIME.version) {
+            const cache = await caches.open(CACHE_NAME);
+            await cache.addAll(RUNTIME.urls);
+        }
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil((async () => {
+        // Bundles are immutable: drop caches of previous bundle versions
+        const cacheNames = await caches.keys();
+        await Promise.all(
+            cacheNames
+                .filter(name => name.startsWith(CACHE_PREFIX) && name !== CACHE_NAME)
+                .map(name => caches.delete(name))
+        );
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener('fetch', (event) => {
+    const url = new URL(event.request.url);
+    if (!RUNTIME.prefix || event.request.method !== 'GET' ||
+        url.origin !== self.location.origin || !url.pathname.startsWith(RUNTIME.prefix)) {
+        return;  // Everything else goes to the network untouched
+    }
+    
+    event.respondWith((async () => {
+        const cached = await caches.match(event.request, { ignoreSearch: true });
+        if (cached) {
+            return cached;
+        }
+        const response = await fetch(event.request);
+        if (response.ok && url.pathname.startsWith(`${RUNTIME.prefix}${RUNTIME.version}/`)) {
+            const cache = await caches.open(CACHE_NAME);
+            await cache.put(event.request, response.clone());
+        }
+        return response;
+    })());
+});